@@ -2,7 +2,8 @@
 import sys
 import uuid
 import argparse
-import requests
+from service_registry.api.auth import issue_heartbeat_tokens
+from service_registry.api.registration import parse_registrations, register_urls, validate_url, validate_urls
 from service_registry.orm.models import URL
 from service_registry.orm import init_db, get_session
 
@@ -14,15 +15,31 @@ def main(args=None):
 
     parser = argparse.ArgumentParser('Run service registry')
     parser.add_argument('--database', default="./data/services.sqlite")
-    parser.add_argument('name', type=str)
-    parser.add_argument('url', type=str)
+    parser.add_argument('--database-uri', default=None,
+                        help='SQLAlchemy URI of the database, e.g. postgresql://...; overrides --database')
+    parser.add_argument('--file', default=None,
+                        help='Register every service in this CSV (name,url) or JSONL file; - reads stdin')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Maximum number of URLs validated at once with --file')
+    parser.add_argument('--no-validate', action='store_true', default=False,
+                        help='Register URLs without first checking they can be connected to')
+    parser.add_argument('name', type=str, nargs='?')
+    parser.add_argument('url', type=str, nargs='?')
     args = parser.parse_args(args)
 
-    if not validate_url(args.url):
+    if args.file:
+        if args.name or args.url:
+            parser.error('give either --file or a name and url')
+        add_services(args)
+        return
+    if not args.url:
+        parser.error('a name and url, or --file, are required')
+
+    if not args.no_validate and not validate_url(args.url):
         print(f"{args.url} validation failed", file=sys.stderr, flush=True)
         sys.exit(1)
 
-    init_db(uri="sqlite:///"+args.database)
+    init_db(uri=args.database_uri or "sqlite:///"+args.database)
     db_session = get_session()
 
     if URL().query.filter_by(url=args.url).scalar():
@@ -31,30 +48,45 @@ def main(args=None):
 
     new_url = URL(url=args.url, name=args.name, id=uuid.uuid4())
     db_session.add(new_url)
+    token, = issue_heartbeat_tokens(db_session, [new_url])
     db_session.commit()
+    print(f"{args.url} added as {new_url.id}, heartbeat token {token}", flush=True)
 
 
-def validate_url(url):
+def add_services(args):
     """
-    Return True iff <url> is a valid URL address that can be connected to.
-
-    :param url: URL address to be validated
-    :return: bool
+    Register the services listed in args.file, validating their URLs
+    concurrently and storing them in a single transaction
     """
-    valid = False
     try:
-        requests.get(url, timeout=5)
-        valid = True
-    except requests.exceptions.Timeout as e:
-        print("Timeout occurred", file=sys.stderr, flush=True)
-        print(e, file=sys.stderr, flush=True)
-    except requests.ConnectionError as e:
-        print("Unable to connect", file=sys.stderr, flush=True)
-        print(e, file=sys.stderr, flush=True)
-    except (requests.RequestException, Exception) as e:
-        print(e, file=sys.stderr, flush=True)
-
-    return valid
+        if args.file == '-':
+            registrations = parse_registrations(sys.stdin.readlines())
+        else:
+            with open(args.file) as registration_file:
+                registrations = parse_registrations(registration_file.readlines())
+    except (OSError, ValueError) as e:
+        print(f"Could not read {args.file}: {e}", file=sys.stderr, flush=True)
+        sys.exit(1)
+
+    invalid = []
+    if not args.no_validate:
+        valid = validate_urls([url for _, url in registrations], max_workers=args.concurrency)
+        invalid = [url for (_, url), ok in zip(registrations, valid) if not ok]
+        registrations = [registration for registration, ok in zip(registrations, valid) if ok]
+        for url in invalid:
+            print(f"{url} validation failed", file=sys.stderr, flush=True)
+
+    init_db(uri=args.database_uri or "sqlite:///"+args.database)
+    added, existing, tokens = register_urls(get_session(), registrations)
+    for url in existing:
+        print(f"{url} already exists in database", file=sys.stderr, flush=True)
+    for url_orm, token in zip(added, tokens):
+        print(f"{url_orm.url} added as {url_orm.id}, heartbeat token {token}", flush=True)
+
+    print(f"Added {len(added)} services; {len(existing)} already registered, {len(invalid)} failed validation",
+          flush=True)
+    if invalid:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
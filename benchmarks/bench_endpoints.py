@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the registry's endpoints against simulated peers.
+
+Starts --peers fake GA4GH services on localhost, each on its own port and
+answering after --peer-latency seconds (+/- --peer-jitter), failing with
+a 500 at --peer-error-rate and padding its service-info by
+--peer-payload bytes.  Registers them in a scratch SQLite database, starts
+the registry (with any --server-arg), waits for the first poll and then,
+for each endpoint, drives it from --clients keep-alive connections for
+--duration seconds after a --warmup, reporting throughput and latency
+percentiles.  Runs offline:
+
+    python3 benchmarks/bench_endpoints.py --output before.json
+    python3 benchmarks/bench_endpoints.py --baseline before.json
+
+Peer behaviour is seeded, and the parameters, commit and environment are
+saved with the results, so runs on the same machine can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import harness
+
+ENDPOINTS = ('services', 'service', 'types')
+
+
+def endpoint_paths(endpoint, ids):
+    """Paths requested, in turn, when benchmarking endpoint"""
+    if endpoint == 'services':
+        return ['/services']
+    if endpoint == 'service':
+        return [f'/services/{service_id}' for service_id in ids]
+    return ['/services/types']
+
+
+def git_commit():
+    """The commit being benchmarked, if known"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(latencies, errors, duration):
+    """Throughput and latency percentiles, in milliseconds, of one endpoint's run"""
+    summary = {'requests': len(latencies), 'errors': errors, 'rps': round(len(latencies) / duration, 1)}
+    for pct in (50, 95, 99):
+        value = harness.percentile(latencies, pct)
+        summary[f'p{pct}_ms'] = round(value * 1000, 3) if value is not None else None
+    return summary
+
+
+def print_results(results, baseline=None):
+    """Print a table of results, with the change from baseline's if given"""
+    columns = ('rps', 'p50_ms', 'p95_ms', 'p99_ms')
+    print(f'{"endpoint":>10} {"requests":>9} {"errors":>7} ' + ' '.join(f'{column:>16}' for column in columns))
+    for endpoint, summary in results.items():
+        cells = []
+        for column in columns:
+            value = summary[column]
+            cell = '-' if value is None else f'{value:.1f}'
+            before = (baseline or {}).get(endpoint, {}).get(column)
+            if value is not None and before:
+                cell += f' ({(value - before) / before:+.0%})'
+            cells.append(f'{cell:>16}')
+        print(f'{endpoint:>10} {summary["requests"]:>9} {summary["errors"]:>7} ' + ' '.join(cells), flush=True)
+
+
+def main(args=None):
+    """Run the benchmark, printing a table and optionally saving the results"""
+    parser = argparse.ArgumentParser('Benchmark service registry endpoints')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--peers', type=int, default=20)
+    parser.add_argument('--peer-latency', type=float, default=0.02, help='Seconds each peer takes to respond')
+    parser.add_argument('--peer-jitter', type=float, default=0.0, help='Random +/- seconds on each response')
+    parser.add_argument('--peer-error-rate', type=float, default=0.0, help='Fraction of peer responses failing')
+    parser.add_argument('--peer-payload', type=int, default=0, help='Extra bytes in each service-info')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--port', type=int, default=3999)
+    parser.add_argument('--server-arg', action='append', default=[],
+                        help='Argument passed on to the registry, e.g. --server-arg=--poll-interval=0')
+    parser.add_argument('--output', help='Save the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare with the results saved in this file')
+    args = parser.parse_args(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f'baseline: commit {baseline.get("commit")}, {baseline.get("parameters")}')
+
+    urls = harness.start_peers(args.peers, seed=args.seed, latency=args.peer_latency, jitter=args.peer_jitter,
+                               error_rate=args.peer_error_rate, payload_size=args.peer_payload)
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        database = os.path.join(scratch, 'services.sqlite')
+        ids = harness.seed_database(database, urls)
+
+        with harness.registry(database, args.port, args.server_arg):
+            harness.wait_until_polled(args.port)
+            for endpoint in args.endpoints:
+                paths = endpoint_paths(endpoint, ids)
+                if args.warmup > 0:
+                    harness.drive(args.port, paths, args.clients, args.warmup)
+                latencies, errors = harness.drive(args.port, paths, args.clients, args.duration)
+                results[endpoint] = summarize(latencies, errors, args.duration)
+
+    print_results(results, baseline and baseline.get('results'))
+    if args.output:
+        parameters = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')}
+        with open(args.output, 'w') as output_file:
+            json.dump({'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': sys.version.split()[0], 'platform': platform.platform(),
+                       'cpus': os.cpu_count(), 'parameters': parameters, 'results': results},
+                      output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
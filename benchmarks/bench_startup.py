@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the registry's start-up time.
+
+Starts the registry --runs times per scenario, with any --server-arg,
+timing each from launching the process to its first answer to
+/service-info.  A cold start is against a new database, with nothing
+cached in the registry's working directory; a warm start is a restart
+against the database and working directory the previous run left, as when
+a pod is restarted with its volume.  Runs offline:
+
+    python3 benchmarks/bench_startup.py --output before.json
+    python3 benchmarks/bench_startup.py --baseline before.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import harness
+from bench_endpoints import git_commit
+
+SCENARIOS = ('cold', 'warm')
+
+
+def start_seconds(directory, port, args):
+    """Seconds the registry run from directory takes to answer its first request"""
+    start = time.perf_counter()
+    with harness.registry(os.path.join(directory, 'data', 'services.sqlite'), port, args, cwd=directory):
+        harness.wait_until_up(port)
+        return time.perf_counter() - start
+
+
+def summarize(seconds):
+    """Median, fastest and slowest start-up times, in milliseconds"""
+    return {'runs': len(seconds), 'median_ms': round(statistics.median(seconds) * 1000, 1),
+            'min_ms': round(min(seconds) * 1000, 1), 'max_ms': round(max(seconds) * 1000, 1)}
+
+
+def print_results(results, baseline=None):
+    """Print a table of results, with the change from baseline's if given"""
+    columns = ('median_ms', 'min_ms', 'max_ms')
+    print(f'{"scenario":>10} {"runs":>5} ' + ' '.join(f'{column:>16}' for column in columns))
+    for scenario, summary in results.items():
+        cells = []
+        for column in columns:
+            cell = f'{summary[column]:.1f}'
+            before = (baseline or {}).get(scenario, {}).get(column)
+            if before:
+                cell += f' ({(summary[column] - before) / before:+.0%})'
+            cells.append(f'{cell:>16}')
+        print(f'{scenario:>10} {summary["runs"]:>5} ' + ' '.join(cells), flush=True)
+
+
+def main(args=None):
+    """Run the benchmark, printing a table and optionally saving the results"""
+    parser = argparse.ArgumentParser('Benchmark service registry start-up')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--port', type=int, default=3999)
+    parser.add_argument('--server-arg', action='append', default=[],
+                        help='Argument passed on to the registry, e.g. --server-arg=--server=aiohttp')
+    parser.add_argument('--output', help='Save the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare with the results saved in this file')
+    args = parser.parse_args(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f'baseline: commit {baseline.get("commit")}, {baseline.get("parameters")}')
+
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = os.path.join(scratch, 'registry')
+        for scenario in args.scenarios:
+            seconds = []
+            # warm starts follow a first, untimed start
+            for run in range(args.runs + (scenario == 'warm')):
+                if scenario == 'cold' or run == 0:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    os.makedirs(os.path.join(directory, 'data'))
+                    os.makedirs(os.path.join(directory, 'log'))
+                elapsed = start_seconds(directory, args.port, args.server_arg)
+                if scenario == 'cold' or run > 0:
+                    seconds.append(elapsed)
+            results[scenario] = summarize(seconds)
+
+    print_results(results, baseline and baseline.get('results'))
+    if args.output:
+        parameters = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')}
+        with open(args.output, 'w') as output_file:
+            json.dump({'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': sys.version.split()[0], 'platform': platform.platform(),
+                       'cpus': os.cpu_count(), 'parameters': parameters, 'results': results},
+                      output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
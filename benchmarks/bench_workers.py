@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Benchmark of GET /services throughput against the number of --workers.
+
+Registers --peers fake services, served locally by harness.py, in a scratch
+database, then for each worker count starts the registry, waits for the
+first poll to land in the shared snapshot and drives it from --clients
+keep-alive connections for --duration seconds.  Runs offline:
+
+    python3 benchmarks/bench_workers.py --workers 1 2 4
+"""
+import argparse
+import os
+import tempfile
+
+import harness
+
+
+def main(args=None):
+    """Run the benchmark and print a table of requests per second"""
+    parser = argparse.ArgumentParser('Benchmark service registry worker scaling')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--peers', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=3999)
+    parser.add_argument('--path', default='/services')
+    args = parser.parse_args(args)
+
+    urls = harness.start_peers(args.peers)
+    with tempfile.TemporaryDirectory() as scratch:
+        database = os.path.join(scratch, 'services.sqlite')
+        harness.seed_database(database, urls)
+
+        print(f'{"workers":>8} {"requests":>9} {"errors":>7} {"req/s":>9}')
+        for workers in args.workers:
+            with harness.registry(database, args.port, ['--workers', str(workers), '--poll-interval', '30']):
+                harness.wait_until_polled(args.port)
+                latencies, errors = harness.drive(args.port, [args.path], args.clients, args.duration)
+            completed = len(latencies)
+            print(f'{workers:>8} {completed:>9} {errors:>7} {completed / args.duration:>9.1f}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
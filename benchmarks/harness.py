@@ -0,0 +1,223 @@
+"""
+Pieces shared by the benchmarks: fake GA4GH peers, a seeded scratch
+database, a registry server run in a subprocess and a keep-alive load
+generator.  Everything runs on localhost, so the benchmarks work offline.
+"""
+import http.client
+import json
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import service_registry.orm
+from service_registry.orm.models import URL
+
+
+class PeerHandler(BaseHTTPRequestHandler):
+    """
+    Answers service-info and cohorts as a fake peer, at any path prefix,
+    after the server's latency and failing at its error rate
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve a fake GA4GH service-info or cohorts document"""
+        peer = self.server.peer
+        time.sleep(peer.delay())
+        name, _, document = self.path.strip('/').rpartition('/')
+        name = name or peer.name
+        if peer.fails():
+            self.send_error(500)
+            return
+        if document == 'service-info':
+            body = {'id': name, 'name': name, 'description': 'Benchmark peer' + 'x' * peer.payload_size,
+                    'version': '1.0',
+                    'type': {'group': 'org.ga4gh', 'artifact': peer.artifact, 'version': '1.0.0'},
+                    'organization': {'name': 'Bench', 'url': 'https://bench.example'},
+                    'contactUrl': 'mailto:bench@bench.example', 'documentationUrl': 'https://bench.example',
+                    'createdAt': '2020-01-01T00:00:00Z', 'updatedAt': '2020-01-01T00:00:00Z',
+                    'environment': 'test'}
+        elif document == 'cohorts':
+            body = [{'id': 'cohort'}]
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class FakePeer():
+    """
+    One fake peer's behaviour: latency seconds (+/- jitter) per response,
+    error_rate of responses failing with a 500, and payload_size extra
+    bytes in its service-info.  Random choices are seeded, for repeatability.
+    """
+    def __init__(self, name, latency=0.0, jitter=0.0, error_rate=0.0, payload_size=0, artifact='beacon', seed=0):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.payload_size = payload_size
+        self.artifact = artifact
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Seconds to wait before this response"""
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def fails(self):
+        """Whether this response is an error"""
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+
+def start_peer(peer):
+    """Serve peer from a thread on a free localhost port, returning its base URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PeerHandler)
+    server.daemon_threads = True
+    server.peer = peer
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def start_peers(npeers, artifacts=('beacon', 'drs', 'htsget'), seed=0, **behaviour):
+    """
+    Start npeers FakePeers, each on its own port, with the given
+    behaviour and artifacts in turn; returns their base URLs
+    """
+    return [start_peer(FakePeer(f'peer{i}', artifact=artifacts[i % len(artifacts)], seed=seed + i, **behaviour))
+            for i in range(npeers)]
+
+
+def seed_database(path, urls):
+    """
+    Create a registry database at path with urls registered, returning
+    their service IDs in the same order
+    """
+    service_registry.orm.init_db('sqlite:///' + path)
+    db_session = service_registry.orm.get_session()
+    url_orms = [URL(id=uuid.UUID(int=i + 1), name=f'peer{i}', url=url) for i, url in enumerate(urls)]
+    db_session.add_all(url_orms)
+    db_session.commit()
+    ids = [str(url_orm.id) for url_orm in url_orms]
+    db_session.remove()
+    return ids
+
+
+@contextmanager
+def registry(database, port, args=(), logfile=None, cwd=None):
+    """
+    Run the registry on port against database, with extra command line
+    args, from the directory cwd, for the duration of the context
+    """
+    logfile = logfile or os.path.join(os.path.dirname(database), 'services.log')
+    server = subprocess.Popen([sys.executable, '-m', 'service_registry', '--database', database,
+                               '--logfile', logfile, '--host', '127.0.0.1', '--port', str(port)] + list(args),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+                              cwd=cwd)
+    try:
+        yield server
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+
+def wait_until_up(port, path='/service-info', timeout=60, interval=0.01):
+    """Wait for the server to answer path, checking every interval seconds"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(interval)
+    raise RuntimeError('server did not come up')
+
+
+def wait_until_polled(port, timeout=60):
+    """Wait for the server to answer /services from a completed poll"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/services')
+            response = connection.getresponse()
+            body = response.read()
+            if response.status == 200 and json.loads(body):
+                return
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('server did not come up')
+
+
+def drive(port, paths, clients, duration):
+    """
+    GET paths, in turn, from clients keep-alive connections for duration
+    seconds; returns (list of seconds taken by each successful request,
+    number of errors)
+    """
+    results = [([], [0]) for _ in range(clients)]
+    stop = time.monotonic() + duration
+
+    def client(index, latencies, errors):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        request_number = index
+        while time.monotonic() < stop:
+            path = paths[request_number % len(paths)]
+            request_number += clients
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                if response.status == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors[0] += 1
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+
+    threads = [threading.Thread(target=client, args=(index, latencies, errors))
+               for index, (latencies, errors) in enumerate(results)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [latency for latencies, _ in results for latency in latencies], sum(errors[0] for _, errors in results)
+
+
+def percentile(values, pct):
+    """The pct'th percentile of values by nearest rank, or None if there are none"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
@@ -2,14 +2,25 @@
 """
 Driver program for service
 """
+import os
 import sys
 import argparse
-from distutils import util
 import logging
-import pkg_resources
 import connexion
+from connexion.resolver import Resolver
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
 from tornado.options import define
+from tornado.process import fork_processes, task_id
+from tornado.web import Application, FallbackHandler
+from tornado.wsgi import WSGIContainer
 import service_registry.orm
+from service_registry import tracing
+from service_registry.api import client, operations, poller, upstream, watch
+from service_registry.api.logging import DEFAULT_LOG_FIELDS, QueueLogHandler, configure_apilog
+from service_registry.api.spec import CachedSpec
+from service_registry.api.validation import SampledResponseValidator, configure_validation
 
 
 def main(args=None):
@@ -19,44 +30,208 @@ def main(args=None):
 
     parser = argparse.ArgumentParser('Run service registry')
     parser.add_argument('--database', default="./data/services.sqlite")
+    parser.add_argument('--database-uri', default=None,
+                        help='SQLAlchemy URI of the database, e.g. postgresql://...; overrides --database')
     parser.add_argument('--host', default="localhost")
-    parser.add_argument('--port', default=3000)
+    parser.add_argument('--port', type=int, default=3000)
     parser.add_argument('--logfile', default="./log/services.log")
     parser.add_argument('--loglevel', default='INFO',
                         choices=['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'])
+    parser.add_argument('--log-sample-rate', type=float, default=1.0,
+                        help='Fraction of API calls logged; calls failing with server errors are always logged')
+    parser.add_argument('--log-fields', default=','.join(DEFAULT_LOG_FIELDS),
+                        help='Comma-separated fields logged for each API call; headers and data can be added')
+    parser.add_argument('--trace-file', default=None,
+                        help='Trace requests, writing their spans to this file as JSON lines')
+    parser.add_argument('--trace-sample-rate', type=float, default=1.0,
+                        help='Fraction of requests traced, unless the caller sent a traceparent header')
+    parser.add_argument('--response-validation-rate', type=float, default=1.0,
+                        help='Fraction of API responses validated against the spec; 0 validates none')
+    parser.add_argument('--spec-cache', default="./data/spec-cache.json",
+                        help='File the validated API spec is cached in as JSON, for faster restarts; empty for none')
     parser.add_argument('--remove-active', action='store_true', default=False)
+    parser.add_argument('--admin-token', default=os.environ.get('SERVICE_REGISTRY_ADMIN_TOKEN'),
+                        help='Bearer token required to register services through the API; '
+                             'defaults to $SERVICE_REGISTRY_ADMIN_TOKEN, and if unset registration is refused')
+    parser.add_argument('--heartbeat-lease', type=float, default=90.0,
+                        help='Seconds a heartbeat keeps a service active without it being polled')
+    parser.add_argument('--server', default='tornado', choices=['tornado', 'aiohttp'],
+                        help='HTTP server; aiohttp contacts services without blocking (requires aiohttp)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of pre-forked tornado server processes; 0 starts one per CPU')
+    parser.add_argument('--fetch-concurrency', type=int, default=16,
+                        help='Maximum number of services contacted at once')
+    parser.add_argument('--fetch-deadline', type=float, default=5.0,
+                        help='Maximum seconds spent contacting services per request')
+    parser.add_argument('--poll-interval', type=float, default=30.0,
+                        help='Seconds between background polls of services; 0 contacts them on every request')
+    parser.add_argument('--health-retention', type=float, default=7.0,
+                        help='Days of service health history kept; 0 keeps all')
+    parser.add_argument('--cache-ttl', type=float, default=10.0,
+                        help='Seconds to cache service-info and cohorts responses of services')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Maximum number of cached service responses')
+    parser.add_argument('--http-pool-size', type=int, default=10,
+                        help='Keep-alive connections kept open per service host, and the most opened to it at once')
+    parser.add_argument('--connect-timeout', type=float, default=1.0,
+                        help='Seconds to wait when connecting to a service')
+    parser.add_argument('--read-timeout', type=float, default=1.0,
+                        help='Seconds to wait for a service to respond once connected')
+    parser.add_argument('--breaker-threshold', type=int, default=3,
+                        help='Consecutive failures after which a service is skipped for a while; 0 never skips')
+    parser.add_argument('--breaker-backoff', type=float, default=5.0,
+                        help='Seconds a failing service is first skipped for, doubling while it keeps failing')
+    parser.add_argument('--breaker-max-backoff', type=float, default=300.0,
+                        help='Maximum seconds a failing service is skipped for')
+    parser.add_argument('--sqlite-profile', default='performance',
+                        choices=sorted(service_registry.orm.SQLITE_PROFILES),
+                        help='Tuning of SQLite connections; none keeps SQLite defaults')
+    parser.add_argument('--db-pool-size', type=int, default=5,
+                        help='Database connections kept open for reuse')
+    parser.add_argument('--db-max-overflow', type=int, default=10,
+                        help='Database connections opened beyond the pool size under load')
+    parser.add_argument('--db-statement-timeout', type=float, default=30.0,
+                        help='Seconds after which PostgreSQL cancels a statement; 0 for no limit')
+    parser.add_argument('--guid-storage', default=None, choices=['binary', 'char'],
+                        help='Storage of IDs in databases other than PostgreSQL, converting existing SQLite '
+                             'databases; by default existing databases keep theirs, and new ones are binary')
     args = parser.parse_args(args)
+    if args.workers != 1 and args.server != 'tornado':
+        parser.error('--workers is only supported with the tornado server')
+    try:
+        configure_apilog(sample_rate=args.log_sample_rate,
+                         fields=[field.strip() for field in args.log_fields.split(',') if field.strip()])
+    except ValueError as e:
+        parser.error(str(e))
+    configure_validation(args.response_validation_rate)
+    validate_responses = args.response_validation_rate > 0
 
     # set up the application
-    app = connexion.FlaskApp(__name__, server='tornado')
+    if args.server == 'aiohttp':
+        # optional dependency, only imported when asked for
+        from service_registry.api import aio_db, aio_operations, aio_upstream  # pylint: disable=import-outside-toplevel
+        app = connexion.AioHttpApp('service_registry', only_one_api=True)
+    else:
+        app = connexion.FlaskApp(__name__, server='tornado')
     define("dbfile", default=args.database)
     define("host", args.host)
     define("port", args.port)
     define("remove_active_status", args.remove_active)
-    service_registry.orm.init_db()
-    db_session = service_registry.orm.get_session()
-
-    @app.app.teardown_appcontext
-    def shutdown_session(exception=None):  # pylint:disable=unused-variable,unused-argument
-        """
-        Tear down the DB session
-        """
-        db_session.remove()
+    define("admin_token", args.admin_token)
+    define("heartbeat_lease", args.heartbeat_lease)
+    define("fetch_concurrency", args.fetch_concurrency)
+    define("fetch_deadline", args.fetch_deadline)
+    define("poll_interval", args.poll_interval)
+    define("health_retention", args.health_retention)
+    if args.trace_file:
+        tracing.configure(args.trace_file, sample_rate=args.trace_sample_rate)
+    try:
+        service_registry.orm.init_db(uri=args.database_uri, sqlite_profile=args.sqlite_profile,
+                                     pool_size=args.db_pool_size, max_overflow=args.db_max_overflow,
+                                     statement_timeout=args.db_statement_timeout, guid_storage=args.guid_storage)
+    except ValueError as e:
+        parser.error(str(e))
+    upstream.CACHE.configure(maxsize=args.cache_size, ttl=args.cache_ttl)
+    client.init_client(pool_size=args.http_pool_size, connect_timeout=args.connect_timeout,
+                       read_timeout=args.read_timeout)
+    upstream.BREAKERS.configure(failure_threshold=args.breaker_threshold, backoff=args.breaker_backoff,
+                                max_backoff=args.breaker_max_backoff)
 
     # configure logging
-    log_handler = logging.FileHandler(args.logfile)
     numeric_loglevel = getattr(logging, args.loglevel.upper())
+    file_handler = logging.FileHandler(args.logfile)
+    file_handler.setLevel(numeric_loglevel)
+    # written from a background thread, so requests don't wait on the file
+    log_handler = QueueLogHandler(file_handler)
     log_handler.setLevel(numeric_loglevel)
 
-    app.app.logger.addHandler(log_handler)
-    app.app.logger.setLevel(numeric_loglevel)
+    api_def = CachedSpec(cache_path=args.spec_cache)
+
+    if args.server == 'aiohttp':
+        service_registry.orm.get_session(scopefunc=aio_db.session_scope)
+        aio_db.configure(max_workers=args.db_pool_size + args.db_max_overflow)
+        app.app.middlewares.append(aio_operations.remove_sessions)
+        app.app.on_cleanup.append(aio_upstream.close_client)
+
+        app_logger = logging.getLogger('service_registry')
+        app_logger.addHandler(log_handler)
+        app_logger.setLevel(numeric_loglevel)
+
+        # add the swagger APIs, served by the coroutines in aio_operations
+        with api_def.trusted():
+            app.add_api(api_def.spec, strict_validation=True, validate_responses=validate_responses,
+                        validator_map={'response': SampledResponseValidator},
+                        resolver=Resolver(aio_operations.resolve), pass_context_arg_name='request')
+    else:
+        service_registry.orm.get_session()
+
+        @app.app.teardown_appcontext
+        def shutdown_session(exception=None):  # pylint:disable=unused-variable,unused-argument
+            """
+            Tear down the DB sessions
+            """
+            service_registry.orm.remove_sessions()
+
+        app.app.logger.addHandler(log_handler)
+        app.app.logger.setLevel(numeric_loglevel)
+
+        # add the swagger APIs
+        with api_def.trusted():
+            app.add_api(api_def.spec, strict_validation=True, validate_responses=validate_responses,
+                        validator_map={'response': SampledResponseValidator})
+    api_def.save()
+
+    # serve the last known state of the services until they are polled
+    if args.poll_interval > 0:
+        if args.workers != 1:
+            poller.share_snapshot()
+        operations.seed_snapshot()
+
+    if args.workers != 1:
+        watch.FEED.share()
+        run_workers(app.app, args.host, args.port, args.workers, args.poll_interval)
+        return
+
+    # keep the service snapshot fresh in the background
+    if args.poll_interval > 0:
+        poller.start_poller(args.poll_interval, operations.refresh_snapshot)
+
+    if args.server == 'aiohttp':
+        app.run(host=args.host, port=args.port)
+        return
+
+    server = HTTPServer(tornado_app(app.app))
+    server.listen(args.port, address=args.host)
+    IOLoop.current().start()
+
+
+def tornado_app(flask_app):
+    """
+    tornado application streaming /services/watch itself, and serving
+    every other request with flask_app
+    """
+    return Application([(r'/services/watch', watch.WatchHandler),
+                        (r'.*', FallbackHandler, {'fallback': WSGIContainer(flask_app)})])
+
+
+def run_workers(flask_app, host, port, workers, poll_interval):
+    """
+    Serve flask_app from pre-forked processes sharing one listening socket.
+
+    The service snapshot is kept in the database (see poller.share_snapshot),
+    and only the first worker polls the services, so they are not contacted
+    once per worker.
+    """
+    sockets = bind_sockets(port, address=host)
+    fork_processes(workers)
 
-    # add the swagger APIs
-    api_def = pkg_resources.resource_filename('service_registry',
-                                              'api/swagger.yaml')
-    app.add_api(api_def, strict_validation=True, validate_responses=True)
+    # threads don't survive fork, so the poller is started in the worker
+    if poll_interval > 0 and task_id() == 0:
+        poller.start_poller(poll_interval, operations.refresh_snapshot)
 
-    app.run(host=args.host, port=args.port)
+    server = HTTPServer(tornado_app(flask_app))
+    server.add_sockets(sockets)
+    IOLoop.current().start()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+"""
+Database access from the coroutines serving under aiohttp, run on a
+thread pool of its own so that queries neither block the event loop nor
+wait behind the services being contacted on the fan-out pool
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent import futures
+
+# scope of the task a function runs on behalf of in the thread pool
+_SCOPE = contextvars.ContextVar('session_scope', default=None)
+
+_CONFIG = {'max_workers': 15}
+_EXECUTOR = None
+_EXECUTOR_PID = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def session_scope():
+    """
+    orm.get_session scopefunc giving each request's task its own session,
+    also used by the functions it runs through run_sync; outside the event
+    loop, as in the poller, sessions are per-thread
+    """
+    scope = _SCOPE.get()
+    if scope is not None:
+        return scope
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is None:
+        return 'thread', threading.get_ident()
+    return 'task', id(task)
+
+
+def _in_scope(scope, func, *args):
+    token = _SCOPE.set(scope)
+    try:
+        return func(*args)
+    finally:
+        _SCOPE.reset(token)
+
+
+def configure(max_workers=None):
+    """
+    Set the number of threads querying the database, best the most
+    database connections open at once; the pool is recreated on next use
+    """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if max_workers is not None:
+            _CONFIG['max_workers'] = max_workers
+        if _EXECUTOR is not None and _EXECUTOR_PID == os.getpid():
+            _EXECUTOR.shutdown(wait=False)
+        _EXECUTOR = None
+
+
+def executor():
+    """
+    Return the database thread pool, creating it on first use, or again
+    if the process has forked since, as worker threads do not survive a fork
+    """
+    global _EXECUTOR, _EXECUTOR_PID
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+            _EXECUTOR = futures.ThreadPoolExecutor(max_workers=_CONFIG['max_workers'], thread_name_prefix='db')
+            _EXECUTOR_PID = os.getpid()
+    return _EXECUTOR
+
+
+async def run_sync(func, *args):
+    """
+    Await func(*args), run in the database thread pool with the calling
+    task's database sessions
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        executor(), functools.partial(_in_scope, session_scope(), func, *args))
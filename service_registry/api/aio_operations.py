@@ -0,0 +1,180 @@
+"""
+Coroutine versions of the endpoints in operations, for the aiohttp server.
+
+These share everything but the contacting of services with operations;
+that is awaited through aio_upstream, and database access through
+aio_db.run_sync, so one worker can serve many requests while services
+are being contacted or the database queried.
+"""
+import asyncio
+import dataclasses
+import sys
+from aiohttp import web
+from service_registry import orm
+from service_registry.api import aio_upstream, operations, watch
+from service_registry.api.aio_db import executor, run_sync
+from service_registry.api.logging import aio_apilog
+
+
+def resolve(operation_id):
+    """
+    connexion function resolver mapping the operationIds in the spec, which
+    name functions in operations, to their counterparts here
+    """
+    return getattr(sys.modules[__name__], operation_id.rsplit('.', 1)[-1])
+
+
+@web.middleware
+async def remove_sessions(request, handler):
+    """
+    Tear down the request's DB sessions, as teardown_appcontext does for Flask
+    """
+    try:
+        return await handler(request)
+    finally:
+        orm.remove_sessions()
+
+
+def _plain(obj):
+    """obj with any dataclasses within it turned into dicts"""
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, dict):
+        return {key: _plain(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_plain(value) for value in obj]
+    return obj
+
+
+def _serializable(response):
+    """
+    Flask's JSON encoder serializes the dataclasses in responses (Error, and
+    those nested in models) but connexion's aiohttp one doesn't, so convert them
+    """
+    body, *rest = response
+    return (_plain(body), *rest)
+
+
+@aio_apilog
+async def list_services(request, type=None, organization=None, environment=None,  # pylint: disable=redefined-builtin
+                        active=None, limit=None, cursor=None, include=None):
+    """
+    Return known services, optionally filtered, a page at a time
+    """
+    filters = {'type': type, 'organization': organization, 'environment': environment, 'active': active,
+               'include': include}
+    page, error = await run_sync(operations.select_services, filters, limit, cursor,
+                                 str(request.url.with_query(None)))
+    if error:
+        return _serializable(error)
+
+    entries = await aio_upstream.get_snapshot_entries(page.urls)
+    cohorts = None
+    if operations.includes_cohorts(include):
+        cohorts = await aio_upstream.fetch_page_cohorts(page.urls, entries)
+    return _serializable(operations.services_response(page, entries, filters, limit, cursor, request.headers,
+                                                      cohorts))
+
+
+@aio_apilog
+async def get_one_service(request, serviceId, include=None):
+    """
+    Return info for one service
+    """
+    q, error = await run_sync(operations.select_one_service, serviceId)
+    if error:
+        return _serializable(error)
+
+    entry, = await aio_upstream.get_snapshot_entries([q])
+    cohorts = None
+    if entry.service and operations.includes_cohorts(include):
+        cohorts = await aio_upstream.fetch_cohorts(q.url)
+    return _serializable(operations.one_service_response(q, entry, cohorts, request.headers))
+
+
+@aio_apilog
+async def get_service_cohorts(request, serviceId, limit=None, cursor=None):
+    """
+    Return the cohorts of one service, a page at a time
+    """
+    q, error = await run_sync(operations.select_one_service, serviceId)
+    if error:
+        return _serializable(error)
+
+    entry, = await aio_upstream.get_snapshot_entries([q])
+    cohorts = await aio_upstream.fetch_cohorts(q.url) if entry.service else None
+    return _serializable(operations.cohorts_response(q, entry, cohorts, limit, cursor,
+                                                     str(request.url.with_query(None)), request.headers))
+
+
+@aio_apilog
+async def get_this_service(request):
+    """
+    Return info for this service
+    """
+    return _serializable(operations.this_service_response(request.headers))
+
+
+@aio_apilog
+async def heartbeat(request, serviceId, body, token_info=None):  # pylint: disable=unused-argument
+    """
+    Record a heartbeat of a registered service, carrying its service info
+    """
+    return _serializable(await run_sync(operations.heartbeat_response, serviceId, body, token_info))
+
+
+@aio_apilog
+async def issue_heartbeat_token(request, serviceId):  # pylint: disable=unused-argument
+    """
+    Issue a new heartbeat token for a registered service
+    """
+    return _serializable(await run_sync(operations.heartbeat_token_response, serviceId))
+
+
+@aio_apilog
+async def watch_services(request, since=None):
+    """
+    Stream the changes to the registry since the given one as Server-Sent Events
+    """
+    seq = watch.last_event_id(since, request.headers.get('Last-Event-ID'))
+    response = web.StreamResponse(headers=dict(operations.CORS_HEADERS, **{
+        'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'}))
+    await response.prepare(request)
+
+    async def send(text):
+        await response.write(text.encode('utf-8'))
+
+    try:
+        await watch.stream(send, seq, executor())
+    except (ConnectionResetError, asyncio.CancelledError):
+        # the watcher went away
+        pass
+    return response
+
+
+async def get_metrics(request):  # pylint: disable=unused-argument
+    """
+    Return this process's metrics in the Prometheus text format
+    """
+    return operations.metrics_response()
+
+
+@aio_apilog
+async def list_service_types(request):
+    """
+    Return the distinct types of registered services, as stored in the database
+    """
+    return _serializable(await run_sync(operations.service_types_response, request.headers))
+
+
+@aio_apilog
+async def register_services(request, body, validate=True):  # pylint: disable=unused-argument
+    """
+    Register a batch of services, contacting their URLs concurrently to validate them
+    """
+    registrations = [(entry['name'], entry['url']) for entry in body]
+    if validate:
+        valid = await aio_upstream.validate_urls([url for _, url in registrations])
+    else:
+        valid = [True] * len(registrations)
+    return _serializable(await run_sync(operations.registration_response, registrations, valid))
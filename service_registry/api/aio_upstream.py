@@ -0,0 +1,219 @@
+"""
+Asynchronous fetching of service-info and cohorts documents, used when
+serving under aiohttp so that upstream I/O is awaited rather than blocking
+"""
+import asyncio
+import os
+import sys
+import time
+from urllib.parse import urljoin
+import aiohttp
+from tornado.options import options
+from service_registry import tracing
+from service_registry.api import client, operations, upstream
+from service_registry.api.aio_db import run_sync
+from service_registry.api.breaker import PeerUnavailable
+from service_registry.api.fanout import TIMED_OUT
+from service_registry.api.operations import SERVICE_NAME, Probe
+
+_SESSION = None
+_SESSION_PID = None
+
+
+def get_client():
+    """
+    Return this process's shared aiohttp.ClientSession, made on first use
+    within the event loop with the same pool size and timeouts as
+    client.get_client; as there, a session inherited across a fork is
+    discarded rather than shared
+    """
+    global _SESSION, _SESSION_PID
+    if _SESSION is None or _SESSION.closed or _SESSION_PID != os.getpid():
+        connect_timeout, read_timeout = client.default_timeout()
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=client.pool_size())
+        _SESSION = aiohttp.ClientSession(connector=connector,
+                                         timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                                                       sock_read=read_timeout))
+        _SESSION_PID = os.getpid()
+    return _SESSION
+
+
+async def close_client(_app=None):
+    """Close the shared session; suitable as an aiohttp on_cleanup handler"""
+    global _SESSION
+    if _SESSION is not None and _SESSION_PID == os.getpid():
+        await _SESSION.close()
+    _SESSION = None
+
+
+async def get_json(url, service_url):
+    """
+    GET url, an endpoint of the service registered as service_url,
+    returning (status code, JSON body or None if not 200, seconds the
+    service took to respond), through the same cache and circuit breakers
+    as upstream.get_json
+    """
+    return await upstream.CACHE.get_or_fetch_async(url, lambda: _get_json(url, service_url))
+
+
+async def _get_json(url, service_url):
+    with tracing.span('http.get', **{'http.url': url}) as span:
+        status_code, payload, latency = await _request_json(url, service_url)
+        if span is not None:
+            span.set('http.status_code', status_code)
+        return status_code, payload, latency
+
+
+async def _request_json(url, service_url):
+    try:
+        upstream.BREAKERS.check(service_url)
+    except PeerUnavailable:
+        upstream.record_call(service_url, 'circuit_open')
+        raise
+    connect_timeout, read_timeout = upstream.BREAKERS.timeout(service_url, client.default_timeout())
+    start = time.monotonic()
+    try:
+        async with get_client().get(url, headers=tracing.headers(),
+                                    timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                                                  sock_read=read_timeout)) as r:
+            latency = time.monotonic() - start
+            payload = await r.json(content_type=None) if r.status == 200 else None
+    except asyncio.TimeoutError:
+        upstream.record_call(service_url, 'timeout')
+        raise
+    except aiohttp.ClientError:
+        upstream.record_call(service_url, 'connection_error')
+        raise
+    upstream.record_call(service_url, 'ok' if r.status == 200 else 'http_error', r.status, latency)
+    return r.status, payload, latency
+
+
+@tracing.traced
+async def fetch_service_info(url):
+    """
+    Fetch service info of url from the service itself, as
+    operations.fetch_service_info, returning a Probe.
+    """
+    service_info_url = urljoin(f"{url}/", "service-info")
+    print(f"[{SERVICE_NAME}] Contacting {service_info_url}", flush=True)
+    try:
+        status_code, payload, latency = await get_json(service_info_url, url)
+    except PeerUnavailable:
+        print(f"[{SERVICE_NAME}] Skipping {service_info_url}: circuit open", file=sys.stderr, flush=True)
+        return Probe(None, None, None)
+    except asyncio.TimeoutError:
+        print(f"[{SERVICE_NAME}] Encountered timeout with {service_info_url}", file=sys.stderr, flush=True)
+        return Probe(None, None, None)
+    except aiohttp.ClientError as e:
+        print(f"[{SERVICE_NAME}] Unable to connect to {service_info_url}: {e!r}", file=sys.stderr, flush=True)
+        return Probe(None, None, None)
+
+    if status_code != 200:
+        print(f"[{SERVICE_NAME}] Non-200 status code on {service_info_url}: {status_code}", file=sys.stderr,
+              flush=True)
+        return Probe(None, status_code, latency)
+
+    # the payload is shared with the cache, so don't modify it in place
+    return Probe(dict(payload), status_code, latency)
+
+
+@tracing.traced
+async def fetch_cohorts(url):
+    """
+    Fetch the cohorts of the service registered as url, as
+    operations.fetch_cohorts
+    """
+    for endpoint in operations.COHORT_ENDPOINTS:
+        try:
+            status_code, payload, _ = await get_json(urljoin(f"{url}/", endpoint), url)
+        except (PeerUnavailable, aiohttp.ClientError, asyncio.TimeoutError):
+            break
+        cohorts = operations.cohorts_in(endpoint, status_code, payload)
+        if cohorts is not None:
+            return cohorts
+    print(f"[{SERVICE_NAME}] No cohort data available at {url}", file=sys.stderr, flush=True)
+    return []
+
+
+async def fetch_page_cohorts(url_orms, entries):
+    """
+    Awaitable operations.fetch_page_cohorts
+    """
+    urls = [url_orm.url for url_orm, entry in zip(url_orms, entries) if entry.service]
+    results = await fan_out(fetch_cohorts, urls, max_concurrency=options.fetch_concurrency,
+                            deadline=options.fetch_deadline)
+    return {url: result if isinstance(result, list) else [] for url, result in zip(urls, results)}
+
+
+async def fan_out(func, items, max_concurrency, deadline=None):
+    """
+    Await func(item) for every item, at most max_concurrency at once and
+    for at most deadline seconds in total, as fanout.fan_out.
+
+    Returns a list of results in the same order as items.  Calls which
+    have not finished by the deadline give TIMED_OUT; calls which raised
+    give the exception instance.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded(item):
+        async with semaphore:
+            return await func(item)
+
+    pending = [asyncio.ensure_future(bounded(item)) for item in items]
+    await asyncio.wait(pending, timeout=deadline)
+
+    results = []
+    for task in pending:
+        if not task.done():
+            task.cancel()
+            results.append(TIMED_OUT)
+        elif task.exception() is not None:
+            results.append(task.exception())
+        else:
+            results.append(task.result())
+    return results
+
+
+async def validate_url(url):
+    """
+    Awaitable registration.validate_url, with the client's timeouts
+    """
+    try:
+        async with get_client().get(url):
+            return True
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Unable to connect to {url}: {e!r}", file=sys.stderr, flush=True)
+        return False
+
+
+async def validate_urls(urls):
+    """
+    Awaitable registration.validate_urls, at most options.fetch_concurrency at once
+    """
+    return [result is True for result in await fan_out(validate_url, urls, options.fetch_concurrency)]
+
+
+async def get_services_info_and_active_status(url_orms):
+    """
+    Awaitable operations.get_services_info_and_active_status
+    """
+    results = await fan_out(fetch_service_info, [url_orm.url for url_orm in url_orms],
+                            max_concurrency=options.fetch_concurrency,
+                            deadline=options.fetch_deadline)
+    return await run_sync(operations.record_service_infos, url_orms, results)
+
+
+async def get_snapshot_entries(url_orms):
+    """
+    Awaitable operations.get_snapshot_entries
+    """
+    entries, missing = await run_sync(operations.lookup_snapshot, url_orms)
+    if missing:
+        statuses = await get_services_info_and_active_status(missing)
+        await run_sync(operations.fill_snapshot, entries, missing, statuses)
+    return [entries[url_orm.url] for url_orm in url_orms]
@@ -0,0 +1,59 @@
+"""
+Bearer token authentication of endpoints which change the registry
+"""
+import hashlib
+import hmac
+import secrets
+from tornado.options import options
+from service_registry import orm
+from service_registry.orm.models import HeartbeatToken
+
+
+def _matches(token, expected):
+    """Whether token is the expected token, compared in constant time; never if none is expected"""
+    return bool(expected) and hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+
+def hash_token(token):
+    """The hash of a heartbeat token stored in place of the token"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def issue_heartbeat_tokens(db_session, url_orms):
+    """
+    New heartbeat tokens for the services at url_orms, replacing any they
+    had, in the same order; the caller commits db_session.  Only their
+    hashes are stored, so the tokens can't be shown again.
+    """
+    tokens = [secrets.token_urlsafe(32) for _ in url_orms]
+    for url_orm, token in zip(url_orms, tokens):
+        db_session.merge(HeartbeatToken(url_id=url_orm.id, token_hash=hash_token(token)))
+    return tokens
+
+
+def admin_token_info(token):
+    """
+    connexion bearer token check: token info if token is the admin token
+    given with --admin-token, else None so the request is refused.  With
+    no admin token set, every token is refused.
+    """
+    if not _matches(token, options.admin_token):
+        return None
+    return {'sub': 'admin'}
+
+
+def heartbeat_token_info(token):
+    """
+    connexion bearer token check for heartbeats: token info, whose sub is
+    the ID of the URL the token was issued to, if it is a heartbeat token,
+    or the admin token's
+    """
+    url_id = orm.get_session().query(HeartbeatToken.url_id).filter_by(token_hash=hash_token(token)).scalar()
+    if url_id is not None:
+        return {'sub': str(url_id)}
+    return admin_token_info(token)
+
+
+def may_heartbeat(token_info, url_id):
+    """Whether token_info, of heartbeat_token_info, lets heartbeats be sent for url_id"""
+    return token_info is not None and token_info['sub'] in ('admin', str(url_id))
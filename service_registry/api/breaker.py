@@ -0,0 +1,171 @@
+"""
+Per-peer circuit breakers and adaptive timeouts for calls to registered services
+"""
+import math
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class PeerUnavailable(Exception):
+    """Raised instead of calling a peer whose circuit is open"""
+
+
+class CircuitBreaker():
+    """
+    Circuit breaker for one peer, also tracking its recent latencies.
+
+    After failure_threshold consecutive failures the circuit opens and
+    calls are refused for backoff seconds; then a single trial call is let
+    through (half-open).  If it succeeds the circuit closes, and if it fails
+    the circuit opens again for twice as long, up to max_backoff seconds.
+    """
+    def __init__(self, failure_threshold=3, backoff=5.0, max_backoff=300.0, window=50, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.retry_at = None
+        self._trial_started = None
+
+    def allow(self):
+        """
+        Whether a call may be made now; an open circuit whose backoff has
+        passed lets through one trial call at a time, or another if the
+        trial has gone unanswered for backoff seconds
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = self._clock()
+            if self.state == OPEN and now >= self.retry_at:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and (self._trial_started is None
+                                            or now - self._trial_started >= self.backoff):
+                self._trial_started = now
+                return True
+            return False
+
+    def record_success(self, latency=None):
+        """Record a call which got a response, taking latency seconds"""
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            self.state = CLOSED
+            self.failures = 0
+            self.opens = 0
+            self.retry_at = None
+            self._trial_started = None
+
+    def record_failure(self):
+        """Record a call which failed, opening the circuit if need be"""
+        with self._lock:
+            self.failures += 1
+            self._trial_started = None
+            if self.failure_threshold <= 0:
+                return
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                backoff = min(self.backoff * 2 ** self.opens, self.max_backoff)
+                self.opens += 1
+                self.state = OPEN
+                self.retry_at = self._clock() + backoff
+
+    def samples(self):
+        """Number of recent latencies recorded"""
+        with self._lock:
+            return len(self._latencies)
+
+    def latency_percentile(self, percentile):
+        """The given percentile of recent latencies, or None if there are none"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[max(0, math.ceil(percentile / 100 * len(latencies)) - 1)]
+
+
+class PeerBreakers():
+    """
+    Thread-safe collection of CircuitBreakers, one per peer, where a peer
+    is a registered service URL, so calls to each of its endpoints share
+    one, but services registered under different paths of a host don't.
+
+    Once a peer has min_samples recent latencies, its read timeout is
+    headroom times their 95th percentile, but no more than the configured
+    timeout and no less than min_timeout.  A failure_threshold of 0 never
+    opens any circuit.
+    """
+    def __init__(self, failure_threshold=3, backoff=5.0, max_backoff=300.0,
+                 headroom=3.0, min_timeout=0.1, min_samples=10, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.headroom = headroom
+        self.min_timeout = min_timeout
+        self.min_samples = min_samples
+        self._clock = clock
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, failure_threshold=None, backoff=None, max_backoff=None):
+        """Change the breaker settings, forgetting every peer's state"""
+        with self._lock:
+            if failure_threshold is not None:
+                self.failure_threshold = failure_threshold
+            if backoff is not None:
+                self.backoff = backoff
+            if max_backoff is not None:
+                self.max_backoff = max_backoff
+            self._breakers.clear()
+
+    def get(self, peer):
+        """Return the CircuitBreaker of peer, made on first use"""
+        with self._lock:
+            breaker = self._breakers.get(peer)
+            if breaker is None:
+                breaker = self._breakers[peer] = CircuitBreaker(self.failure_threshold, self.backoff,
+                                                                self.max_backoff, clock=self._clock)
+            return breaker
+
+    def timeout(self, peer, default):
+        """(connect, read) timeout for a call to peer, adapted from default"""
+        connect_timeout, read_timeout = default
+        breaker = self.get(peer)
+        if breaker.samples() < self.min_samples:
+            return default
+        p95 = breaker.latency_percentile(95)
+        return connect_timeout, min(read_timeout, max(self.min_timeout, p95 * self.headroom))
+
+    def check(self, peer):
+        """Raise PeerUnavailable if peer shouldn't be called now"""
+        if self.failure_threshold > 0 and not self.get(peer).allow():
+            raise PeerUnavailable(f"circuit open for {peer}")
+
+    def record(self, peer, status_code=None, latency=None):
+        """
+        Record the outcome of a call to peer: a response with status_code,
+        taking latency seconds, or a failure to get one if status_code is
+        None.  Server errors count as failures.
+        """
+        breaker = self.get(peer)
+        if status_code is None or status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success(latency)
+
+    def stats(self):
+        """Dictionary of each peer's circuit state and latency percentiles"""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {key: {'state': breaker.state, 'failures': breaker.failures,
+                      'p50': breaker.latency_percentile(50), 'p95': breaker.latency_percentile(95)}
+                for key, breaker in breakers.items()}
@@ -0,0 +1,148 @@
+"""
+Bounded TTL + LRU cache with collapsing of concurrent identical fetches
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Call():
+    """A fetch in flight, which other callers for the same key wait on"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache():
+    """
+    Thread-safe cache of at most maxsize entries, each living ttl seconds.
+
+    When full, the least recently used entry is evicted.  Concurrent
+    get_or_fetch (or, in an event loop, get_or_fetch_async) calls for a
+    key that is not cached share a single fetch.
+    """
+    def __init__(self, maxsize=1024, ttl=30.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.collapsed = 0
+
+    def configure(self, maxsize=None, ttl=None):
+        """Change the size cap and/or TTL, dropping all entries"""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._entries.clear()
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Return the cached value for key, or the value of fetch() which is
+        then cached; exceptions raised by fetch are passed on, not cached
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = fetch()
+        except Exception as e:
+            call.error = e
+            raise
+        else:
+            self._store(key, call.value)
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    async def get_or_fetch_async(self, key, fetch):
+        """
+        As get_or_fetch, for use in an event loop; fetch is a coroutine
+        function, and concurrent callers await the same fetch
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+
+            task = self._tasks.get(key)
+            if task is None:
+                task = self._tasks[key] = asyncio.ensure_future(self._fetch_async(key, fetch))
+            else:
+                self.collapsed += 1
+
+        # shielded so that one caller giving up doesn't cancel the others' fetch
+        return await asyncio.shield(task)
+
+    async def _fetch_async(self, key, fetch):
+        try:
+            value = await fetch()
+            self._store(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._tasks[key]
+
+    def _lookup(self, key):
+        """(True, value) if key is cached, else (False, None); call with the lock held"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self._entries[key]
+            self.expirations += 1
+
+        self.misses += 1
+        return False, None
+
+    def _store(self, key, value):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Drop key from the cache, if present"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        """Dictionary of cache counters"""
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'collapsed': self.collapsed}
@@ -0,0 +1,82 @@
+"""
+Shared, pooled keep-alive HTTP client for calls to registered services
+"""
+import os
+import threading
+import warnings
+import requests
+from requests.adapters import HTTPAdapter
+
+_CONFIG = {'pool_size': 10, 'pool_hosts': 128, 'connect_timeout': 1.0, 'read_timeout': 1.0}
+
+_SESSION = None
+_SESSION_PID = None
+_SESSION_LOCK = threading.Lock()
+
+
+def init_client(pool_size=None, pool_hosts=None, connect_timeout=None, read_timeout=None):
+    """
+    Configure the shared client; the session is (re)created on next use.
+
+    pool_size is the number of keep-alive connections kept per host, and
+    the most open to it at once; further calls wait for one to be free.
+    pool_hosts is the number of hosts connection pools are kept for.
+    """
+    global _SESSION
+    for key, value in (('pool_size', pool_size), ('pool_hosts', pool_hosts),
+                       ('connect_timeout', connect_timeout), ('read_timeout', read_timeout)):
+        if value is not None:
+            _CONFIG[key] = value
+    with _SESSION_LOCK:
+        if _SESSION is not None and _SESSION_PID == os.getpid():
+            _SESSION.close()
+        _SESSION = None
+
+
+def get_client():
+    """
+    Return this process's shared requests.Session.
+
+    As with orm.add_engine_pidguard, a session inherited across a fork is
+    discarded rather than shared, and a fresh one made for this process.
+    """
+    global _SESSION, _SESSION_PID
+    pid = os.getpid()
+    with _SESSION_LOCK:
+        if _SESSION is not None and _SESSION_PID != pid:
+            warnings.warn(
+                "Parent process %(orig)s forked (%(newproc)s) with an open "
+                "HTTP session, which is being discarded and recreated." %
+                {"newproc": pid, "orig": _SESSION_PID})
+            _SESSION = None
+        if _SESSION is None:
+            session = requests.Session()
+            # block rather than open connections beyond the pool, so that
+            # pool_size limits the connections to each host, as under aiohttp
+            adapter = HTTPAdapter(pool_connections=_CONFIG['pool_hosts'],
+                                  pool_maxsize=_CONFIG['pool_size'], pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _SESSION = session
+            _SESSION_PID = pid
+        return _SESSION
+
+
+def pool_size():
+    """Number of keep-alive connections kept per host, and the most open to it at once"""
+    return _CONFIG['pool_size']
+
+
+def default_timeout():
+    """(connect, read) timeout used when none is given"""
+    return _CONFIG['connect_timeout'], _CONFIG['read_timeout']
+
+
+def get(url, timeout=None, **kwargs):
+    """
+    GET url over a pooled keep-alive connection; takes the same
+    arguments as requests.get
+    """
+    if timeout is None:
+        timeout = default_timeout()
+    return get_client().get(url, timeout=timeout, **kwargs)
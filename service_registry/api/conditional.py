@@ -0,0 +1,61 @@
+"""
+Conditional GET support (ETag, Last-Modified) for registry responses
+"""
+import datetime
+import hashlib
+import json
+from email.utils import format_datetime, parsedate_to_datetime
+
+CACHE_CONTROL = 'no-cache'
+
+
+def make_etag(*parts):
+    """
+    Strong ETag over the JSON-serializable parts a response is built from
+    """
+    digest = hashlib.sha1(json.dumps(parts, default=str, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+
+def http_date(timestamp):
+    """Format a naive UTC datetime as an HTTP-date"""
+    return format_datetime(timestamp.replace(tzinfo=datetime.timezone.utc, microsecond=0), usegmt=True)
+
+
+def cache_headers(etag, last_modified=None):
+    """
+    Validator and caching headers for a response; clients may store it
+    but must revalidate it with If-None-Match / If-Modified-Since
+    """
+    headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def not_modified(request_headers, etag, last_modified=None):
+    """
+    True if the request's conditional headers show the client already
+    holds the representation with this etag / last_modified.
+
+    If-None-Match takes precedence over If-Modified-Since (RFC 7232).
+    """
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        # weak comparison, as for GET
+        candidates = [tag.strip() for tag in if_none_match.split(',')]
+        return etag in [tag[2:] if tag.startswith('W/') else tag for tag in candidates]
+
+    if_modified_since = request_headers.get('If-Modified-Since')
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        return last_modified.replace(tzinfo=datetime.timezone.utc, microsecond=0) <= since
+
+    return False
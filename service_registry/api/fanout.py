@@ -0,0 +1,57 @@
+"""
+Concurrent fan-out of blocking upstream calls
+"""
+import os
+import threading
+from concurrent import futures
+
+TIMED_OUT = object()
+
+_EXECUTOR = None
+_EXECUTOR_PID = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor(max_workers):
+    """
+    Return the shared, bounded thread pool, creating it on first use.
+
+    The pool is recreated if the process has forked since it was made,
+    as worker threads do not survive a fork.
+    """
+    global _EXECUTOR, _EXECUTOR_PID
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None or _EXECUTOR_PID != os.getpid():
+            _EXECUTOR = futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                   thread_name_prefix='fanout')
+            _EXECUTOR_PID = os.getpid()
+    return _EXECUTOR
+
+
+def fan_out(func, items, max_workers, deadline=None):
+    """
+    Call func(item) for every item concurrently on at most max_workers
+    threads, waiting at most deadline seconds for the whole batch.
+
+    Returns a list of results in the same order as items.  Calls which
+    have not finished by the deadline give TIMED_OUT; calls which raised
+    give the exception instance.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    executor = get_executor(max_workers)
+    pending = [executor.submit(func, item) for item in items]
+    futures.wait(pending, timeout=deadline)
+
+    results = []
+    for future in pending:
+        if not future.done():
+            future.cancel()
+            results.append(TIMED_OUT)
+        elif future.exception() is not None:
+            results.append(future.exception())
+        else:
+            results.append(future.result())
+    return results
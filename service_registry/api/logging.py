@@ -3,12 +3,36 @@
 Logging wrappers for api calls
 """
 
+import inspect
 import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
 from datetime import datetime
 from uuid import UUID
 from decorator import decorator
 from connexion import request
 from flask import current_app
+from service_registry import tracing
+from service_registry.metrics import Counter, Gauge, Histogram
+
+REQUEST_SECONDS = Histogram('service_registry_request_duration_seconds',
+                            'Time taken to handle API calls', ['operation'])
+REQUESTS = Counter('service_registry_requests_total', 'API calls handled', ['operation', 'status'])
+REQUESTS_IN_FLIGHT = Gauge('service_registry_requests_in_flight', 'API calls being handled', ['operation'])
+LOG_RECORDS_DROPPED = Counter('service_registry_log_records_dropped_total',
+                              'Log records dropped because the log queue was full')
+
+# fields an API call's log entry can have; headers and data are left out
+# by default, as they are large and can carry personal information
+LOG_FIELDS = ('timestamp', 'operation', 'method', 'path', 'address', 'status', 'duration', 'headers', 'data')
+DEFAULT_LOG_FIELDS = ('timestamp', 'operation', 'method', 'path', 'address', 'status', 'duration')
+
+_CONFIG = {'sample_rate': 1.0, 'fields': frozenset(DEFAULT_LOG_FIELDS)}
 
 
 class FieldEncoder(json.JSONEncoder):
@@ -21,6 +45,87 @@ class FieldEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+# one reusable encoder, rather than one made by every json.dumps(cls=...)
+_ENCODER = FieldEncoder(skipkeys=True, separators=(',', ':'))
+
+
+class JSONMessage():
+    """
+    Log message of a dict of fields, only encoded as JSON when the record
+    is formatted; with a QueueLogHandler, that's in its listener thread
+    """
+    __slots__ = ('fields',)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return _ENCODER.encode(self.fields)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """
+    Handler passing records through a bounded queue to a thread which
+    writes them with handler, so that API calls never wait on the log.
+
+    Records arriving while the queue is full are dropped and counted.  As
+    with client.get_client, a process forked after the thread started
+    gets a queue and thread of its own.
+    """
+    def __init__(self, handler, maxsize=10000):
+        super().__init__(None)
+        self.handler = handler
+        self.maxsize = maxsize
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self.queue = queue.Queue(self.maxsize)
+                    self._listener = logging.handlers.QueueListener(self.queue, self.handler,
+                                                                    respect_handler_level=True)
+                    self._listener.start()
+                    self._pid = os.getpid()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def prepare(self, record):
+        # the message is formatted by the listener thread, unless there's
+        # a traceback, which can only be formatted while it's being handled
+        if record.exc_info:
+            return super().prepare(record)
+        return record
+
+    def close(self):
+        """Write out the queued records and stop the thread"""
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+        self.handler.close()
+        super().close()
+
+
+def configure_apilog(sample_rate=None, fields=None):
+    """
+    Log only a sample_rate fraction of API calls, though always those
+    which fail with a server error, and only the given LOG_FIELDS of each
+    """
+    if sample_rate is not None:
+        _CONFIG['sample_rate'] = sample_rate
+    if fields is not None:
+        unknown = set(fields) - set(LOG_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown log fields: {', '.join(sorted(unknown))}")
+        _CONFIG['fields'] = frozenset(fields)
+
+
 def structured_log(**kwargs):
     """
     JSON string of keyword arguments
@@ -28,7 +133,86 @@ def structured_log(**kwargs):
     entrydict = {"timestamp": str(datetime.now())}
     for key in kwargs:
         entrydict[key] = kwargs[key]
-    return json.dumps(entrydict, skipkeys=True, cls=FieldEncoder)
+    return _ENCODER.encode(entrydict)
+
+
+def redacted_headers(headers):
+    """
+    Request headers as a dict, with credentials masked for logging
+    """
+    return {key: '<redacted>' if key.lower() in ('authorization', 'cookie') else value
+            for key, value in headers.items()}
+
+
+def response_status(response):
+    """
+    Status code of an endpoint's return value: a body, a Flask response, or
+    a tuple of body, status and optionally headers
+    """
+    if isinstance(response, tuple) and len(response) > 1 and isinstance(response[1], int):
+        return response[1]
+    return getattr(response, 'status_code', 200)
+
+
+# how each field is read from Flask's and aiohttp's requests
+_FLASK_FIELDS = {'method': lambda req: req.method,
+                 'path': lambda req: req.full_path,
+                 'address': lambda req: req.remote_addr,
+                 'headers': lambda req: redacted_headers(req.headers),
+                 'data': lambda req: req.get_data(as_text=True)}
+_AIO_FIELDS = {'method': lambda req: req.method,
+               'path': lambda req: req.path_qs,
+               'address': lambda req: req.remote,
+               'headers': lambda req: redacted_headers(req.headers)}
+
+
+def log_entry(operation, started, status, duration, req, getters, args, kwargs, span=None):
+    """
+    Dict of the configured fields of an API call's log entry; without a
+    request, as when called directly, its arguments are given instead.
+    Traced calls' entries also have their trace ID.
+    """
+    fields = _CONFIG['fields']
+    entrydict = {}
+    if 'timestamp' in fields:
+        entrydict['timestamp'] = started
+    if 'operation' in fields:
+        entrydict['operation'] = operation
+    if req is not None:
+        for field, getter in getters.items():
+            if field in fields:
+                entrydict[field] = getter(req)
+    else:
+        entrydict['args'] = args
+        entrydict.update(kwargs)
+    if 'status' in fields:
+        entrydict['status'] = status
+    if 'duration' in fields:
+        entrydict['duration'] = round(duration, 6)
+    if span is not None:
+        entrydict['trace_id'] = span.trace_id
+    return entrydict
+
+
+def sampled():
+    """Whether to log an API call, regardless of its outcome"""
+    sample_rate = _CONFIG['sample_rate']
+    return sample_rate >= 1 or random.random() < sample_rate
+
+
+def _flask_request():
+    """The current Flask request, or None outside of one"""
+    try:
+        return request._get_current_object()  # pylint: disable=protected-access
+    except RuntimeError:
+        return None
+
+
+def _traceparent(req):
+    """req's traceparent header, if tracing"""
+    if req is None or not tracing.enabled():
+        return None
+    return req.headers.get('traceparent')
 
 
 def logger():
@@ -39,21 +223,52 @@ def logger():
 @decorator
 def apilog(func, *args, **kwargs):
     """
-    Logging decorator for API calls
+    Logging decorator for API calls, which also records their count,
+    duration and number in flight, and traces them if tracing is enabled
     """
-    entrydict = {"timestamp": str(datetime.now())}
-    try:
-        entrydict['method'] = request.method
-        entrydict['path'] = request.full_path
-        entrydict['data'] = str(request.data)
-        entrydict['address'] = request.remote_addr
-        entrydict['headers'] = str(request.headers)
-    except RuntimeError:
-        entrydict['called'] = func.__name__
-        entrydict['args'] = args
-        for key in kwargs:
-            entrydict[key] = kwargs[key]
+    operation = func.__name__
+    started = datetime.now()
+    status = 500
+    start = time.perf_counter()
+    req = _flask_request()
+    with REQUESTS_IN_FLIGHT.track(operation), tracing.span(operation, _traceparent(req), root=True) as span:
+        try:
+            response = func(*args, **kwargs)
+            status = response_status(response)
+            return response
+        finally:
+            duration = time.perf_counter() - start
+            REQUEST_SECONDS.observe(duration, operation)
+            REQUESTS.inc(operation, str(status))
+            if span is not None:
+                span.set('http.status_code', status)
+            if status >= 500 or sampled():
+                current_app.logger.info(JSONMessage(
+                    log_entry(operation, started, status, duration, req, _FLASK_FIELDS, args, kwargs, span)))
+
 
-    logentry = json.dumps(entrydict)
-    current_app.logger.info(logentry)
-    return func(*args, **kwargs)
+@decorator
+async def aio_apilog(func, *args, **kwargs):
+    """
+    Logging decorator for API coroutines served by aiohttp, which are
+    passed the aiohttp request as their request argument
+    """
+    operation = func.__name__
+    started = datetime.now()
+    status = 500
+    start = time.perf_counter()
+    req = inspect.signature(func).bind(*args, **kwargs).arguments.get('request')
+    with REQUESTS_IN_FLIGHT.track(operation), tracing.span(operation, _traceparent(req), root=True) as span:
+        try:
+            response = await func(*args, **kwargs)
+            status = response_status(response)
+            return response
+        finally:
+            duration = time.perf_counter() - start
+            REQUEST_SECONDS.observe(duration, operation)
+            REQUESTS.inc(operation, str(status))
+            if span is not None:
+                span.set('http.status_code', status)
+            if status >= 500 or sampled():
+                logging.getLogger('service_registry').info(JSONMessage(
+                    log_entry(operation, started, status, duration, req, _AIO_FIELDS, args, kwargs, span)))
@@ -3,7 +3,39 @@ API Data Model definitions
 """
 
 import dataclasses
-from dataclasses import dataclass, field
+import functools
+import json
+from dataclasses import dataclass
+
+
+@functools.lru_cache(maxsize=None)
+def field_names(cls):
+    """Names of the fields of the dataclass cls, found once per class"""
+    return frozenset(f.name for f in dataclasses.fields(cls))
+
+
+class Model():
+    """
+    Base of the models which are built from dicts of fields, such as
+    service-info, keeping the known keys and ignoring the rest
+    """
+    def __init__(self, **kwargs):
+        names = field_names(type(self))
+        self.__dict__.update({k: v for k, v in kwargs.items() if k in names})
+
+
+# compact, with keys sorted as by Flask's encoder
+_ENCODER = json.JSONEncoder(sort_keys=True, separators=(',', ':'))
+
+
+def encode(obj):
+    """JSON bytes of obj, made of JSON types"""
+    return _ENCODER.encode(obj).encode('utf-8')
+
+
+def encode_list(encoded):
+    """JSON bytes of a list of items, each already encoded as JSON bytes"""
+    return b'[' + b','.join(encoded) + b']'
 
 
 @dataclass
@@ -13,39 +45,26 @@ class Error():
     detail: str
 
 
-@dataclass
-class ServiceType():
+@dataclass(init=False)
+class ServiceType(Model):
     group: str
     artifact: str
     version: str
 
-    def __init__(self, **kwargs):
-        names = set([f.name for f in dataclasses.fields(self)])
-        for k, v in kwargs.items():
-            if k in names:
-                setattr(self, k, v)
 
-
-@dataclass
-class Organization():
+@dataclass(init=False)
+class Organization(Model):
     name: str
     url: str
 
-    def __init__(self, **kwargs):
-        names = set([f.name for f in dataclasses.fields(self)])
-        for k, v in kwargs.items():
-            if k in names:
-                setattr(self, k, v)
-
 
-@dataclass
-class Service():
+@dataclass(init=False)
+class Service(Model):
     id: str
     name: str
     type: ServiceType
     organization: Organization
     version: str
-    cohorts: list = field(default_factory=list)
     contactUrl: str = ''
     documentationUrl: str = ''
     description: str = ''
@@ -53,33 +72,3 @@ class Service():
     updatedAt: str = ''
     environment: str = ''
 
-    def __init__(self, **kwargs):
-        names = set([f.name for f in dataclasses.fields(self)])
-        for k, v in kwargs.items():
-            if k in names:
-                setattr(self, k, v)
-
-
-@dataclass
-class ExternalService():
-    id: str
-    name: str
-    type: ServiceType
-    organization: Organization
-    version: str
-    url: str
-    active: bool
-    cohorts: list = field(default_factory=list)
-    contactUrl: str = ''
-    documentationUrl: str = ''
-    description: str = ''
-    createdAt: str = ''
-    updatedAt: str = ''
-    environment: str = ''
-
-    def __init__(self, **kwargs):
-        names = set([f.name for f in dataclasses.fields(self)])
-        for k, v in kwargs.items():
-            if k in names:
-                setattr(self, k, v)
-
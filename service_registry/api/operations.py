@@ -5,14 +5,24 @@ Implement endpoints of model service
 """
 import sys
 import uuid
-from urllib.parse import urljoin
+import datetime
+from collections import namedtuple
+from urllib.parse import urljoin, urlencode
 import requests
-from service_registry import orm
-from service_registry.orm import models
+from service_registry import orm, tracing
+from service_registry.api import auth, client, conditional, models, poller, registration, upstream, watch
+from service_registry.api.breaker import PeerUnavailable
+from service_registry.api.fanout import fan_out, TIMED_OUT
 from service_registry.api.logging import apilog
+from service_registry.api.poller import SnapshotEntry
 from service_registry.api.models import Error, ServiceType
-from service_registry.api.models import Service, ExternalService
-from service_registry.orm.models import URL, Service as ORM_Service, Type, Organization
+from service_registry.api.models import Service
+from service_registry.metrics import REGISTRY
+from service_registry.orm.models import URL, Service as ORM_Service, Type, Organization, HealthCheck, Lease
+from connexion import NoContent, request
+from flask import current_app
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import joinedload
 from tornado.options import options
 
 SERVICE_NAME = "CINECA Service Registry"
@@ -23,72 +33,475 @@ THIS_SERVICE = Service(id='this.service',
                        description='CINECA service registry',
                        organization={'name': "CINECA", 'url': 'www.cineca-project.eu'},
                        version='1.0.0')
+THIS_SERVICE_ETAG = conditional.make_etag(orm.dump(THIS_SERVICE))
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'ETag, Last-Modified, Link'}
 
+# JSON of the ExternalServices served recently, by their URL and snapshot
+# entry, so that services unchanged since the last poll aren't re-encoded
+SERVICE_JSON_LIMIT = 10000
+_SERVICE_JSON = {}
 
-def get_service_info_and_active_status(url):
+# service-info fields which may be left out, stored as nulls when they are
+OPTIONAL_SERVICE_FIELDS = ('description', 'contactUrl', 'documentationUrl', 'createdAt', 'updatedAt', 'environment')
+# endpoints of a service its cohorts are looked for at, in order
+COHORT_ENDPOINTS = ('service-info', 'cohorts')
+
+ServicePage = namedtuple('ServicePage', ['urls', 'type_fields', 'headers'])
+# the identity of a registered URL, kept after its session is closed
+URLRef = namedtuple('URLRef', ['id', 'name', 'url'])
+# result of contacting a service: its service data (None if unavailable),
+# the service-info status code and seconds taken to respond, where known
+Probe = namedtuple('Probe', ['service_data', 'status_code', 'latency'])
+
+
+def query_urls(db_session):
     """
-    Fetch service info and active status of url
+    Query for registered URLs which loads each URL's stored service, and
+    that service's type and organization, in the same SELECT
     """
-    db_session = orm.get_session()
-    active = True
+    return db_session.query(URL).options(
+        joinedload(URL.service).joinedload(ORM_Service.type),
+        joinedload(URL.service).joinedload(ORM_Service.organization))
 
-    try:
-        url_orm = db_session.query(URL).filter(URL.url == url).scalar()
-    except orm.ORMException as e:
-        print("Error connecting to database: " + str(e), file=sys.stderr, flush=True)
-        return None, active
 
-    service_orm = url_orm.service
+@tracing.traced
+def fetch_service_info(url):
+    """
+    Fetch service info of url from the service itself; its cohorts, which
+    can be large, are left to fetch_cohorts.
+
+    Returns a Probe, whose service data is None if the service could not
+    be reached, or was skipped as its circuit breaker is open.  Doesn't
+    touch the database, so is safe to run in fan-out worker threads.
+    """
     service_info_url = urljoin(f"{url}/", "service-info")
     print(f"[{SERVICE_NAME}] Contacting {service_info_url}", flush=True)
     try:
-        r = requests.get(service_info_url, timeout=1)
-        if r.status_code != 200:
-            print(f"[{SERVICE_NAME}] Non-200 status code on {service_info_url}: {r.status_code}", file=sys.stderr,
-                  flush=True)
-            service_data = get_service_data_from_db(service_orm)
-            active = False
-        else:
-            service_data = r.json()
+        status_code, payload, latency = upstream.get_json(service_info_url, url)
+    except PeerUnavailable:
+        print(f"[{SERVICE_NAME}] Skipping {service_info_url}: circuit open", file=sys.stderr, flush=True)
+        return Probe(None, None, None)
     except requests.exceptions.Timeout:
         print(f"[{SERVICE_NAME}] Encountered timeout with {service_info_url}", file=sys.stderr, flush=True)
-        service_data = get_service_data_from_db(service_orm)
-        active = False
+        return Probe(None, None, None)
+    except requests.RequestException as e:
+        print(f"[{SERVICE_NAME}] Unable to connect to {service_info_url}: {e}", file=sys.stderr, flush=True)
+        return Probe(None, None, None)
 
-    if not service_data:
-        return None, active
+    if status_code != 200:
+        print(f"[{SERVICE_NAME}] Non-200 status code on {service_info_url}: {status_code}", file=sys.stderr,
+              flush=True)
+        return Probe(None, status_code, latency)
+
+    # the payload is shared with the cache, so don't modify it in place
+    return Probe(dict(payload), status_code, latency)
+
+
+def cohorts_in(endpoint, status_code, payload):
+    """
+    The cohorts in a service's response from endpoint, one of
+    COHORT_ENDPOINTS, or None if there are none
+    """
+    if status_code != 200:
+        return None
+    cohorts = payload.get('cohorts') if endpoint == 'service-info' and isinstance(payload, dict) else payload
+    return cohorts if isinstance(cohorts, list) else None
 
-    # add the service to the database if it is not already in the database
-    if not service_orm:
-        service_type = Type(id=uuid.uuid4(), group=service_data['type']['group'],
-                            artifact=service_data['type']['artifact'], version=service_data['type']['version'])
-        organization = Organization(id=uuid.uuid4(), name=service_data['organization']['name'],
-                                    url=service_data['organization']['url'])
-        service = ORM_Service(id=uuid.uuid4(), name=service_data['name'], description=service_data['description'],
-                              contact_url=service_data['contactUrl'],
-                              documentation_url=service_data['documentationUrl'],
-                              created_at=service_data['createdAt'], updated_at=service_data['updatedAt'],
-                              environment=service_data['environment'], version=service_data['version'])
-        service.type = service_type
-        service.organization = organization
-        url_orm.service = service
 
+@tracing.traced
+def fetch_cohorts(url):
+    """
+    Fetch the cohorts of the service registered as url when they are asked
+    for: those in its service info, else those at its /cohorts, or [] if
+    there are none or it can't be reached.  The poller leaves them out of
+    the snapshot, as they can be large; responses are cached by upstream.
+    """
+    for endpoint in COHORT_ENDPOINTS:
         try:
-            db_session.add(service)
-            db_session.commit()
-        except orm.ORMException as e:
-            print("Error writing to database: " + str(e), file=sys.stderr, flush=True)
-            db_session.rollback()
-
-    if "cohorts" not in service_data:
-        cohort_url = urljoin(f"{url}/", "cohorts")
-        cr = requests.get(cohort_url, timeout=1)
-        if cr.status_code != 200:
-            print(f"[{SERVICE_NAME}] No cohort data available at f{url}", file=sys.stderr, flush=True)
+            cohorts = cohorts_in(endpoint, *upstream.get_json(urljoin(f"{url}/", endpoint), url)[:2])
+        except (PeerUnavailable, requests.RequestException):
+            break
+        if cohorts is not None:
+            return cohorts
+    print(f"[{SERVICE_NAME}] No cohort data available at {url}", file=sys.stderr, flush=True)
+    return []
+
+
+def fetch_page_cohorts(url_orms, entries):
+    """
+    fetch_cohorts of each of url_orms whose snapshot entry has a service,
+    concurrently; returns a dict of their cohorts by URL
+    """
+    urls = [url_orm.url for url_orm, entry in zip(url_orms, entries) if entry.service]
+    results = fan_out(tracing.propagate(fetch_cohorts), urls, max_workers=options.fetch_concurrency,
+                      deadline=options.fetch_deadline)
+    return {url: result if isinstance(result, list) else [] for url, result in zip(urls, results)}
+
+
+def add_service_to_db(db_session, url_orm, service_data, types):
+    """
+    Store the service described by service_data as url_orm's service;
+    the caller commits.
+
+    types maps (group, artifact, version) to the stored Type, so that
+    services of the same type share one row; new types are added to it.
+    """
+    triple = (service_data['type']['group'], service_data['type']['artifact'], service_data['type']['version'])
+    service_type = types.get(triple)
+    if service_type is None:
+        service_type = types[triple] = Type(id=uuid.uuid4(), group=triple[0], artifact=triple[1], version=triple[2])
+    organization = Organization(id=uuid.uuid4(), name=service_data['organization']['name'],
+                                url=service_data['organization']['url'])
+    service = ORM_Service(id=uuid.uuid4(), name=service_data['name'], description=service_data.get('description'),
+                          contact_url=service_data.get('contactUrl'),
+                          documentation_url=service_data.get('documentationUrl'),
+                          created_at=service_data.get('createdAt'), updated_at=service_data.get('updatedAt'),
+                          environment=service_data.get('environment'), version=service_data['version'])
+    service.type = service_type
+    service.organization = organization
+    url_orm.service = service
+    db_session.add(service)
+
+
+def update_service_in_db(service_orm, service_data, types):
+    """
+    Bring the stored service_orm up to date with service_data, as fetched
+    from the service; the caller commits.  types is as for add_service_to_db.
+
+    Returns True if any stored metadata changed.
+    """
+    stored = get_service_data_from_db(service_orm)
+    fields = {'name': 'name', 'description': 'description', 'contactUrl': 'contact_url',
+              'documentationUrl': 'documentation_url', 'createdAt': 'created_at', 'updatedAt': 'updated_at',
+              'environment': 'environment', 'version': 'version'}
+    # read everything first, so malformed service_data changes nothing
+    triple = (service_data['type']['group'], service_data['type']['artifact'], service_data['type']['version'])
+    organization = {key: service_data['organization'][key] for key in ('name', 'url')}
+    values = {key: service_data.get(key) for key in fields}
+    changed = False
+    for key, column in fields.items():
+        if stored[key] != values[key]:
+            setattr(service_orm, column, values[key])
+            changed = True
+
+    if (stored['type']['group'], stored['type']['artifact'], stored['type']['version']) != triple:
+        service_type = types.get(triple)
+        if service_type is None:
+            service_type = types[triple] = Type(id=uuid.uuid4(), group=triple[0], artifact=triple[1],
+                                                version=triple[2])
+        service_orm.type = service_type
+        changed = True
+
+    for key, value in organization.items():
+        if stored['organization'][key] != value:
+            setattr(service_orm.organization, key, value)
+            changed = True
+
+    return changed
+
+
+def get_services_info_and_active_status(url_orms, prune_before=None):
+    """
+    Fetch service info and active status of every URL in url_orms, as
+    loaded by query_urls, contacting the services concurrently.
+
+    At most options.fetch_concurrency services are contacted at once, and
+    the whole batch takes at most options.fetch_deadline seconds; services
+    which fail or miss the deadline are served from the database as inactive.
+    The results are stored as by record_service_infos.
+    """
+    results = fan_out(tracing.propagate(fetch_service_info), [url_orm.url for url_orm in url_orms],
+                      max_workers=options.fetch_concurrency,
+                      deadline=options.fetch_deadline)
+    return record_service_infos(url_orms, results, prune_before)
+
+
+@tracing.traced
+def record_service_infos(url_orms, results, prune_before=None):
+    """
+    Turn the fan-out results (Probes) of fetching service info for url_orms
+    into (Service, active) statuses, falling back to the database for
+    services which could not be reached.
+
+    In a single transaction, newly seen services are stored, the stored
+    metadata of the others brought up to date, a HealthCheck recorded for
+    every URL and, if prune_before is given, older checks deleted.
+    """
+    db_session = orm.get_session()
+    statuses = []
+    checks = []
+    types = None
+    checked_at = datetime.datetime.utcnow()
+    for url_orm, probe in zip(url_orms, results):
+        if probe is TIMED_OUT:
+            print(f"[{SERVICE_NAME}] Deadline exceeded contacting {url_orm.url}", file=sys.stderr, flush=True)
+            probe = Probe(None, None, None)
+        elif isinstance(probe, Exception):
+            print(f"[{SERVICE_NAME}] Error contacting {url_orm.url}: {probe}", file=sys.stderr, flush=True)
+            probe = Probe(None, None, None)
+
+        service_data = probe.service_data
+        active = service_data is not None
+        changed = False
+        if not active:
+            service_data = get_service_data_from_db(url_orm.service)
         else:
-            service_data.update["cohorts"] = cr.json()
+            service_data = dict(dict.fromkeys(OPTIONAL_SERVICE_FIELDS), **service_data)
+            if types is None:
+                types = {(t.group, t.artifact, t.version): t for t in db_session.query(Type)}
+            try:
+                if not url_orm.service:
+                    add_service_to_db(db_session, url_orm, service_data, types)
+                    changed = True
+                else:
+                    changed = update_service_in_db(url_orm.service, service_data, types)
+            except (KeyError, TypeError) as e:
+                # one malformed service-info mustn't lose the results of the others
+                print(f"[{SERVICE_NAME}] Malformed service info from {url_orm.url}: {e!r}", file=sys.stderr,
+                      flush=True)
+                active = False
+                service_data = get_service_data_from_db(url_orm.service)
+
+        checks.append({'url_id': url_orm.id, 'checked_at': checked_at, 'active': active,
+                       'status_code': probe.status_code, 'latency': probe.latency, 'metadata_changed': changed})
+        statuses.append((Service(**service_data) if service_data else None, active))
+
+    try:
+        if checks:
+            db_session.execute(HealthCheck.__table__.insert(), checks)
+        if prune_before is not None:
+            db_session.query(HealthCheck).filter(HealthCheck.checked_at < prune_before) \
+                .delete(synchronize_session=False)
+        db_session.commit()
+    except orm.ORMException as e:
+        print("Error writing to database: " + str(e), file=sys.stderr, flush=True)
+        db_session.rollback()
+
+    return statuses
+
 
-    return Service(**service_data), active
+def leased_url_ids(db_session, now):
+    """
+    IDs of the registered URLs whose heartbeat lease has not expired by now
+    """
+    return {url_id for url_id, in db_session.query(Lease.url_id).filter(Lease.expires > now)}
+
+
+def refresh_snapshot():
+    """
+    Contact every registered URL, except those kept alive by heartbeats,
+    and record the results in the snapshot; run periodically by the
+    background poller
+    """
+    now = datetime.datetime.utcnow()
+    prune_before = None
+    if options.health_retention > 0:
+        prune_before = now - datetime.timedelta(days=options.health_retention)
+
+    db_session = orm.get_session()
+    try:
+        with tracing.span('refresh_snapshot', root=True):
+            url_orms = query_urls(db_session).all()
+            urls = [url_orm.url for url_orm in url_orms]
+            leased = leased_url_ids(db_session, now)
+            polled = [url_orm for url_orm in url_orms if url_orm.id not in leased]
+            refs = [URLRef(url_orm.id, url_orm.name, url_orm.url) for url_orm in polled]
+            statuses = get_services_info_and_active_status(polled, prune_before)
+    finally:
+        db_session.remove()
+
+    last_checked = datetime.datetime.utcnow()
+    update_snapshot(refs, [SnapshotEntry(service, active, last_checked) for service, active in statuses])
+    removed = poller.SNAPSHOT.retain(urls)
+    watch.FEED.publish([{'kind': 'removed', 'url': url, 'data': {'url': url}} for url in removed])
+    if prune_before is not None:
+        watch.FEED.prune(prune_before)
+
+    print(f"[{SERVICE_NAME}] Upstream cache: {upstream.CACHE.stats()}", flush=True)
+    tripped = {peer: stats for peer, stats in upstream.BREAKERS.stats().items() if stats['state'] != 'closed'}
+    if tripped:
+        print(f"[{SERVICE_NAME}] Circuits not closed: {tripped}", flush=True)
+
+
+def update_snapshot(refs, entries):
+    """
+    Record entries, the new SnapshotEntry of each of refs (URLRefs or
+    URLs), in the snapshot, and publish how they changed to watchers
+    """
+    urls = [ref.url for ref in refs]
+    old = poller.SNAPSHOT.get_many(urls)
+    poller.SNAPSHOT.update_many(dict(zip(urls, entries)))
+    watch.FEED.publish(snapshot_changes(refs, old, entries))
+
+
+def snapshot_changes(refs, old, new):
+    """
+    Changes to send watchers between the SnapshotEntries old, a dict by
+    URL, and new, in the order of refs
+    """
+    changes = []
+    for ref, entry in zip(refs, new):
+        before = old.get(ref.url)
+        if before is None:
+            kind = 'added'
+        elif before.active != entry.active and not options.remove_active_status:
+            kind = 'active' if entry.active else 'inactive'
+        elif served_fields(before.service) != served_fields(entry.service):
+            kind = 'changed'
+        else:
+            continue
+        changes.append({'kind': kind, 'url': ref.url, 'data': watched_service(ref, entry)})
+    return changes
+
+
+def served_fields(service):
+    """
+    The fields of service which watchers are sent, to tell whether it
+    changed: without unset fields, which the shared snapshot leaves out,
+    or its ID, which a snapshot seeded from the database doesn't have as
+    the service gave it
+    """
+    def set_fields(value):
+        if isinstance(value, dict):
+            return {k: set_fields(v) for k, v in value.items() if v is not None}
+        return value
+
+    if service is None:
+        return None
+    return set_fields({k: v for k, v in vars(service).items() if k != 'id'})
+
+
+def watched_service(ref, entry):
+    """
+    The ExternalService sent to watchers of a change to ref, or as much of
+    it as is known of a service never connected to
+    """
+    if entry.service:
+        return external_service_dict(ref, entry)
+    service_as_dict = {'id': str(ref.id), 'name': ref.name, 'url': ref.url}
+    if not options.remove_active_status:
+        service_as_dict['active'] = entry.active
+    return service_as_dict
+
+
+def seed_snapshot():
+    """
+    Fill the snapshot with the last recorded health of every registered
+    URL and its stored service, so that a restarted registry serves its
+    last known state straight away rather than contacting every service
+    """
+    db_session = orm.get_session()
+    try:
+        latest = db_session.query(HealthCheck.url_id, func.max(HealthCheck.checked_at).label('checked_at')) \
+            .group_by(HealthCheck.url_id).subquery()
+        checks = {check.url_id: check for check in db_session.query(HealthCheck).join(
+            latest, and_(HealthCheck.url_id == latest.c.url_id, HealthCheck.checked_at == latest.c.checked_at))}
+        entries = {}
+        for url_orm in query_urls(db_session):
+            check = checks.get(url_orm.id)
+            if check is not None:
+                service_data = get_service_data_from_db(url_orm.service)
+                entries[url_orm.url] = SnapshotEntry(Service(**service_data) if service_data else None,
+                                                     check.active, check.checked_at)
+    finally:
+        db_session.remove()
+
+    poller.SNAPSHOT.update_many(entries)
+
+
+def get_snapshot_entries(url_orms):
+    """
+    Return a SnapshotEntry for each URL in url_orms, as loaded by query_urls.
+
+    When the background poller is running these are served from its
+    snapshot; URLs it has not polled yet, or every URL when not polling,
+    are contacted live.
+    """
+    entries, missing = lookup_snapshot(url_orms)
+    if missing:
+        fill_snapshot(entries, missing, get_services_info_and_active_status(missing))
+    return [entries[url_orm.url] for url_orm in url_orms]
+
+
+def lookup_snapshot(url_orms):
+    """
+    Look url_orms up in the snapshot, returning a dict of the entries found
+    by URL, and the list of url_orms which must be contacted live
+    """
+    entries = poller.SNAPSHOT.get_many([url_orm.url for url_orm in url_orms]) if options.poll_interval > 0 else {}
+    missing = [url_orm for url_orm in url_orms if url_orm.url not in entries]
+    return entries, missing
+
+
+def fill_snapshot(entries, missing, statuses):
+    """
+    Add the statuses of the missing url_orms, just contacted, to entries
+    and to the snapshot
+    """
+    last_checked = datetime.datetime.utcnow()
+    contacted = {url_orm.url: SnapshotEntry(service, active, last_checked)
+                 for url_orm, (service, active) in zip(missing, statuses)}
+    entries.update(contacted)
+    if options.poll_interval > 0:
+        update_snapshot(missing, [contacted[url_orm.url] for url_orm in missing])
+
+
+def external_service_dict(url_orm, entry, cohorts=None):
+    """
+    Return the ExternalService for url_orm from its SnapshotEntry as a dict,
+    with the ID and name overwritten by local values, and with cohorts,
+    those of fetch_cohorts, if they are given
+    """
+    service_as_dict = {k: v for k, v in vars(entry.service).items() if v is not None}
+    if cohorts is not None:
+        service_as_dict['cohorts'] = cohorts
+    service_as_dict['id'] = str(url_orm.id)
+    service_as_dict['name'] = url_orm.name
+    service_as_dict['url'] = url_orm.url
+    service_as_dict['lastChecked'] = entry.last_checked.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    if not options.remove_active_status:
+        service_as_dict['active'] = entry.active
+
+    return service_as_dict
+
+
+def external_service_json(url_orm, entry, cohorts=None):
+    """
+    external_service_dict as JSON bytes, encoded once per poll of the
+    service unless it has cohorts, which are fetched afresh
+    """
+    if cohorts is not None:
+        return models.encode(external_service_dict(url_orm, entry, cohorts))
+    key = (url_orm.id, url_orm.name, url_orm.url, entry.active, entry.last_checked, options.remove_active_status)
+    encoded = _SERVICE_JSON.get(key)
+    if encoded is None:
+        if len(_SERVICE_JSON) >= SERVICE_JSON_LIMIT:
+            _SERVICE_JSON.clear()
+        encoded = _SERVICE_JSON[key] = models.encode(external_service_dict(url_orm, entry, cohorts))
+    return encoded
+
+
+def includes_cohorts(include):
+    """Whether the include parameter, a list of optional parts of services, asks for their cohorts"""
+    return 'cohorts' in (include or [])
+
+
+def snapshot_validators(url_orms, entries, *params):
+    """
+    ETag and Last-Modified of a response built from the snapshot entries of
+    url_orms and the request parameters params.
+
+    These are computed from when each service was last checked rather than
+    from the serialized response, so unchanged responses needn't be built.
+    """
+    etag = conditional.make_etag(options.remove_active_status, params,
+                                 [(str(url_orm.id), url_orm.name, url_orm.url,
+                                   entry.active, entry.last_checked, entry.service is not None)
+                                  for url_orm, entry in zip(url_orms, entries)])
+    last_modified = max((entry.last_checked for entry in entries), default=None)
+    return etag, last_modified
 
 
 def get_service_data_from_db(service_orm):
@@ -123,66 +536,344 @@ def get_service_data_from_db(service_orm):
     return service_dict
 
 
-@apilog
-def list_services():
+def parse_type_filter(type_filter):
+    """
+    Split a group[:artifact[:version]] type filter into a dict of the
+    ServiceType fields it gives
+    """
+    values = type_filter.split(':')
+    if len(values) > 3 or not all(values):
+        raise ValueError(f"Type filter {type_filter} is not of the form group[:artifact[:version]]")
+    return dict(zip(('group', 'artifact', 'version'), values))
+
+
+def filter_urls(query, type_fields, organization, environment):
+    """
+    Restrict a query_urls query to URLs whose stored service matches the
+    filters; URLs with no stored service yet are kept, as they can only be
+    matched once contacted
+    """
+    criteria = []
+    if type_fields:
+        criteria.append(ORM_Service.type.has(and_(*[getattr(Type, field) == value
+                                                    for field, value in type_fields.items()])))
+    if organization:
+        criteria.append(ORM_Service.organization.has(Organization.name == organization))
+    if environment:
+        criteria.append(ORM_Service.environment == environment)
+
+    if not criteria:
+        return query
+    return query.filter(or_(URL.service_id.is_(None), URL.service.has(and_(*criteria))))
+
+
+def service_matches(service, active, type_fields, organization, environment, active_filter):
+    """
+    True if the service info and active status match the filters
     """
-    Return all known and active services
+    if any(service.type.get(field) != value for field, value in type_fields.items()):
+        return False
+    if organization and service.organization.get('name') != organization:
+        return False
+    if environment and getattr(service, 'environment', None) != environment:
+        return False
+    return active_filter is None or active == active_filter
+
+
+@tracing.traced
+def select_services(filters, limit, cursor, base_url):
+    """
+    Query the registered URLs for a page of list_services.
+
+    Returns (ServicePage, None), or (None, error response) for bad
+    parameters; base_url is used to link to the next page
     """
+    try:
+        type_fields = parse_type_filter(filters['type']) if filters['type'] else {}
+    except ValueError as e:
+        return None, (Error(status=400, title='Bad type filter', detail=str(e)), 400)
+
     db_session = orm.get_session()
     try:
-        urls = URL().query.all()
+        query = filter_urls(query_urls(db_session), type_fields, filters['organization'], filters['environment'])
+        if limit is not None:
+            query = query.order_by(URL.id)
+            if cursor:
+                query = query.filter(URL.id > uuid.UUID(cursor))
+            query = query.limit(limit + 1)
+        urls = query.all()
+    except ValueError:
+        return None, (Error(status=400, title='Bad cursor', detail=f"Cursor {cursor} is not valid"), 400)
     except orm.ORMException as e:
-        return Error(status=500, title='Error connecting to database', detail=str(e)), 500
+        return None, (Error(status=500, title='Error connecting to database', detail=str(e)), 500)
 
-    external_services = []
-    for url in urls:
-        service, active = get_service_info_and_active_status(url.url)
-        if not service:
-            continue
-        # overwrite ID and name with local values
-        service.id = url.id
-        service.name = url.name
-        service_as_dict = orm.dump(service)
-        service_as_dict['url'] = url.url
+    headers = dict(CORS_HEADERS)
+    if limit is not None and len(urls) > limit:
+        urls = urls[:limit]
+        next_params = {key: value for key, value in filters.items() if value is not None}
+        if filters['active'] is not None:
+            next_params['active'] = str(filters['active']).lower()
+        if filters['include']:
+            next_params['include'] = ','.join(filters['include'])
+        next_params.update(limit=limit, cursor=str(urls[-1].id))
+        headers['Link'] = f'<{base_url}?{urlencode(next_params)}>; rel="next"'
 
-        if not options.remove_active_status:
-            service_as_dict['active'] = active
+    return ServicePage(urls, type_fields, headers), None
 
-        external_services.append(ExternalService(**service_as_dict))
 
-    return [orm.dump(ext_svc) for ext_svc in external_services], 200, {'Access-Control-Allow-Origin':'*'}
+@tracing.traced
+def services_response(page, entries, filters, limit, cursor, request_headers, cohorts=None):
+    """
+    Response for a page of list_services, given the snapshot entries of its
+    URLs and, if they are included, the cohorts of fetch_page_cohorts
+    """
+    headers = page.headers
+    etag, last_modified = snapshot_validators(page.urls, entries, filters, limit, cursor, cohorts)
+    headers.update(conditional.cache_headers(etag, last_modified))
+    # Last-Modified, of the services listed, goes back when the latest
+    # checked is deleted, so only the ETag shows the list is unchanged
+    if conditional.not_modified(request_headers, etag):
+        return NoContent, 304, headers
 
+    external_services = [external_service_json(url, entry, None if cohorts is None else cohorts.get(url.url, []))
+                         for url, entry in zip(page.urls, entries)
+                         if entry.service and service_matches(entry.service, entry.active, page.type_fields,
+                                                              filters['organization'], filters['environment'],
+                                                              filters['active'])]
 
-@apilog
-def get_one_service(serviceId):
+    return models.encode_list(external_services), 200, headers
+
+
+@tracing.traced
+def select_one_service(serviceId):
     """
-    Return info for one service
+    Query the registered URL for get_one_service.
+
+    Returns (URL, None), or (None, error response) if there is none
     """
     db_session = orm.get_session()
     try:
-        q = db_session.query(models.URL).get(serviceId)
+        q = query_urls(db_session).get(serviceId)
     except orm.ORMException as e:
-        return Error(status=500, title='Error connecting to database', detail=str(e)), 500
+        return None, (Error(status=500, title='Error connecting to database', detail=str(e)), 500)
 
     if not q:
-        return Error(title="No such service found", detail="No result for service "+str(serviceId), status=404), 404
+        return None, (Error(title="No such service found", detail="No result for service "+str(serviceId), status=404), 404)
 
-    service, active = get_service_info_and_active_status(q.url)
+    return q, None
 
-    if not service:
-        return Error(title="Service not available", detail="Could not connect to service "+str(serviceId), status=404), 404
 
-    # overwrite ID and name with local values
-    service.id = q.id
-    service.name = q.name
-    service_as_dict = orm.dump(service)
-    service_as_dict['url'] = q.url
+@tracing.traced
+def one_service_response(q, entry, cohorts, request_headers):
+    """
+    Response for get_one_service, given the snapshot entry of its URL and,
+    if they are included, its cohorts
+    """
+    if not entry.service:
+        return Error(title="Service not available", detail="Could not connect to service "+str(q.id), status=404), 404
 
-    if not options.remove_active_status:
-        service_as_dict['active'] = active
+    etag, last_modified = snapshot_validators([q], [entry], cohorts)
+    headers = dict(CORS_HEADERS, **conditional.cache_headers(etag, last_modified))
+    if conditional.not_modified(request_headers, etag, last_modified):
+        return NoContent, 304, headers
+
+    return external_service_json(q, entry, cohorts), 200, headers
+
+
+@tracing.traced
+def cohorts_response(q, entry, cohorts, limit, cursor, base_url, request_headers):
+    """
+    Response for get_service_cohorts: a page of cohorts, those of the
+    service fetched by fetch_cohorts, given the snapshot entry of its URL;
+    base_url is used to link to the next page
+    """
+    if not entry.service:
+        return Error(title="Service not available", detail="Could not connect to service "+str(q.id), status=404), 404
+    try:
+        start = int(cursor) if cursor else 0
+        if start < 0:
+            raise ValueError(cursor)
+    except ValueError:
+        return Error(status=400, title='Bad cursor', detail=f"Cursor {cursor} is not valid"), 400
+
+    etag, last_modified = snapshot_validators([q], [entry], cohorts, limit, cursor)
+    headers = dict(CORS_HEADERS, **conditional.cache_headers(etag, last_modified))
+    if conditional.not_modified(request_headers, etag, last_modified):
+        return NoContent, 304, headers
+
+    end = len(cohorts) if limit is None else start + limit
+    if end < len(cohorts):
+        headers['Link'] = f'<{base_url}?{urlencode({"limit": limit, "cursor": end})}>; rel="next"'
+    return models.encode(cohorts[start:end]), 200, headers
+
+
+def this_service_response(request_headers):
+    """
+    Response for get_this_service
+    """
+    headers = dict(CORS_HEADERS, **conditional.cache_headers(THIS_SERVICE_ETAG))
+    if conditional.not_modified(request_headers, THIS_SERVICE_ETAG):
+        return NoContent, 304, headers
+
+    return orm.dump(THIS_SERVICE), 200, headers
+
+
+def service_types_response(request_headers):
+    """
+    Response for list_service_types
+    """
+    db_session = orm.get_read_session()
+    try:
+        service_types = db_session.query(Type.group, Type.artifact, Type.version) \
+            .join(ORM_Service, ORM_Service.type_id == Type.id) \
+            .join(URL, URL.service_id == ORM_Service.id) \
+            .distinct() \
+            .order_by(Type.group, Type.artifact, Type.version) \
+            .all()
+    except orm.ORMException as e:
+        return Error(status=500, title='Error connecting to database', detail=str(e)), 500
+
+    etag = conditional.make_etag([list(service_type) for service_type in service_types])
+    headers = dict(CORS_HEADERS, **conditional.cache_headers(etag))
+    if conditional.not_modified(request_headers, etag):
+        return NoContent, 304, headers
+
+    return [orm.dump(ServiceType(group=group, artifact=artifact, version=version))
+            for group, artifact, version in service_types], 200, headers
+
+
+def metrics_response():
+    """
+    The metrics text of get_metrics; not logged, as it is scraped often
+    """
+    return REGISTRY.render(), 200
 
-    external_service = ExternalService(**service_as_dict)
-    return orm.dump(external_service), 200, {'Access-Control-Allow-Origin':'*'}
+
+def flask_response(response):
+    """
+    Flask re-encodes the bodies of JSON operations, so return a response
+    whose body is already encoded as JSON bytes as a Flask response
+    """
+    body, status, *headers = response
+    if isinstance(body, bytes):
+        return current_app.response_class(body, status, *headers, mimetype='application/json')
+    return response
+
+
+def heartbeat_response(serviceId, service_data, token_info):
+    """
+    Response for heartbeat: record service_data, the service info sent by
+    the service registered as serviceId, as for a successful poll, and
+    lease it options.heartbeat_lease seconds without being polled.
+    token_info, of auth.heartbeat_token_info, must be for serviceId's token
+    or the admin token.
+    """
+    q, error = select_one_service(serviceId)
+    if error:
+        return error
+    if not auth.may_heartbeat(token_info, q.id):
+        err = Error(status=403, title='Forbidden', detail=f'Token was not issued for service {serviceId}')
+        return err, 403
+
+    checked_at = datetime.datetime.utcnow()
+    expires = checked_at + datetime.timedelta(seconds=options.heartbeat_lease)
+    db_session = orm.get_session()
+    try:
+        db_session.merge(Lease(url_id=q.id, expires=expires))
+    except orm.ORMException as e:
+        db_session.rollback()
+        return Error(status=500, title='Error writing to database', detail=str(e)), 500
+    # stored, with the lease, in record_service_infos's transaction
+    statuses = record_service_infos([q], [Probe(service_data, None, None)])
+    if options.poll_interval > 0:
+        update_snapshot([q], [SnapshotEntry(*statuses[0], checked_at)])
+
+    return {'id': str(q.id), 'expires': expires.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'interval': options.heartbeat_lease}, 200
+
+
+def registration_response(registrations, valid):
+    """
+    Response for register_services: store the (name, url) registrations
+    whose URLs passed validation, as given by the list of bools valid
+    """
+    invalid = [url for (_, url), ok in zip(registrations, valid) if not ok]
+    db_session = orm.get_session()
+    try:
+        added, existing, tokens = registration.register_urls(
+            db_session, [entry for entry, ok in zip(registrations, valid) if ok])
+    except orm.ORMException as e:
+        db_session.rollback()
+        return Error(status=500, title='Error writing to database', detail=str(e)), 500
+
+    return {'added': [{'id': str(url_orm.id), 'name': url_orm.name, 'url': url_orm.url, 'heartbeatToken': token}
+                      for url_orm, token in zip(added, tokens)],
+            'existing': existing, 'invalid': invalid}, 200
+
+
+def heartbeat_token_response(serviceId):
+    """
+    Response for issue_heartbeat_token: a new heartbeat token for the
+    service registered as serviceId, replacing any it had
+    """
+    q, error = select_one_service(serviceId)
+    if error:
+        return error
+
+    db_session = orm.get_session()
+    try:
+        token, = auth.issue_heartbeat_tokens(db_session, [q])
+        db_session.commit()
+    except orm.ORMException as e:
+        db_session.rollback()
+        return Error(status=500, title='Error writing to database', detail=str(e)), 500
+
+    return {'id': str(q.id), 'heartbeatToken': token}, 200
+
+
+@apilog
+def list_services(type=None, organization=None, environment=None, active=None,  # pylint: disable=redefined-builtin
+                  limit=None, cursor=None, include=None):
+    """
+    Return known services, optionally filtered, a page at a time
+    """
+    filters = {'type': type, 'organization': organization, 'environment': environment, 'active': active,
+               'include': include}
+    page, error = select_services(filters, limit, cursor, request.base_url)
+    if error:
+        return error
+
+    entries = get_snapshot_entries(page.urls)
+    cohorts = fetch_page_cohorts(page.urls, entries) if includes_cohorts(include) else None
+    return flask_response(services_response(page, entries, filters, limit, cursor, request.headers, cohorts))
+
+
+@apilog
+def get_one_service(serviceId, include=None):
+    """
+    Return info for one service
+    """
+    q, error = select_one_service(serviceId)
+    if error:
+        return error
+
+    entry, = get_snapshot_entries([q])
+    cohorts = fetch_cohorts(q.url) if entry.service and includes_cohorts(include) else None
+    return flask_response(one_service_response(q, entry, cohorts, request.headers))
+
+
+@apilog
+def get_service_cohorts(serviceId, limit=None, cursor=None):
+    """
+    Return the cohorts of one service, a page at a time
+    """
+    q, error = select_one_service(serviceId)
+    if error:
+        return error
+
+    entry, = get_snapshot_entries([q])
+    cohorts = fetch_cohorts(q.url) if entry.service else None
+    return flask_response(cohorts_response(q, entry, cohorts, limit, cursor, request.base_url, request.headers))
 
 
 @apilog
@@ -190,27 +881,62 @@ def get_this_service():
     """
     Return info for this service
     """
-    return orm.dump(THIS_SERVICE), 200, {'Access-Control-Allow-Origin':'*'}
+    return this_service_response(request.headers)
+
+
+@apilog
+def heartbeat(serviceId, body, token_info=None):
+    """
+    Record a heartbeat of a registered service, carrying its service info
+    """
+    return heartbeat_response(serviceId, body, token_info)
+
+
+@apilog
+def issue_heartbeat_token(serviceId):
+    """
+    Issue a new heartbeat token for a registered service
+    """
+    return heartbeat_token_response(serviceId)
+
+
+@apilog
+def watch_services(since=None):
+    """
+    Return the changes to the registry since the given one as Server-Sent
+    Events.  The stream ends, to be reconnected to, as Flask served from
+    tornado's WSGIContainer can't stream; tornado serves the open-ended
+    stream itself (see watch.WatchHandler).
+    """
+    seq = watch.last_event_id(since, request.headers.get('Last-Event-ID'))
+    return current_app.response_class(watch.catch_up(seq), mimetype='text/event-stream',
+                                      headers=dict(CORS_HEADERS, **{'Cache-Control': 'no-cache'}))
+
+
+def get_metrics():
+    """
+    Return this process's metrics in the Prometheus text format
+    """
+    return metrics_response()
 
 
 @apilog
 def list_service_types():
     """
-    Return all known and active services
+    Return the distinct types of registered services, as stored in the database
     """
-    db_session = orm.get_session()
-    try:
-        urls = URL().query.all()
-    except orm.ORMException as e:
-        return Error(status=500, title='Error connecting to database', detail=str(e)), 500
+    return service_types_response(request.headers)
 
-    service_types = []
-    for url in urls:
-        service, _ = get_service_info_and_active_status(url.url)
-        if not service:
-            continue
-        service_type = ServiceType(**service.type)
-        if not service_type in service_types:
-            service_types.append(service_type)
 
-    return [orm.dump(svc_type) for svc_type in service_types], 200, {'Access-Control-Allow-Origin':'*'}
+@apilog
+def register_services(body, validate=True):
+    """
+    Register a batch of services, contacting their URLs concurrently to validate them
+    """
+    registrations = [(entry['name'], entry['url']) for entry in body]
+    if validate:
+        valid = registration.validate_urls([url for _, url in registrations], max_workers=options.fetch_concurrency,
+                                           timeout=client.default_timeout())
+    else:
+        valid = [True] * len(registrations)
+    return registration_response(registrations, valid)
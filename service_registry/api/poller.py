@@ -0,0 +1,143 @@
+"""
+Background polling of registered services into a snapshot, kept in memory
+or, when serving from several processes, in the database
+"""
+import json
+import sys
+import threading
+from collections import namedtuple
+from sqlalchemy import select
+from service_registry import orm
+from service_registry.api.models import Service
+from service_registry.orm.models import URLStatus
+
+SnapshotEntry = namedtuple('SnapshotEntry', ['service', 'active', 'last_checked'])
+
+
+class Snapshot():
+    """
+    Thread-safe map of registered URL -> last polled SnapshotEntry
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, urls):
+        """Return a dict of the SnapshotEntry of each of urls which has been polled"""
+        entries = self._entries
+        return {url: entries[url] for url in urls if url in entries}
+
+    def update_many(self, entries):
+        """Record the results of polling, a dict of url -> SnapshotEntry"""
+        with self._lock:
+            self._entries.update(entries)
+
+    def retain(self, urls):
+        """Forget every URL not in urls, returning those forgotten"""
+        urls = set(urls)
+        with self._lock:
+            stale = [url for url in self._entries if url not in urls]
+            for url in stale:
+                del self._entries[url]
+        return stale
+
+    def clear(self):
+        """Forget every URL"""
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedSnapshot():
+    """
+    Snapshot with the same interface as Snapshot, kept in the url_statuses
+    table so that worker processes share the results of a single poller
+    """
+    # bound parameters per statement, under SQLite's default limit
+    CHUNK_SIZE = 500
+
+    def get_many(self, urls):
+        """Return a dict of the SnapshotEntry of each of urls which has been polled"""
+        table = URLStatus.__table__
+        entries = {}
+        with orm.get_read_engine().connect() as connection:
+            for chunk in _chunks(list(urls), self.CHUNK_SIZE):
+                for row in connection.execute(table.select().where(table.c.url.in_(chunk))):
+                    service = Service(**json.loads(row.service)) if row.service else None
+                    entries[row.url] = SnapshotEntry(service, row.active, row.last_checked)
+        return entries
+
+    def update_many(self, entries):
+        """Record the results of polling, a dict of url -> SnapshotEntry"""
+        table = URLStatus.__table__
+        rows = [{'url': url, 'active': entry.active, 'last_checked': entry.last_checked,
+                 'service': json.dumps(orm.dump(entry.service), default=orm.dump) if entry.service else None}
+                for url, entry in entries.items()]
+        with orm.get_engine().begin() as connection:
+            for chunk in _chunks(rows, self.CHUNK_SIZE):
+                connection.execute(table.delete().where(table.c.url.in_([row['url'] for row in chunk])))
+                connection.execute(table.insert(), chunk)
+
+    def retain(self, urls):
+        """Forget every URL not in urls, returning those forgotten"""
+        table = URLStatus.__table__
+        urls = set(urls)
+        with orm.get_engine().begin() as connection:
+            stale = [url for url, in connection.execute(select(table.c.url)) if url not in urls]
+            for chunk in _chunks(stale, self.CHUNK_SIZE):
+                connection.execute(table.delete().where(table.c.url.in_(chunk)))
+        return stale
+
+    def clear(self):
+        """Forget every URL"""
+        with orm.get_engine().begin() as connection:
+            connection.execute(URLStatus.__table__.delete())
+
+
+def _chunks(items, size):
+    """Successive slices of items of at most size"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+SNAPSHOT = Snapshot()
+
+
+def share_snapshot():
+    """
+    Keep the snapshot in the database from now on, to be shared by
+    processes forked afterwards; entries left by earlier runs are dropped
+    """
+    global SNAPSHOT  # pylint: disable=global-statement
+    SNAPSHOT = SharedSnapshot()
+    SNAPSHOT.clear()
+
+
+class Poller(threading.Thread):
+    """
+    Daemon thread calling refresh() every interval seconds
+    """
+    def __init__(self, interval, refresh):
+        super().__init__(name='poller', daemon=True)
+        self.interval = interval
+        self.refresh = refresh
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Error polling services: {e}", file=sys.stderr, flush=True)
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        """Stop polling after the current refresh"""
+        self._stopped.set()
+
+
+def start_poller(interval, refresh):
+    """
+    Start polling in the background; returns the Poller thread
+    """
+    poller = Poller(interval, refresh)
+    poller.start()
+    return poller
@@ -0,0 +1,103 @@
+"""
+Registration of service URLs, one at a time or in bulk
+"""
+import csv
+import json
+import sys
+import uuid
+import requests
+from service_registry.api import auth, client
+from service_registry.api.fanout import fan_out
+from service_registry.orm.models import URL
+
+# bound parameters per statement, under SQLite's default limit
+CHUNK_SIZE = 500
+
+
+def parse_registrations(lines):
+    """
+    Parse (name, url) pairs from lines of JSONL, objects with name and url
+    members, or of CSV, name,url rows with an optional header row.
+
+    Blank lines are skipped; raises ValueError on a malformed line.
+    """
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return []
+
+    registrations = []
+    if lines[0].lstrip().startswith('{'):
+        for number, line in enumerate(lines, 1):
+            try:
+                entry = json.loads(line)
+                registrations.append((entry['name'], entry['url']))
+            except (ValueError, TypeError, KeyError) as e:
+                raise ValueError(f"line {number}: expected an object with name and url ({e})")
+        return registrations
+
+    for number, row in enumerate(csv.reader(lines), 1):
+        if number == 1 and [field.strip().lower() for field in row] == ['name', 'url']:
+            continue
+        if len(row) != 2:
+            raise ValueError(f"line {number}: expected name,url")
+        registrations.append((row[0].strip(), row[1].strip()))
+    return registrations
+
+
+def validate_url(url, timeout=5):
+    """
+    Return True iff <url> is a valid URL address that can be connected to.
+
+    :param url: URL address to be validated
+    :param timeout: seconds to wait for a response
+    :return: bool
+    """
+    valid = False
+    try:
+        client.get(url, timeout=timeout)
+        valid = True
+    except requests.exceptions.Timeout as e:
+        print("Timeout occurred", file=sys.stderr, flush=True)
+        print(e, file=sys.stderr, flush=True)
+    except requests.ConnectionError as e:
+        print("Unable to connect", file=sys.stderr, flush=True)
+        print(e, file=sys.stderr, flush=True)
+    except (requests.RequestException, Exception) as e:
+        print(e, file=sys.stderr, flush=True)
+
+    return valid
+
+
+def validate_urls(urls, max_workers=16, timeout=5):
+    """
+    validate_url every one of urls, at most max_workers at once; returns
+    a list of bools in the same order
+    """
+    return [result is True for result in fan_out(lambda url: validate_url(url, timeout), urls, max_workers)]
+
+
+def register_urls(db_session, registrations):
+    """
+    Store the (name, url) registrations whose URLs aren't registered yet,
+    in one transaction; the first of several registrations of a URL wins.
+
+    Returns (list of added URLs, list of the url strings already registered,
+    list of the heartbeat tokens issued to the added URLs)
+    """
+    unique = {}
+    for name, url in registrations:
+        unique.setdefault(url, name)
+
+    urls = list(unique)
+    existing = set()
+    for start in range(0, len(urls), CHUNK_SIZE):
+        chunk = urls[start:start + CHUNK_SIZE]
+        existing.update(url for url, in db_session.query(URL.url).filter(URL.url.in_(chunk)))
+
+    added = [URL(id=uuid.uuid4(), name=name, url=url) for url, name in unique.items() if url not in existing]
+    tokens = []
+    if added:
+        db_session.add_all(added)
+        tokens = auth.issue_heartbeat_tokens(db_session, added)
+        db_session.commit()
+    return added, [url for url in urls if url in existing], tokens
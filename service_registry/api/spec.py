@@ -0,0 +1,83 @@
+"""
+The API spec, cached as JSON once connexion has validated it, so that
+restarts needn't parse and validate the YAML again
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import connexion
+import yaml
+from connexion.spec import OpenAPISpecification
+
+SPEC_FILE = os.path.join(os.path.dirname(__file__), 'swagger.yaml')
+
+
+def _key(contents):
+    """Identifies contents of the spec as validated by this version of connexion"""
+    return hashlib.sha256(connexion.__version__.encode('utf-8') + b'\0' + contents).hexdigest()
+
+
+class CachedSpec():
+    """
+    The spec at path, loaded from the JSON at cache_path if it was cached
+    there from the same YAML, else parsed afresh; call save once connexion
+    has accepted it to cache it.  Without a cache_path nothing is cached.
+    """
+    def __init__(self, path=SPEC_FILE, cache_path=None):
+        self.cache_path = cache_path
+        with open(path, 'rb') as spec_file:
+            contents = spec_file.read()
+        self.key = _key(contents)
+        self.validated = False
+        self._json = None
+        cached = self._load_cache()
+        if cached is not None:
+            self.spec, self.validated = cached, True
+        else:
+            self.spec = yaml.load(contents, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+            try:
+                # now, as connexion adds its defaults to the spec it is given
+                self._json = json.dumps({'key': self.key, 'spec': self.spec})
+            except TypeError:
+                pass  # YAML values JSON can't hold, such as dates, aren't cached
+
+    def _load_cache(self):
+        """The cached spec, if cached from the same YAML"""
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, encoding='utf-8') as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        return cached['spec'] if isinstance(cached, dict) and cached.get('key') == self.key else None
+
+    @contextlib.contextmanager
+    def trusted(self):
+        """
+        While adding the API, skip connexion's validation of the spec
+        itself if it was validated before it was cached
+        """
+        if not self.validated:
+            yield
+            return
+        validate_spec = OpenAPISpecification.__dict__['_validate_spec']
+        OpenAPISpecification._validate_spec = classmethod(lambda cls, spec: None)  # pylint: disable=protected-access
+        try:
+            yield
+        finally:
+            OpenAPISpecification._validate_spec = validate_spec  # pylint: disable=protected-access
+
+    def save(self):
+        """Cache the spec, if it wasn't loaded from the cache"""
+        if not self.cache_path or self.validated or self._json is None:
+            return
+        temporary = f'{self.cache_path}.{os.getpid()}'
+        try:
+            with open(temporary, 'w', encoding='utf-8') as cache_file:
+                cache_file.write(self._json)
+            os.replace(temporary, self.cache_path)
+        except OSError as e:
+            print(f"Couldn't cache the API spec in {self.cache_path}: {e}", file=sys.stderr, flush=True)
@@ -0,0 +1,100 @@
+"""
+Fetching of service-info and cohorts documents from registered services
+"""
+import requests
+from service_registry import tracing
+from service_registry.api import client
+from service_registry.api.breaker import PeerBreakers, PeerUnavailable, OPEN
+from service_registry.api.cache import TTLCache
+from service_registry.metrics import REGISTRY, Counter, Histogram
+
+CACHE = TTLCache()
+BREAKERS = PeerBreakers()
+
+UPSTREAM_SECONDS = Histogram('service_registry_upstream_duration_seconds',
+                             'Time taken by registered services to respond', ['peer'])
+UPSTREAM_REQUESTS = Counter('service_registry_upstream_requests_total',
+                            'Calls to registered services, by outcome: ok, http_error, timeout, '
+                            'connection_error or circuit_open', ['peer', 'outcome'])
+
+
+def get_json(url, service_url, timeout=None):
+    """
+    GET url, an endpoint of the service registered as service_url,
+    returning (status code, JSON body or None if not 200, seconds the
+    service took to respond when the response was fetched).
+
+    Responses are cached in CACHE, and concurrent requests for the same
+    url share one upstream call; the JSON body is shared too, so callers
+    must copy it before modifying it.  Connection errors are raised.
+
+    Calls are recorded in service_url's circuit breaker in BREAKERS, and
+    while its circuit is open breaker.PeerUnavailable is raised without
+    contacting it.  The timeout defaults to the client's configured
+    (connect, read) timeouts, adapted to the service's recent latency.
+    """
+    return CACHE.get_or_fetch(url, lambda: _get_json(url, service_url, timeout))
+
+
+def record_call(service_url, outcome, status_code=None, latency=None):
+    """
+    Record a call to the service registered as service_url, and how it
+    went, in the metrics and, unless it was never made, in its circuit
+    breaker
+    """
+    UPSTREAM_REQUESTS.inc(service_url, outcome)
+    if latency is not None:
+        UPSTREAM_SECONDS.observe(latency, service_url)
+    if outcome != 'circuit_open':
+        BREAKERS.record(service_url, status_code, latency)
+
+
+def _get_json(url, service_url, timeout):
+    with tracing.span('http.get', **{'http.url': url}) as span:
+        status_code, payload, latency = _request_json(url, service_url, timeout)
+        if span is not None:
+            span.set('http.status_code', status_code)
+        return status_code, payload, latency
+
+
+def _request_json(url, service_url, timeout):
+    try:
+        BREAKERS.check(service_url)
+    except PeerUnavailable:
+        record_call(service_url, 'circuit_open')
+        raise
+    if timeout is None:
+        timeout = BREAKERS.timeout(service_url, client.default_timeout())
+    try:
+        r = client.get(url, timeout=timeout, headers=tracing.headers())
+    except requests.exceptions.Timeout:
+        record_call(service_url, 'timeout')
+        raise
+    except requests.RequestException:
+        record_call(service_url, 'connection_error')
+        raise
+    latency = r.elapsed.total_seconds()
+    record_call(service_url, 'ok' if r.status_code == 200 else 'http_error', r.status_code, latency)
+    if r.status_code != 200:
+        return r.status_code, None, latency
+    return r.status_code, r.json(), latency
+
+
+def collect_metrics():
+    """Metrics of CACHE and BREAKERS, for the metrics registry"""
+    stats = CACHE.stats()
+    yield ('service_registry_upstream_cache_lookups_total', 'counter',
+           'Lookups of cached service responses, by result',
+           [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses']),
+            ({'result': 'collapsed'}, stats['collapsed'])])
+    yield ('service_registry_upstream_cache_removals_total', 'counter',
+           'Cached service responses removed, by reason',
+           [({'reason': 'evicted'}, stats['evictions']), ({'reason': 'expired'}, stats['expirations'])])
+    yield ('service_registry_upstream_cache_entries', 'gauge', 'Cached service responses',
+           [({}, stats['size'])])
+    yield ('service_registry_upstream_circuit_open', 'gauge',
+           'Whether calls to each peer are being skipped (1) or not (0)',
+           [({'peer': key}, int(peer_stats['state'] == OPEN)) for key, peer_stats in BREAKERS.stats().items()])
+
+
+REGISTRY.add_collector(collect_metrics)
@@ -0,0 +1,194 @@
+"""
+Changes to the registry, streamed to watchers of /services/watch as
+Server-Sent Events
+"""
+import asyncio
+import datetime
+import json
+import threading
+import tornado.web
+from tornado.iostream import StreamClosedError
+from sqlalchemy import func, select
+from service_registry import orm
+from service_registry.api import models
+from service_registry.orm.models import Change
+
+# seconds between looking for new changes, and between keep-alive comments
+CHECK_INTERVAL = 1.0
+KEEPALIVE_INTERVAL = 15.0
+# most changes sent at once
+BATCH_SIZE = 500
+# milliseconds clients wait before reconnecting
+RETRY = 2000
+
+
+class ChangeFeed():
+    """
+    Numbered changes to the registry, kept in the changes table so that
+    watchers can resume from the last one they saw, across restarts.
+
+    The last number is remembered when changes are published, so watchers
+    of a single process only query the table when there's something new;
+    when shared between processes, any of which may publish, it is looked up.
+    """
+    def __init__(self):
+        self.shared = False
+        self._latest = None
+        self._lock = threading.Lock()
+
+    def share(self):
+        """Look up the last change in the database from now on"""
+        self.shared = True
+
+    def publish(self, changes):
+        """Record changes, dicts of their kind, url and data to send"""
+        if not changes:
+            return
+        table = Change.__table__
+        created = datetime.datetime.utcnow()
+        with orm.get_engine().begin() as connection:
+            connection.execute(table.insert(), [{'kind': change['kind'], 'url': change['url'], 'created': created,
+                                                 'data': models.encode(change['data']).decode('utf-8')}
+                                                for change in changes])
+            latest = connection.execute(select(func.max(table.c.seq))).scalar()
+        with self._lock:
+            self._latest = max(latest, self._latest or 0)
+
+    def prune(self, before):
+        """
+        Forget changes made before the datetime before, but for the last,
+        so that numbers are never reused
+        """
+        table = Change.__table__
+        with orm.get_engine().begin() as connection:
+            connection.execute(table.delete().where(table.c.created < before,
+                                                    table.c.seq < select(func.max(table.c.seq)).scalar_subquery()))
+
+    def latest(self):
+        """Number of the last change, or 0 if there have been none"""
+        if self.shared or self._latest is None:
+            with orm.get_read_engine().connect() as connection:
+                latest = connection.execute(select(func.max(Change.__table__.c.seq))).scalar() or 0
+            with self._lock:
+                self._latest = max(latest, self._latest or 0)
+        return self._latest
+
+    def resumable(self, seq):
+        """Whether every change after seq is still kept"""
+        if seq < 0 or seq > self.latest():
+            return False
+        with orm.get_read_engine().connect() as connection:
+            first = connection.execute(select(func.min(Change.__table__.c.seq))).scalar()
+        return first is None or seq >= first - 1
+
+    def since(self, seq):
+        """Up to BATCH_SIZE (seq, kind, data) of the changes after seq, in order"""
+        if not self.shared and seq >= self.latest():
+            return []
+        table = Change.__table__
+        with orm.get_read_engine().connect() as connection:
+            return [tuple(row) for row in connection.execute(
+                select(table.c.seq, table.c.kind, table.c.data)
+                .where(table.c.seq > seq).order_by(table.c.seq).limit(BATCH_SIZE))]
+
+
+FEED = ChangeFeed()
+
+
+def format_event(seq, kind, data):
+    """A Server-Sent Event of a change; data is its JSON"""
+    return f'id: {seq}\nevent: {kind}\ndata: {data}\n\n'
+
+
+def last_event_id(since, header=None):
+    """
+    Number of the last change a watcher saw: its Last-Event-ID header
+    when reconnecting, else the since parameter, else None for a new
+    watcher.  Malformed IDs are -1, which can't be resumed from.
+    """
+    if header is None:
+        return since
+    try:
+        return int(header)
+    except ValueError:
+        return -1
+
+
+def opening(seq):
+    """
+    The events opening a stream resuming from change seq, and the number
+    of the change to continue from.
+
+    New watchers (seq None) are sent a ready event with the number of the
+    last change, to resume from; those whose changes were pruned, or who
+    come from a different database, a reset event, after which they should
+    list the services afresh.
+    """
+    text = f'retry: {RETRY}\n\n'
+    if seq is None or not FEED.resumable(seq):
+        latest = FEED.latest()
+        text += format_event(latest, 'ready' if seq is None else 'reset', json.dumps({'seq': latest}))
+        seq = latest
+    return text, seq
+
+
+def catch_up(seq):
+    """
+    Event stream of the changes after seq which ends, for servers which
+    can't stream; clients reconnect after RETRY milliseconds to continue
+    """
+    text, seq = opening(seq)
+    return text + ''.join(format_event(*change) for change in FEED.since(seq))
+
+
+async def stream(send, seq, executor=None):
+    """
+    Send the changes after seq, then each change as it is published, as
+    Server-Sent Events through the coroutine send, until send raises.
+    Changes are read from the database on executor if given, else on the
+    event loop.
+    """
+    loop = asyncio.get_running_loop()
+    text, seq = await loop.run_in_executor(executor, opening, seq) if executor else opening(seq)
+    await send(text)
+    idle = 0.0
+    while True:
+        changes = await loop.run_in_executor(executor, FEED.since, seq) if executor else FEED.since(seq)
+        if changes:
+            await send(''.join(format_event(*change) for change in changes))
+            seq = changes[-1][0]
+            idle = 0.0
+        elif idle >= KEEPALIVE_INTERVAL:
+            await send(': keep-alive\n\n')
+            idle = 0.0
+        if len(changes) < BATCH_SIZE:
+            await asyncio.sleep(CHECK_INTERVAL)
+            idle += CHECK_INTERVAL
+
+
+class WatchHandler(tornado.web.RequestHandler):
+    """
+    Streams /services/watch under tornado, in front of the Flask app,
+    which can't stream through tornado's WSGIContainer
+    """
+    async def get(self):
+        try:
+            since = self.get_query_argument('since', None)
+            seq = last_event_id(int(since) if since is not None else None, self.request.headers.get('Last-Event-ID'))
+        except ValueError:
+            self.set_status(400)
+            self.finish({'status': 400, 'title': 'Bad since', 'detail': 'since must be an integer'})
+            return
+
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('Access-Control-Allow-Origin', '*')
+
+        async def send(text):
+            self.write(text)
+            await self.flush()
+
+        try:
+            await stream(send, seq)
+        except StreamClosedError:
+            pass
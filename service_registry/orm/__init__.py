@@ -2,19 +2,41 @@
 ORM module for service
 """
 import os
+import time
 import warnings
 from sqlalchemy import event, create_engine, exc
+from sqlalchemy.engine import make_url
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from tornado.options import options
+from service_registry import tracing
+from service_registry.orm.guid import use_binary
+from service_registry.metrics import Histogram
 
 ORMException = SQLAlchemyError
 
 Base = declarative_base()
 
 _ENGINE = None
+_READ_ENGINE = None
 _DB_SESSION = None
+_READ_SESSION = None
+_SCOPEFUNC = None
+
+DB_QUERY_SECONDS = Histogram('service_registry_db_query_duration_seconds',
+                             'Time taken by database statements', ['engine', 'statement'])
+
+# PRAGMAs set on each new connection to a SQLite database file
+SQLITE_PROFILES = {
+    # SQLite's own defaults
+    'none': {},
+    # WAL lets readers proceed while the database is being written, and
+    # NORMAL synchronous is still durable against application crashes in WAL
+    'performance': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -16000,
+                    'mmap_size': 268435456, 'busy_timeout': 5000},
+}
 
 
 # From http://docs.sqlalchemy.org/en/latest/faq/connections.html
@@ -49,32 +71,219 @@ def add_engine_pidguard(engine):
             )
 
 
-def init_db(uri=None):
+def _statement_kind(statement):
+    """select, insert, update, delete or other"""
+    kind = statement.lstrip()[:6].lower()
+    return kind if kind in ('select', 'insert', 'update', 'delete') else 'other'
+
+
+def add_engine_metrics(engine, name):
+    """
+    Time every statement executed through the engine in DB_QUERY_SECONDS,
+    labelled with name and the statement's kind (select, insert, ...)
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany):  # pylint:disable=unused-variable
+        """Note the start time"""
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, _cursor, statement, _parameters, _context, _executemany):  # pylint:disable=unused-variable
+        """Record the time taken"""
+        elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+        DB_QUERY_SECONDS.observe(elapsed, name, _statement_kind(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):  # pylint:disable=unused-variable
+        """Forget the start time of a failed statement"""
+        starts = exception_context.connection.info.get('query_start_time') \
+            if exception_context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+def add_engine_tracing(engine, name):
+    """
+    Give every statement executed through the engine, for a traced
+    request, a span of its own
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, _cursor, statement, _parameters, _context, _executemany):  # pylint:disable=unused-variable
+        """Start the span"""
+        conn.info.setdefault('query_spans', []).append(
+            tracing.start_span(f'db.{_statement_kind(statement)}', **{'db.engine': name, 'db.statement': statement[:500]}))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany):  # pylint:disable=unused-variable
+        """End the span"""
+        span = conn.info['query_spans'].pop()
+        if span is not None:
+            span.end()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):  # pylint:disable=unused-variable
+        """End the span of a failed statement"""
+        spans = exception_context.connection.info.get('query_spans') \
+            if exception_context.connection is not None else None
+        if spans:
+            span = spans.pop()
+            if span is not None:
+                span.end(exception_context.original_exception)
+
+
+def add_sqlite_pragmas(engine, pragmas, query_only=False):
+    """
+    Set pragmas, and optionally make the connection read-only, on every
+    new connection of a SQLite engine
+    """
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, _connection_record):  # pylint:disable=unused-variable
+        """Apply the pragmas"""
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+def _is_sqlite_file(url):
+    """True if url is of a SQLite database file, rather than in memory or another database"""
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def _create_engine(uri, sqlite_profile, pool_size, max_overflow, statement_timeout, query_only=False):
     """
-    Creates the DB engine + ORM
+    Create a pooled engine for uri.  Connections to SQLite files are tuned
+    with the named profile of SQLITE_PROFILES; connections to other
+    databases are checked before use, and to PostgreSQL have their
+    statements cancelled after statement_timeout seconds, if given
     """
-    global _ENGINE
+    url = make_url(uri)
+    if _is_sqlite_file(url):
+        # pooled connections are handed between threads, one at a time
+        engine = create_engine(uri, convert_unicode=True, poolclass=QueuePool,
+                               pool_size=pool_size, max_overflow=max_overflow,
+                               connect_args={'check_same_thread': False})
+        pragmas = dict(SQLITE_PROFILES[sqlite_profile])
+        if query_only:
+            # the journal mode is a property of the file, set by the writer
+            pragmas.pop('journal_mode', None)
+        add_sqlite_pragmas(engine, pragmas, query_only)
+    elif url.get_backend_name() == 'sqlite':
+        engine = create_engine(uri, convert_unicode=True)
+    else:
+        connect_args = {}
+        if statement_timeout and url.get_backend_name() == 'postgresql':
+            connect_args['options'] = f'-c statement_timeout={int(statement_timeout * 1000)}'
+        engine = create_engine(uri, convert_unicode=True, pool_size=pool_size, max_overflow=max_overflow,
+                               pool_pre_ping=True, connect_args=connect_args)
+    add_engine_pidguard(engine)
+    add_engine_metrics(engine, 'read' if query_only else 'primary')
+    if tracing.enabled():
+        add_engine_tracing(engine, 'read' if query_only else 'primary')
+    return engine
+
+
+def init_db(uri=None, sqlite_profile='performance', pool_size=5, max_overflow=10, statement_timeout=None,
+            guid_storage=None):
+    """
+    Creates the DB engines + ORM.
+
+    Besides the main engine, SQLite files get a separate pool of read-only
+    connections for query-only endpoints (see get_read_session).  Sessions
+    of an earlier call are discarded.
+
+    GUIDs are stored as guid_storage, 'binary' or 'char', converting those
+    of an existing SQLite database; by default an existing database keeps
+    its storage, and new ones are binary.
+
+    Tables are only created and upgraded if the schema recorded in the
+    database differs from the models', as checking each table is slow.
+    """
+    global _ENGINE, _READ_ENGINE, _DB_SESSION, _READ_SESSION
+    remove_sessions()
+    _DB_SESSION = _READ_SESSION = None
     import service_registry.orm.models # noqa401 #pylint: disable=unused-variable
+    from service_registry.orm.migrations import schema_current, stored_schema, stores_binary_guids, upgrade
     if not uri:
         uri = 'sqlite:///' + options.dbfile
-    _ENGINE = create_engine(uri, convert_unicode=True)
-    add_engine_pidguard(_ENGINE)
-    Base.metadata.create_all(bind=_ENGINE)
+    engine_args = (sqlite_profile, pool_size, max_overflow, statement_timeout)
+    _ENGINE = _create_engine(uri, *engine_args)
+    stored = stored_schema(_ENGINE)
+    if guid_storage is not None:
+        binary = guid_storage == 'binary'
+    elif stored is not None:
+        binary = stored[1]
+    else:
+        with _ENGINE.connect() as connection:
+            binary = stores_binary_guids(connection) is not False
+    use_binary(_ENGINE, binary)
+    if not schema_current(_ENGINE, stored):
+        Base.metadata.create_all(bind=_ENGINE)
+        upgrade(_ENGINE)
 
+    if _is_sqlite_file(_ENGINE.url):
+        _READ_ENGINE = _create_engine(uri, *engine_args, query_only=True)
+        use_binary(_READ_ENGINE, binary)
+    else:
+        _READ_ENGINE = _ENGINE
 
-def get_session(**kwargs):
+
+def get_engine():
+    """
+    Return the DB engine, for bulk statements outside the ORM session
+    """
+    return _ENGINE
+
+
+def get_read_engine():
     """
-    Start the database session
+    Return the read-only DB engine, for bulk queries outside the ORM session
     """
-    global _DB_SESSION
+    return _READ_ENGINE
+
+
+def get_session(scopefunc=None, **kwargs):
+    """
+    Start the database session; sessions are per-thread unless scopefunc,
+    which identifies the current scope, is given on the first call
+    """
+    global _DB_SESSION, _SCOPEFUNC
     if not _DB_SESSION:
+        _SCOPEFUNC = scopefunc
         _DB_SESSION = scoped_session(sessionmaker(autocommit=False,
                                                   autoflush=False,
-                                                  bind=_ENGINE, **kwargs))
+                                                  bind=_ENGINE, **kwargs),
+                                     scopefunc=scopefunc)
         Base.query = _DB_SESSION.query_property()
     return _DB_SESSION
 
 
+def get_read_session():
+    """
+    Start the read-only database session, scoped as get_session's, for
+    endpoints which only query; its connections can't write, and aren't
+    held up by those busy writing
+    """
+    global _READ_SESSION
+    if not _READ_SESSION:
+        _READ_SESSION = scoped_session(sessionmaker(autocommit=False,
+                                                    autoflush=False,
+                                                    bind=_READ_ENGINE),
+                                       scopefunc=_SCOPEFUNC)
+    return _READ_SESSION
+
+
+def remove_sessions():
+    """
+    Tear down the current scope's database sessions
+    """
+    for session in (_DB_SESSION, _READ_SESSION):
+        if session is not None:
+            session.remove()
+
+
 def dump(obj, nonulls=True):
     """
     Generate dictionary of fields without SQLAlchemy internal fields
@@ -2,27 +2,56 @@
 """
 UUIDs for the database - from SQLAlchemy docs
 """
+import functools
 import uuid
 
-from sqlalchemy import TypeDecorator, CHAR
+from sqlalchemy import TypeDecorator, CHAR, BINARY, BLOB
 from sqlalchemy.dialects.postgresql import UUID
 
+# distinct IDs whose UUID objects are kept, so rows read repeatedly don't each build them
+UUID_CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=UUID_CACHE_SIZE)
+def _uuid(value):
+    """The UUID of its 16 bytes or string; UUIDs are immutable, so can be shared"""
+    if isinstance(value, bytes):
+        return uuid.UUID(bytes=value)
+    return uuid.UUID(value)
+
+
+def use_binary(engine, binary=True):
+    """
+    Store GUIDs as 16 bytes rather than 32 hex characters through engine,
+    other than to PostgreSQL, which has UUIDs.  Set before engine is used.
+    """
+    engine.dialect.binary_guids = binary
+
+
+def uses_binary(dialect):
+    """Whether GUIDs are stored as bytes through dialect"""
+    return getattr(dialect, 'binary_guids', False)
+
 
 class GUID(TypeDecorator):  # pylint: disable=abstract-method
     """Platform-independent GUID type.
 
     Uses Postgresql's UUID type, otherwise uses
-    CHAR(32), storing as stringified hex values.
+    CHAR(32), storing as stringified hex values, or with use_binary,
+    BINARY(16) (BLOB in SQLite), storing the UUIDs' bytes.
 
     from SQLAlchemy Docs
     http://docs.sqlalchemy.org/en/rel_0_9/core/custom_types.html
     """
     impl = CHAR
+    cache_ok = True
 
     def load_dialect_impl(self, dialect):
-        """Dialect-specific implementation; use UUIDs for Postgres, otherwise CHAR"""
+        """Dialect-specific implementation; use UUIDs for Postgres, otherwise CHAR or binary"""
         if dialect.name == 'postgresql':
             return dialect.type_descriptor(UUID())
+        elif uses_binary(dialect):
+            return dialect.type_descriptor(BLOB() if dialect.name == 'sqlite' else BINARY(16))
         else:
             return dialect.type_descriptor(CHAR(32))
 
@@ -30,18 +59,19 @@ class GUID(TypeDecorator):  # pylint: disable=abstract-method
         """Process the value and return"""
         if value is None:
             return value
-        elif dialect.name == 'postgresql':
+        if not isinstance(value, uuid.UUID):
+            value = _uuid(value)
+        if dialect.name == 'postgresql':
             return str(value)
+        elif uses_binary(dialect):
+            return value.bytes
         else:
-            if not isinstance(value, uuid.UUID):
-                return "%.32x" % uuid.UUID(value).int  # noqa # pylint: disable=no-member
-            else:
-                # hexstring
-                return "%.32x" % value.int
+            # hexstring
+            return value.hex
 
     def process_result_value(self, value, dialect):
         """Process provided value"""
         if value is None:
             return value
         else:
-            return uuid.UUID(value)
+            return _uuid(value)
@@ -0,0 +1,142 @@
+"""
+In-place upgrades of databases created by earlier versions of the models
+"""
+import hashlib
+from sqlalchemy import column, exc, func, inspect, select, table as table_clause
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.types import NullType, _Binary
+from service_registry.orm import Base
+from service_registry.orm.guid import GUID, uses_binary, _uuid
+from service_registry.orm.models import SchemaVersion
+
+# rows copied at a time when converting GUIDs
+COPY_BATCH_SIZE = 1000
+# part of the schema fingerprint; bump when upgrade changes without the models
+REVISION = 1
+
+
+def upgrade(engine):
+    """
+    Bring the tables of an existing database up to date with the models.
+
+    create_all only creates missing tables, so indexes and constraints
+    added to existing tables are created here, and GUIDs are converted to
+    the storage engine uses (see guid.use_binary).  Safe to run repeatedly.
+    """
+    with engine.begin() as connection:
+        dedupe_types(connection)
+        stored = stores_binary_guids(connection)
+        if stored is not None and stored != uses_binary(engine.dialect):
+            convert_guids(connection)
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    record_schema(engine)
+
+
+def schema_fingerprint(engine):
+    """Digest of the DDL of the models' tables and indexes, as created through engine"""
+    ddl = [str(REVISION)]
+    for table in Base.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=engine.dialect)))
+        ddl.extend(str(CreateIndex(index).compile(dialect=engine.dialect))
+                   for index in sorted(table.indexes, key=lambda index: index.name))
+    return hashlib.sha256('\n'.join(ddl).encode('utf-8')).hexdigest()
+
+
+def stored_schema(engine):
+    """
+    The (fingerprint, binary_guids) recorded when the database was last
+    upgraded, or None if it never was
+    """
+    table = SchemaVersion.__table__
+    try:
+        with engine.connect() as connection:
+            row = connection.execute(select(table.c.fingerprint, table.c.binary_guids)).first()
+    except exc.DBAPIError:
+        # a new database, or one from before the table was added
+        return None
+    return (row.fingerprint, row.binary_guids) if row else None
+
+
+def schema_current(engine, stored):
+    """Whether stored, of stored_schema, is of the schema the models give through engine"""
+    return stored == (schema_fingerprint(engine), uses_binary(engine.dialect))
+
+
+def record_schema(engine):
+    """Record the schema of the models, as created through engine, for stored_schema"""
+    table = SchemaVersion.__table__
+    with engine.begin() as connection:
+        connection.execute(table.delete())
+        connection.execute(table.insert().values(fingerprint=schema_fingerprint(engine),
+                                                 binary_guids=uses_binary(engine.dialect)))
+
+
+def dedupe_types(connection):
+    """
+    Merge rows of the types table with the same (group, artifact, version),
+    pointing their services at the one kept, so the unique index can be built
+    """
+    types = Base.metadata.tables['types']
+    services = Base.metadata.tables['services']
+    triple = (types.c.group, types.c.artifact, types.c.version)
+
+    duplicated = connection.execute(
+        select(*triple).group_by(*triple).having(func.count() > 1)).fetchall()
+
+    for group, artifact, version in duplicated:
+        ids = [row.id for row in connection.execute(
+            select(types.c.id).where(types.c.group == group,
+                                     types.c.artifact == artifact,
+                                     types.c.version == version).order_by(types.c.id))]
+        keep, drop = ids[0], ids[1:]
+        connection.execute(services.update().where(services.c.type_id.in_(drop)).values(type_id=keep))
+        connection.execute(types.delete().where(types.c.id.in_(drop)))
+
+
+def stores_binary_guids(connection):
+    """
+    Whether the database stores GUIDs as bytes, from the type of urls.id;
+    None for a new database, or PostgreSQL, which has UUIDs
+    """
+    if connection.dialect.name == 'postgresql' or not inspect(connection).has_table('urls'):
+        return None
+    id_type = next(info['type'] for info in inspect(connection).get_columns('urls') if info['name'] == 'id')
+    return isinstance(id_type, _Binary)
+
+
+def convert_guids(connection):
+    """
+    Rebuild the tables with GUID columns of a SQLite database, whose
+    columns can't be altered, in the GUID storage of connection's engine:
+    each is renamed, created afresh, and its rows copied over converted.
+    Their indexes are dropped, to be created again by upgrade.
+    """
+    if connection.dialect.name != 'sqlite':
+        raise ValueError(f'GUIDs stored in {connection.dialect.name} databases can only be converted '
+                         'in SQLite databases; keep the storage the database was created with')
+    # don't point the foreign keys of other tables at the renamed tables
+    connection.exec_driver_sql('PRAGMA legacy_alter_table=ON')
+    try:
+        for table in Base.metadata.sorted_tables:
+            guids = {column.name for column in table.columns if isinstance(column.type, GUID)}
+            if not guids or not inspect(connection).has_table(table.name):
+                continue
+            for index in inspect(connection).get_indexes(table.name):
+                connection.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+            connection.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "_old_{table.name}"')
+            table.create(bind=connection)
+
+            # GUIDs are read as stored, the rest as the model types them
+            old = table_clause(f'_old_{table.name}', *[column(name, NullType() if name in guids else table.c[name].type)
+                                                       for name in table.columns.keys()])
+            result = connection.execute(select(old))
+            for rows in iter(lambda: result.fetchmany(COPY_BATCH_SIZE), []):
+                connection.execute(table.insert(), [
+                    {name: _uuid(value) if name in guids and value is not None else value
+                     for name, value in row._mapping.items()} for row in rows])
+            connection.exec_driver_sql(f'DROP TABLE "_old_{table.name}"')
+    finally:
+        connection.exec_driver_sql('PRAGMA legacy_alter_table=OFF')
@@ -3,8 +3,8 @@ SQLAlchemy models for the database
 """
 import datetime
 import uuid
-from sqlalchemy import Column, String, DateTime
-from sqlalchemy import UniqueConstraint, ForeignKey
+from sqlalchemy import Column, String, DateTime, Boolean, Text, Integer, Float
+from sqlalchemy import UniqueConstraint, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from service_registry.orm.guid import GUID
 from service_registry.orm import Base
@@ -19,7 +19,7 @@ class URL(Base):
     name = Column(String(100))
     url = Column(String(100))
     added = Column(DateTime, default=datetime.datetime.utcnow)
-    service_id = Column(GUID(), ForeignKey('services.id'), default=None)
+    service_id = Column(GUID(), ForeignKey('services.id'), default=None, index=True)
     __table_args__ = (
         UniqueConstraint('url'),
     )
@@ -35,7 +35,10 @@ class Type(Base):
     group = Column(String(100))
     artifact = Column(String(100))
     version = Column(String(100))
-    service = relationship('Service', uselist=False)
+    __table_args__ = (
+        Index('ix_types_group_artifact_version', 'group', 'artifact', 'version', unique=True),
+    )
+    services = relationship('Service')
 
 
 class Organization(Base):
@@ -56,9 +59,9 @@ class Service(Base):
     __tablename__ = 'services'
     id = Column(GUID(), primary_key=True, default=uuid.uuid4)
     name = Column(String(100))
-    type_id = Column(GUID(), ForeignKey('types.id'), default=None)
+    type_id = Column(GUID(), ForeignKey('types.id'), default=None, index=True)
     description = Column(String(100))
-    organization_id = Column(GUID(), ForeignKey('organizations.id'), default=None)
+    organization_id = Column(GUID(), ForeignKey('organizations.id'), default=None, index=True)
     contact_url = Column(String(100))
     documentation_url = Column(String(100))
     created_at = Column(String(100))
@@ -68,3 +71,80 @@ class Service(Base):
     type = relationship('Type')
     organization = relationship('Organization')
     url = relationship('URL', uselist=False)
+
+
+class URLStatus(Base):
+    """
+    SQLAlchemy class/table representing the last polled status of a
+    registered URL, shared by worker processes
+    """
+    __tablename__ = 'url_statuses'
+    url = Column(String(100), primary_key=True)
+    active = Column(Boolean, default=False)
+    last_checked = Column(DateTime)
+    service = Column(Text)
+
+
+class HealthCheck(Base):
+    """
+    SQLAlchemy class/table representing the result of contacting a
+    registered URL: whether it was available, the status code of its
+    service-info and the seconds taken to respond, and whether the stored
+    metadata of its service changed as a result
+    """
+    __tablename__ = 'health_checks'
+    id = Column(GUID(), primary_key=True, default=uuid.uuid4)
+    url_id = Column(GUID(), ForeignKey('urls.id'))
+    checked_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    active = Column(Boolean, default=False)
+    status_code = Column(Integer)
+    latency = Column(Float)
+    metadata_changed = Column(Boolean, default=False)
+    __table_args__ = (
+        Index('ix_health_checks_url_id_checked_at', 'url_id', 'checked_at'),
+    )
+
+
+class Lease(Base):
+    """
+    SQLAlchemy class/table representing when a registered URL's last
+    heartbeat expires; until then it is not polled
+    """
+    __tablename__ = 'leases'
+    url_id = Column(GUID(), ForeignKey('urls.id'), primary_key=True)
+    expires = Column(DateTime, index=True)
+
+
+class HeartbeatToken(Base):
+    """
+    SQLAlchemy class/table representing the hash of the bearer token a
+    registered URL's service sends with its heartbeats
+    """
+    __tablename__ = 'heartbeat_tokens'
+    url_id = Column(GUID(), ForeignKey('urls.id'), primary_key=True)
+    token_hash = Column(String(64), index=True, unique=True)
+
+
+class Change(Base):
+    """
+    SQLAlchemy class/table representing a numbered change to the registry
+    sent to watchers: a URL being added, removed, becoming active or
+    inactive, or its service info changing, with the service as JSON
+    """
+    __tablename__ = 'changes'
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(20))
+    url = Column(String(100))
+    data = Column(Text)
+    created = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+class SchemaVersion(Base):
+    """
+    SQLAlchemy class/table representing the schema the tables were last
+    brought up to date with, as a fingerprint of their DDL, and whether
+    GUIDs were stored as bytes, so that start-up can skip doing it again
+    """
+    __tablename__ = 'schema_version'
+    fingerprint = Column(String(64), primary_key=True)
+    binary_guids = Column(Boolean, default=False)
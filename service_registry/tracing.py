@@ -0,0 +1,197 @@
+"""
+Optional request tracing.
+
+When enabled with configure, each API call gets a span, as do the
+database statements and calls to registered services made for it, and
+the functions decorated with traced.  Spans follow the W3C Trace Context:
+an incoming traceparent header continues the caller's trace, and calls to
+services carry one on.  Finished spans are written as JSON lines to a
+file, from a background thread.
+
+When not enabled, no spans are made and no hooks are installed; what's
+left is a check of a module global where spans could start.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import random
+import re
+import time
+
+_ENABLED = False
+_SAMPLE_RATE = 1.0
+_MESSAGE = None
+_EXPORT_LOG = logging.getLogger('service_registry.tracing')
+_CURRENT = contextvars.ContextVar('service_registry_span', default=None)
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+class Span():
+    """A timed operation within a trace, with attributes describing it"""
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'attributes', 'error', '_begin', '_token')
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.attributes = attributes
+        self.error = None
+        self._begin = time.perf_counter()
+        self._token = _CURRENT.set(self)
+
+    def set(self, key, value):
+        """Set an attribute of the span"""
+        self.attributes[key] = value
+
+    def traceparent(self):
+        """traceparent header value making calls children of this span"""
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def end(self, error=None):
+        """Finish the span, making its parent current again, and export it"""
+        duration = time.perf_counter() - self._begin
+        _CURRENT.reset(self._token)
+        if error is not None:
+            self.error = f'{type(error).__name__}: {error}'
+        _EXPORT_LOG.info(_MESSAGE({
+            'traceId': self.trace_id, 'spanId': self.span_id, 'parentSpanId': self.parent_id,
+            'name': self.name, 'start': self.start, 'duration': round(duration, 6),
+            'attributes': self.attributes, 'error': self.error}))
+
+
+class _NoSpan():
+    """Context manager standing in for a span when none is made"""
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _SpanContext():
+    def __init__(self, name, traceparent, root, attributes):
+        self.args = (name, traceparent, root, attributes)
+        self.span = None
+
+    def __enter__(self):
+        name, traceparent, root, attributes = self.args
+        self.span = start_span(name, traceparent, root, **attributes)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.span is not None:
+            self.span.end(exc)
+        return False
+
+
+def configure(path, sample_rate=1.0):
+    """
+    Enable tracing, writing spans to the file at path through a
+    QueueLogHandler; sample_rate is the fraction of traces started here
+    that are recorded.  Call before orm.init_db, so engines are hooked.
+    """
+    global _ENABLED, _SAMPLE_RATE, _MESSAGE
+    # imported here, as service_registry.api.logging itself uses tracing
+    from service_registry.api.logging import JSONMessage, QueueLogHandler  # pylint: disable=import-outside-toplevel
+    _MESSAGE = JSONMessage
+    _EXPORT_LOG.addHandler(QueueLogHandler(logging.FileHandler(path)))
+    _EXPORT_LOG.setLevel(logging.INFO)
+    _EXPORT_LOG.propagate = False
+    _SAMPLE_RATE = sample_rate
+    _ENABLED = True
+
+
+def enabled():
+    """Whether tracing is enabled"""
+    return _ENABLED
+
+
+def current():
+    """The current span, if any"""
+    return _CURRENT.get() if _ENABLED else None
+
+
+def start_span(name, traceparent=None, root=False, **attributes):
+    """
+    Start a span and make it current, returning it, or None if none is
+    made: when tracing is disabled, when there's no current span to be a
+    child of and neither root nor traceparent is given, or when a new
+    trace isn't sampled.  The caller must end it.
+    """
+    if not _ENABLED:
+        return None
+    parent = _CURRENT.get()
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+
+    match = _TRACEPARENT.match(traceparent) if traceparent else None
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        if not int(flags, 16) & 1:
+            return None
+        return Span(name, trace_id, parent_id, attributes)
+    if not root and traceparent is None:
+        return None
+    if _SAMPLE_RATE < 1 and random.random() >= _SAMPLE_RATE:
+        return None
+    return Span(name, '%032x' % random.getrandbits(128), None, attributes)
+
+
+def span(name, traceparent=None, root=False, **attributes):
+    """
+    Context manager for start_span, giving the span or None, and ending
+    the span on exit, noting any exception
+    """
+    if not _ENABLED:
+        return _NO_SPAN
+    return _SpanContext(name, traceparent, root, attributes)
+
+
+def headers():
+    """Headers passing the current span on to a service, or None"""
+    if not _ENABLED:
+        return None
+    current_span = _CURRENT.get()
+    return {'traceparent': current_span.traceparent()} if current_span is not None else None
+
+
+def propagate(func):
+    """
+    func, to be run on another thread, wrapped so that spans it starts
+    are children of the current span
+    """
+    if not _ENABLED or _CURRENT.get() is None:
+        return func
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def traced(func):
+    """Decorator giving each call of func, or coroutine func, a span of its own"""
+    name = func.__name__
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _ENABLED:
+            return func(*args, **kwargs)
+        with span(name):
+            return func(*args, **kwargs)
+    return wrapper
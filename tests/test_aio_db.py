@@ -0,0 +1,33 @@
+"""
+Unit tests for running database access from coroutines
+"""
+import asyncio
+import threading
+import unittest
+import service_registry.orm
+from service_registry.api.aio_db import run_sync, session_scope
+
+
+class RunSyncTests(unittest.TestCase):
+    """Unit tests for run_sync"""
+    def test_task_session(self):
+        """
+        Functions run on the database threads, off the event loop, with the session of the task awaiting them
+        """
+        service_registry.orm.init_db('sqlite://')
+        session_factory = service_registry.orm.get_session(scopefunc=session_scope)
+
+        async def request():
+            session = session_factory()
+            thread, worker_session = await run_sync(lambda: (threading.current_thread(), session_factory()))
+            service_registry.orm.remove_sessions()
+            return thread.name.startswith('db') and worker_session is session
+
+        async def requests():
+            return await asyncio.gather(request(), request())
+
+        self.assertEqual(asyncio.run(requests()), [True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
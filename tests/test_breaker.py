@@ -0,0 +1,83 @@
+"""
+Unit tests for the per-peer circuit breakers
+"""
+import unittest
+from service_registry.api.breaker import PeerBreakers, PeerUnavailable, CLOSED, OPEN
+
+
+class FakeClock():
+    """Manually advanced monotonic clock"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class PeerBreakersTests(unittest.TestCase):
+    """Unit tests for PeerBreakers"""
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breakers = PeerBreakers(failure_threshold=2, backoff=5, max_backoff=15, clock=self.clock)
+
+    def test_opens_and_backs_off(self):
+        """
+        Failures open the circuit; failed trials double the backoff, up to its maximum
+        """
+        self.breakers.record('http://a')
+        self.breakers.check('http://a')
+        self.breakers.record('http://a', 503)
+        with self.assertRaises(PeerUnavailable):
+            self.breakers.check('http://a')
+        self.breakers.check('http://b')
+
+        for backoff in (5, 10, 15, 15):
+            self.clock.now += backoff - 1
+            with self.assertRaises(PeerUnavailable):
+                self.breakers.check('http://a')
+            self.clock.now += 1
+            self.breakers.check('http://a')
+            with self.assertRaises(PeerUnavailable):
+                self.breakers.check('http://a')
+            self.breakers.record('http://a')
+        self.assertEqual(self.breakers.get('http://a').state, OPEN)
+
+    def test_services_on_one_host(self):
+        """
+        Services registered under different paths of one host have their own breakers and latencies
+        """
+        self.breakers.record('http://host/beacon')
+        self.breakers.record('http://host/beacon')
+        with self.assertRaises(PeerUnavailable):
+            self.breakers.check('http://host/beacon')
+        self.breakers.check('http://host/htsget')
+        self.breakers.record('http://host/htsget', 200, 0.1)
+        self.assertEqual(self.breakers.get('http://host/htsget').samples(), 1)
+        self.assertEqual(self.breakers.get('http://host/beacon').samples(), 0)
+
+    def test_trial_success_closes(self):
+        """
+        A successful trial call closes the circuit
+        """
+        self.breakers.record('http://a')
+        self.breakers.record('http://a')
+        self.clock.now += 5
+        self.breakers.check('http://a')
+        self.breakers.record('http://a', 200, 0.1)
+        self.assertEqual(self.breakers.get('http://a').state, CLOSED)
+        self.breakers.check('http://a')
+        self.breakers.check('http://a')
+
+    def test_adaptive_timeout(self):
+        """
+        Read timeouts follow the 95th percentile latency, within bounds
+        """
+        default = (1.0, 2.0)
+        for _ in range(9):
+            self.breakers.record('http://a', 200, 0.1)
+        self.assertEqual(self.breakers.timeout('http://a', default), default)
+        self.breakers.record('http://a', 200, 0.1)
+        self.assertAlmostEqual(self.breakers.timeout('http://a', default)[1], 0.3)
+        for _ in range(10):
+            self.breakers.record('http://a', 404, 5.0)
+        self.assertEqual(self.breakers.timeout('http://a', default), default)
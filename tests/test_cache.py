@@ -0,0 +1,115 @@
+"""
+Unit tests for the upstream response cache
+"""
+import asyncio
+import threading
+import unittest
+from service_registry.api.cache import TTLCache
+
+
+class FakeClock():
+    """Manually advanced monotonic clock"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTests(unittest.TestCase):
+    """Unit tests for TTLCache"""
+    def test_hit_after_miss(self):
+        """
+        A second lookup of a key is served from the cache
+        """
+        cache = TTLCache(maxsize=2, ttl=10)
+        self.assertEqual(cache.get_or_fetch('a', lambda: 1), 1)
+        self.assertEqual(cache.get_or_fetch('a', lambda: 2), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_expiry(self):
+        """
+        Entries are fetched again once their TTL has passed
+        """
+        clock = FakeClock()
+        cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+        cache.get_or_fetch('a', lambda: 1)
+        clock.now = 11
+        self.assertEqual(cache.get_or_fetch('a', lambda: 2), 2)
+        self.assertEqual(cache.expirations, 1)
+
+    def test_lru_eviction(self):
+        """
+        The least recently used entry is evicted when the cache is full
+        """
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.get_or_fetch('a', lambda: 1)
+        cache.get_or_fetch('b', lambda: 2)
+        cache.get_or_fetch('a', lambda: 1)
+        cache.get_or_fetch('c', lambda: 3)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.get_or_fetch('a', lambda: 0), 1)
+        self.assertEqual(cache.get_or_fetch('b', lambda: 0), 0)
+
+    def test_errors_not_cached(self):
+        """
+        Exceptions from the fetch are raised and not cached
+        """
+        cache = TTLCache(maxsize=2, ttl=10)
+
+        def fail():
+            raise ValueError("upstream down")
+
+        with self.assertRaises(ValueError):
+            cache.get_or_fetch('a', fail)
+        self.assertEqual(cache.get_or_fetch('a', lambda: 1), 1)
+
+    def test_concurrent_fetches_collapse(self):
+        """
+        Concurrent lookups of an uncached key share one fetch
+        """
+        cache = TTLCache(maxsize=2, ttl=10)
+        release = threading.Event()
+        calls = []
+
+        def slow_fetch():
+            calls.append(1)
+            release.wait(5)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch('a', slow_fetch)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while cache.collapsed < 4:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 5)
+
+    def test_concurrent_async_fetches_collapse(self):
+        """
+        Concurrent async lookups of an uncached key await a single fetch
+        """
+        cache = TTLCache(maxsize=2, ttl=10)
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'value'
+
+        async def lookups():
+            return await asyncio.gather(*[cache.get_or_fetch_async('a', fetch) for _ in range(5)])
+
+        self.assertEqual(asyncio.run(lookups()), ['value'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.collapsed, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
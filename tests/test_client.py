@@ -0,0 +1,24 @@
+"""
+Unit tests for the shared HTTP client
+"""
+import unittest
+from service_registry.api import client
+
+
+class ClientTests(unittest.TestCase):
+    """Unit tests for get_client"""
+    def tearDown(self):
+        client.init_client(pool_size=10)
+
+    def test_pool_limits_connections(self):
+        """
+        The pool size is a limit on connections to each host, not only those kept alive
+        """
+        client.init_client(pool_size=3)
+        pool = client.get_client().get_adapter('http://service').poolmanager.connection_from_url('http://service')
+        self.assertEqual(pool.pool.maxsize, 3)
+        self.assertTrue(pool.block)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""
+Unit tests for conditional GET support
+"""
+import datetime
+import unittest
+from service_registry.api.conditional import http_date, make_etag, not_modified
+
+
+class ConditionalTests(unittest.TestCase):
+    """Unit tests for make_etag and not_modified"""
+    def setUp(self):
+        self.etag = make_etag('services', [('id', True)])
+        self.checked = datetime.datetime(2021, 1, 2, 3, 4, 5, 678000)
+
+    def test_make_etag(self):
+        """
+        ETags are strong, stable for the same parts and differ for others
+        """
+        self.assertRegex(self.etag, r'^"[0-9a-f]{40}"$')
+        self.assertEqual(make_etag('services', [('id', True)]), self.etag)
+        self.assertEqual(make_etag({'a': 1, 'b': 2}), make_etag({'b': 2, 'a': 1}))
+        self.assertNotEqual(make_etag('services', [('id', False)]), self.etag)
+        self.assertNotEqual(make_etag([('id', True)], 'services'), self.etag)
+
+    def test_if_none_match(self):
+        """
+        If-None-Match matches the ETag in a list, as a weak tag, or as *
+        """
+        self.assertTrue(not_modified({'If-None-Match': self.etag}, self.etag))
+        self.assertTrue(not_modified({'If-None-Match': f'"other", {self.etag}'}, self.etag))
+        self.assertTrue(not_modified({'If-None-Match': f'W/{self.etag}'}, self.etag))
+        self.assertTrue(not_modified({'If-None-Match': '*'}, self.etag))
+        self.assertFalse(not_modified({'If-None-Match': '"other", W/"another"'}, self.etag))
+        self.assertFalse(not_modified({}, self.etag, self.checked))
+
+    def test_if_modified_since(self):
+        """
+        If-Modified-Since matches when nothing changed since, to the second,
+        and is ignored when If-None-Match is given or it is malformed
+        """
+        self.assertTrue(not_modified({'If-Modified-Since': http_date(self.checked)}, self.etag, self.checked))
+        later = http_date(self.checked + datetime.timedelta(seconds=1))
+        self.assertTrue(not_modified({'If-Modified-Since': later}, self.etag, self.checked))
+        earlier = http_date(self.checked - datetime.timedelta(seconds=1))
+        self.assertFalse(not_modified({'If-Modified-Since': earlier}, self.etag, self.checked))
+        self.assertFalse(not_modified({'If-Modified-Since': later}, self.etag))
+        self.assertFalse(not_modified({'If-Modified-Since': 'yesterday'}, self.etag, self.checked))
+        self.assertFalse(not_modified({'If-None-Match': '"other"', 'If-Modified-Since': later},
+                                      self.etag, self.checked))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""
+Unit tests for fanning out upstream calls
+"""
+import threading
+import unittest
+from service_registry.api.fanout import TIMED_OUT, fan_out
+
+
+class FanOutTests(unittest.TestCase):
+    """Unit tests for fan_out"""
+    def setUp(self):
+        self.release = threading.Event()
+
+    def tearDown(self):
+        # let the slow call finish, so it doesn't hold a worker for other tests
+        self.release.set()
+
+    def call(self, item):
+        """Answers at once, except 'slow' which waits to be released and 'bad' which raises"""
+        if item == 'slow':
+            self.release.wait(5)
+        elif item == 'bad':
+            raise ValueError(item)
+        return item.upper()
+
+    def test_results_in_order(self):
+        """
+        Results come back in the order of the items given
+        """
+        self.assertEqual(fan_out(self.call, ['a', 'b', 'c'], 4, 5), ['A', 'B', 'C'])
+        self.assertEqual(fan_out(self.call, [], 4, 5), [])
+
+    def test_deadline(self):
+        """
+        A call still running at the deadline times out without holding up the others
+        """
+        results = fan_out(self.call, ['a', 'slow', 'b'], 4, 0.2)
+        self.assertEqual(results[0], 'A')
+        self.assertIs(results[1], TIMED_OUT)
+        self.assertEqual(results[2], 'B')
+
+    def test_exception(self):
+        """
+        A call which raises gives its exception, rather than raising it
+        """
+        results = fan_out(self.call, ['a', 'bad'], 4, 5)
+        self.assertEqual(results[0], 'A')
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(str(results[1]), 'bad')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Unit tests for recording the results of contacting services
+"""
+import datetime
+import unittest
+import uuid
+from tornado.options import define, options
+import service_registry.orm
+from service_registry.api.auth import heartbeat_token_info, issue_heartbeat_tokens
+from service_registry.api.fanout import TIMED_OUT
+from service_registry.api.operations import Probe, heartbeat_response, leased_url_ids, query_urls, \
+    record_service_infos
+from service_registry.orm.models import URL, HealthCheck
+
+for name, default in (('heartbeat_lease', 60.0), ('poll_interval', 0.0), ('admin_token', None)):
+    if name not in options:
+        define(name, default)
+
+
+def service_data(description):
+    """service-info of a fake service"""
+    return {'id': 'beacon', 'name': 'beacon', 'description': description, 'version': '1.0',
+            'type': {'group': 'org.ga4gh', 'artifact': 'beacon', 'version': '1.0.0'},
+            'organization': {'name': 'Org', 'url': 'https://org.example'},
+            'contactUrl': 'mailto:a@org.example', 'documentationUrl': 'https://org.example',
+            'createdAt': '2020-01-01T00:00:00Z', 'updatedAt': '2020-01-01T00:00:00Z', 'environment': 'test'}
+
+
+class RecordServiceInfosTests(unittest.TestCase):
+    """Unit tests for record_service_infos"""
+    def setUp(self):
+        service_registry.orm.init_db('sqlite://')
+        self.db_session = service_registry.orm.get_session()
+        self.db_session.add(URL(id=uuid.uuid4(), name='beacon', url='http://beacon'))
+        self.db_session.commit()
+
+    def record(self, probe, prune_before=None):
+        """Record one probe of the registered URL"""
+        url_orms = query_urls(self.db_session).all()
+        return record_service_infos(url_orms, [probe], prune_before)
+
+    def test_metadata_updated(self):
+        """
+        Stored metadata follows the service, and each change is flagged
+        """
+        self.record(Probe(service_data('first'), 200, 0.1))
+        self.record(Probe(service_data('first'), 200, 0.1))
+        (service, active), = self.record(Probe(service_data('second'), 200, 0.1))
+        self.assertTrue(active)
+        self.assertEqual(service.description, 'second')
+        self.assertEqual(query_urls(self.db_session).one().service.description, 'second')
+        checks = self.db_session.query(HealthCheck).order_by(HealthCheck.checked_at)
+        changes = [check.metadata_changed for check in checks]
+        self.assertEqual(changes, [True, False, True])
+
+    def test_unavailable_served_from_database(self):
+        """
+        A service which doesn't answer is recorded inactive and served as last stored
+        """
+        self.record(Probe(service_data('stored'), 200, 0.1))
+        (service, active), = self.record(TIMED_OUT)
+        self.assertFalse(active)
+        self.assertEqual(service.description, 'stored')
+        check = self.db_session.query(HealthCheck).order_by(HealthCheck.checked_at.desc()).first()
+        self.assertEqual((check.active, check.status_code), (False, None))
+
+    def test_minimal_service_info(self):
+        """
+        Services leaving out optional fields are stored and updated, and
+        a malformed one doesn't lose the results of the others
+        """
+        minimal = {key: value for key, value in service_data('ignored').items()
+                   if key in ('id', 'name', 'version', 'type', 'organization')}
+        (service, active), = self.record(Probe(minimal, 200, 0.1))
+        self.assertTrue(active)
+        self.assertIsNone(service.description)
+        (service, active), = self.record(Probe(service_data('full'), 200, 0.1))
+        self.assertEqual(service.description, 'full')
+        (service, active), = self.record(Probe(minimal, 200, 0.1))
+        self.assertTrue(active)
+        self.assertIsNone(query_urls(self.db_session).one().service.description)
+
+        self.db_session.add(URL(id=uuid.uuid4(), name='broken', url='http://broken'))
+        self.db_session.commit()
+        url_orms = query_urls(self.db_session).order_by(URL.name).all()
+        statuses = record_service_infos(url_orms, [Probe(service_data('again'), 200, 0.1),
+                                                   Probe({'name': 'broken', 'type': 'beacon'}, 200, 0.1)])
+        self.assertEqual([active for _, active in statuses], [True, False])
+        self.assertEqual(statuses[0][0].description, 'again')
+        self.assertEqual(self.db_session.query(HealthCheck).count(), 5)
+
+    def test_prune(self):
+        """
+        Checks older than prune_before are deleted
+        """
+        self.record(Probe(service_data('stored'), 200, 0.1))
+        self.record(Probe(service_data('stored'), 200, 0.1), prune_before=datetime.datetime.utcnow())
+        self.assertEqual(self.db_session.query(HealthCheck).count(), 1)
+
+
+    def test_heartbeat(self):
+        """
+        A heartbeat stores the service's info and leases it from polling until it expires
+        """
+        url_orm = query_urls(self.db_session).one()
+        data = service_data('pushed')
+        del data['contactUrl'], data['environment']
+        token, = issue_heartbeat_tokens(self.db_session, [url_orm])
+        self.db_session.commit()
+        body, status = heartbeat_response(str(url_orm.id), data, heartbeat_token_info(token))
+        self.assertEqual((body['id'], status), (str(url_orm.id), 200))
+
+        now = datetime.datetime.utcnow()
+        self.assertEqual(leased_url_ids(self.db_session, now), {url_orm.id})
+        self.assertEqual(leased_url_ids(self.db_session, now + datetime.timedelta(seconds=61)), set())
+        service = query_urls(self.db_session).one().service
+        self.assertEqual((service.description, service.contact_url), ('pushed', None))
+        self.assertTrue(self.db_session.query(HealthCheck).one().active)
+
+    def test_heartbeat_token(self):
+        """
+        A heartbeat token only renews the lease of the service it was issued to
+        """
+        other = URL(id=uuid.uuid4(), name='other', url='http://other')
+        self.db_session.add(other)
+        url_orm = query_urls(self.db_session).filter(URL.name == 'beacon').one()
+        token, other_token = issue_heartbeat_tokens(self.db_session, [url_orm, other])
+        self.db_session.commit()
+        self.assertIsNone(heartbeat_token_info('not-a-token'))
+
+        body, status = heartbeat_response(str(url_orm.id), service_data('pushed'), heartbeat_token_info(other_token))
+        self.assertEqual((body.title, status), ('Forbidden', 403))
+        self.assertEqual(leased_url_ids(self.db_session, datetime.datetime.utcnow()), set())
+        self.assertEqual(self.db_session.query(HealthCheck).count(), 0)
+
+        # a new token replaces the old one
+        new_token, = issue_heartbeat_tokens(self.db_session, [url_orm])
+        self.db_session.commit()
+        self.assertIsNone(heartbeat_token_info(token))
+        self.assertEqual(heartbeat_token_info(new_token), {'sub': str(url_orm.id)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+Tests of listing services through the API: filters, pages and the links between them
+"""
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from urllib.parse import urlsplit
+import connexion
+from tornado.options import define, options
+import service_registry.orm
+from service_registry.api import poller
+from service_registry.api.operations import Probe, query_urls, record_service_infos, update_snapshot
+from service_registry.api.poller import SnapshotEntry
+from service_registry.api.spec import SPEC_FILE
+from service_registry.orm.models import URL
+
+for name, default in (('remove_active_status', False), ('poll_interval', 30.0)):
+    if name not in options:
+        define(name, default)
+
+# the database the dredd tests run against
+TEST_DB = os.path.join(os.path.dirname(__file__), 'test.db')
+
+# name: (type, environment, active)
+SERVICES = {'beacon-one': ('org.ga4gh:beacon:1.0.0', 'prod', True),
+            'beacon-two': ('org.ga4gh:beacon:2.0.0', 'test', False),
+            'drs': ('org.ga4gh:drs:1.0.0', 'prod', True),
+            'htsget': ('org.ga4gh:htsget:1.0.0', 'prod', True)}
+
+
+def service_info(name):
+    """service-info of a fake service"""
+    group, artifact, version = SERVICES[name][0].split(':')
+    return {'id': name, 'name': name, 'version': '1.0', 'environment': SERVICES[name][1],
+            'type': {'group': group, 'artifact': artifact, 'version': version},
+            'organization': {'name': 'Org', 'url': 'https://org.example'}}
+
+
+def make_app():
+    """The registry's API, served by the Flask test client"""
+    app = connexion.FlaskApp(__name__)
+    app.add_api(SPEC_FILE, strict_validation=True)
+    return app.app.test_client()
+
+
+class ListServicesTests(unittest.TestCase):
+    """Tests of GET /services against a copy of test.db with services registered"""
+    @classmethod
+    def setUpClass(cls):
+        cls.client = make_app()
+
+    def setUp(self):
+        self.poll_interval = options.poll_interval
+        options.poll_interval = 30.0
+        self.directory = tempfile.TemporaryDirectory()
+        database = os.path.join(self.directory.name, 'test.db')
+        shutil.copy(TEST_DB, database)
+        service_registry.orm.init_db('sqlite:///' + database)
+        poller.SNAPSHOT = poller.Snapshot()
+
+        db_session = service_registry.orm.get_session()
+        db_session.add_all([URL(id=uuid.uuid4(), name=name, url=f'http://{name}') for name in SERVICES])
+        db_session.commit()
+        # test.db's own URL, never contacted, is in the snapshot without a service
+        url_orms = query_urls(db_session).all()
+        probes = [Probe(service_info(url_orm.name), 200, 0.1) if url_orm.name in SERVICES else Probe(None, None, None)
+                  for url_orm in url_orms]
+        statuses = record_service_infos(url_orms, probes)
+        checked = datetime.datetime(2021, 1, 1)
+        update_snapshot(url_orms, [SnapshotEntry(service, SERVICES.get(url_orm.name, (None, None, False))[2], checked)
+                                   for url_orm, (service, _) in zip(url_orms, statuses)])
+        db_session.remove()
+
+    def tearDown(self):
+        options.poll_interval = self.poll_interval
+        service_registry.orm.remove_sessions()
+        service_registry.orm.get_engine().dispose()
+        service_registry.orm.get_read_engine().dispose()
+        self.directory.cleanup()
+
+    def names(self, query):
+        """Names of the services listed with the query string, which must succeed"""
+        response = self.client.get('/services?' + query)
+        self.assertEqual(response.status_code, 200, response.data)
+        return sorted(service['name'] for service in json.loads(response.data))
+
+    def test_type_filter(self):
+        """
+        Services are filtered by type group and artifact, and optionally version
+        """
+        self.assertEqual(self.names('type=org.ga4gh:beacon'), ['beacon-one', 'beacon-two'])
+        self.assertEqual(self.names('type=org.ga4gh:beacon:2.0.0'), ['beacon-two'])
+        self.assertEqual(self.names('type=org.ga4gh'), sorted(SERVICES))
+        self.assertEqual(self.client.get('/services?type=org.ga4gh:beacon:1.0.0:extra').status_code, 400)
+        self.assertEqual(self.client.get('/services?type=org.ga4gh::1.0.0').status_code, 400)
+
+    def test_active_and_environment_filters(self):
+        """
+        Services are filtered by their active status and environment
+        """
+        self.assertEqual(self.names('active=true'), ['beacon-one', 'drs', 'htsget'])
+        self.assertEqual(self.names('active=false'), ['beacon-two'])
+        self.assertEqual(self.names('environment=test'), ['beacon-two'])
+        self.assertEqual(self.names('environment=prod&active=false'), [])
+        self.assertEqual(self.names('environment=prod&type=org.ga4gh:beacon'), ['beacon-one'])
+
+    def test_bad_cursor(self):
+        """
+        A cursor which isn't one given in a next link is refused
+        """
+        response = self.client.get('/services?limit=1&cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)['title'], 'Bad cursor')
+
+    def test_pages(self):
+        """
+        Following next links pages through every matching service, keeping the filters
+        """
+        path, names, pages = '/services?environment=prod&active=true&limit=1', [], 0
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, response.data)
+            names.extend(service['name'] for service in json.loads(response.data))
+            pages += 1
+            link = response.headers.get('Link')
+            path = None
+            if link:
+                self.assertTrue(link.endswith('>; rel="next"'))
+                url = urlsplit(link[1:link.index('>')])
+                self.assertIn('environment=prod', url.query)
+                self.assertIn('active=true', url.query)
+                self.assertIn('limit=1', url.query)
+                path = f'{url.path}?{url.query}'
+        self.assertEqual(sorted(names), ['beacon-one', 'drs', 'htsget'])
+        # a page per URL the database filters keep: the three in prod, and test.db's, not contacted yet
+        self.assertEqual(pages, 4)
+
+    def test_conditional(self):
+        """
+        Lists are unmodified while their ETag matches, but If-Modified-Since
+        alone doesn't hide a service's removal; single services honour it
+        """
+        db_session = service_registry.orm.get_session()
+        url_orms = {url_orm.name: url_orm for url_orm in query_urls(db_session)}
+        drs = url_orms['drs']
+        update_snapshot([drs], [poller.SNAPSHOT.get_many([drs.url])[drs.url]._replace(
+            last_checked=datetime.datetime(2021, 1, 2))])
+        listed = self.client.get('/services')
+        self.assertEqual(self.client.get('/services', headers={'If-None-Match': listed.headers['ETag']}).status_code,
+                         304)
+        single = self.client.get(f'/services/{drs.id}')
+        self.assertEqual(self.client.get(f'/services/{drs.id}', headers={
+            'If-Modified-Since': single.headers['Last-Modified']}).status_code, 304)
+
+        # the latest checked service goes, taking Last-Modified back
+        db_session.delete(drs)
+        db_session.commit()
+        db_session.remove()
+        response = self.client.get('/services', headers={'If-Modified-Since': listed.headers['Last-Modified']})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('drs', [service['name'] for service in json.loads(response.data)])
+        self.assertEqual(self.client.get('/services', headers={'If-None-Match': listed.headers['ETag']}).status_code,
+                         200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""
+Unit tests for the queued API call logging
+"""
+import datetime
+import logging
+import unittest
+import uuid
+from service_registry.api.logging import JSONMessage, QueueLogHandler, configure_apilog
+
+
+class ListHandler(logging.Handler):
+    """Handler keeping the messages of the records it is given"""
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class QueueLogHandlerTests(unittest.TestCase):
+    """Unit tests for QueueLogHandler and JSONMessage"""
+    def test_queued_json(self):
+        """
+        Records are encoded and written by the listener, and all written on close
+        """
+        target = ListHandler()
+        handler = QueueLogHandler(target)
+        log = logging.getLogger('service_registry.tests')
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        try:
+            service_id = uuid.UUID(int=1)
+            for i in range(100):
+                log.info(JSONMessage({'id': service_id, 'at': datetime.datetime(2020, 1, 1), 'i': i}))
+        finally:
+            log.removeHandler(handler)
+            handler.close()
+
+        self.assertEqual(len(target.messages), 100)
+        self.assertEqual(target.messages[0],
+                         '{"id":"00000000-0000-0000-0000-000000000001","at":"2020-01-01 00:00:00","i":0}')
+
+    def test_unknown_fields(self):
+        """
+        Only known fields can be logged
+        """
+        with self.assertRaises(ValueError):
+            configure_apilog(fields=['timestamp', 'password'])
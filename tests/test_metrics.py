@@ -0,0 +1,36 @@
+"""
+Unit tests for the metrics registry
+"""
+import unittest
+from service_registry.metrics import Registry, Counter, Gauge, Histogram
+
+
+class MetricsTests(unittest.TestCase):
+    """Unit tests for rendering metrics"""
+    def test_render(self):
+        """
+        Metrics render in the Prometheus text format, with cumulative buckets
+        """
+        registry = Registry()
+        counter = Counter('calls_total', 'Calls', ['peer'], registry=registry)
+        gauge = Gauge('in_flight', 'Calls in flight', registry=registry)
+        histogram = Histogram('call_seconds', 'Call time', ['peer'], buckets=(0.1, 1.0), registry=registry)
+        registry.add_collector(lambda: [('cached', 'gauge', 'Cached entries', [({}, 3)])])
+
+        counter.inc('a"b')
+        counter.inc('a"b', amount=2)
+        with gauge.track():
+            self.assertIn('in_flight 1\n', registry.render())
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, 'a')
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE calls_total counter', lines)
+        self.assertIn('calls_total{peer="a\\"b"} 3', lines)
+        self.assertIn('in_flight 0', lines)
+        self.assertIn('call_seconds_bucket{peer="a",le="0.1"} 1', lines)
+        self.assertIn('call_seconds_bucket{peer="a",le="1.0"} 2', lines)
+        self.assertIn('call_seconds_bucket{peer="a",le="+Inf"} 3', lines)
+        self.assertIn('call_seconds_sum{peer="a"} 5.55', lines)
+        self.assertIn('call_seconds_count{peer="a"} 3', lines)
+        self.assertIn('cached 3', lines)
@@ -0,0 +1,144 @@
+"""
+Unit tests for in-place database upgrades
+"""
+import os
+import tempfile
+import unittest
+import uuid
+from sqlalchemy import create_engine, inspect, text
+import service_registry.orm
+from service_registry.orm import Base
+from service_registry.orm import models  # noqa401 # pylint: disable=unused-import
+from service_registry.orm.migrations import schema_fingerprint, stored_schema, upgrade
+
+
+class UpgradeTests(unittest.TestCase):
+    """Unit tests for migrations.upgrade"""
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        # create the tables as an earlier version would have, without indexes
+        for table in Base.metadata.sorted_tables:
+            indexes = set(table.indexes)
+            table.indexes.clear()
+            try:
+                table.create(bind=self.engine)
+            finally:
+                table.indexes.update(indexes)
+
+    def test_dedupes_types(self):
+        """
+        Duplicate types are merged and their services repointed
+        """
+        types = Base.metadata.tables['types']
+        services = Base.metadata.tables['services']
+        type_ids = [uuid.uuid4() for _ in range(3)]
+        with self.engine.begin() as connection:
+            for type_id in type_ids:
+                connection.execute(types.insert().values(id=type_id, group='org.ga4gh',
+                                                         artifact='beacon', version='1.0.0'))
+                connection.execute(services.insert().values(id=uuid.uuid4(), name='beacon', type_id=type_id))
+
+        upgrade(self.engine)
+
+        with self.engine.connect() as connection:
+            remaining = [row.id for row in connection.execute(types.select())]
+            used = {row.type_id for row in connection.execute(services.select())}
+        self.assertEqual(len(remaining), 1)
+        self.assertEqual(used, set(remaining))
+
+    def test_creates_indexes(self):
+        """
+        Indexes missing from existing tables are created, repeatably
+        """
+        upgrade(self.engine)
+        upgrade(self.engine)
+        inspector = inspect(self.engine)
+        self.assertIn('ix_types_group_artifact_version',
+                      {index['name'] for index in inspector.get_indexes('types')})
+        self.assertEqual({index['name'] for index in inspector.get_indexes('services')},
+                         {'ix_services_type_id', 'ix_services_organization_id'})
+        self.assertIn('ix_urls_service_id', {index['name'] for index in inspector.get_indexes('urls')})
+
+
+class GUIDStorageTests(unittest.TestCase):
+    """Unit tests for converting the storage of GUIDs"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.uri = 'sqlite:///' + os.path.join(self.directory.name, 'services.sqlite')
+
+    def tearDown(self):
+        service_registry.orm.get_engine().dispose()
+        service_registry.orm.get_read_engine().dispose()
+        self.directory.cleanup()
+
+    def stored(self):
+        """The SQLite type of the stored URL and service IDs, and the IDs read back"""
+        with service_registry.orm.get_engine().connect() as connection:
+            kinds = connection.execute(text('SELECT typeof(urls.id), typeof(urls.service_id), typeof(services.id) '
+                                            'FROM urls JOIN services ON services.id = urls.service_id')).one()
+        db_session = service_registry.orm.get_session()
+        try:
+            url = db_session.query(models.URL).one()
+            return tuple(kinds), (url.id, url.service.id)
+        finally:
+            db_session.remove()
+
+    def test_converts_guids(self):
+        """
+        IDs of an existing database are converted both ways, and its storage kept by default
+        """
+        ids = uuid.uuid4(), uuid.uuid4()
+        service_registry.orm.init_db(self.uri, guid_storage='char')
+        db_session = service_registry.orm.get_session()
+        db_session.add(models.URL(id=ids[0], url='http://beacon', service=models.Service(id=ids[1], name='beacon')))
+        db_session.commit()
+        db_session.remove()
+        self.assertEqual(self.stored(), (('text', 'text', 'text'), ids))
+
+        service_registry.orm.init_db(self.uri, guid_storage='binary')
+        self.assertEqual(self.stored(), (('blob', 'blob', 'blob'), ids))
+        self.assertIn('ix_urls_service_id', {index['name'] for index in
+                                             inspect(service_registry.orm.get_engine()).get_indexes('urls')})
+        service_registry.orm.init_db(self.uri)
+        self.assertEqual(self.stored(), (('blob', 'blob', 'blob'), ids))
+
+        service_registry.orm.init_db(self.uri, guid_storage='char')
+        self.assertEqual(self.stored(), (('text', 'text', 'text'), ids))
+
+
+class SchemaVersionTests(unittest.TestCase):
+    """Unit tests for skipping upgrades of current databases"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.uri = 'sqlite:///' + os.path.join(self.directory.name, 'services.sqlite')
+
+    def tearDown(self):
+        service_registry.orm.get_engine().dispose()
+        service_registry.orm.get_read_engine().dispose()
+        self.directory.cleanup()
+
+    def indexes(self):
+        """Names of the indexes of the urls table"""
+        return {index['name'] for index in inspect(service_registry.orm.get_engine()).get_indexes('urls')}
+
+    def test_skips_current_schema(self):
+        """
+        Databases recorded as having the current schema aren't upgraded again
+        """
+        service_registry.orm.init_db(self.uri)
+        engine = service_registry.orm.get_engine()
+        self.assertEqual(stored_schema(engine), (schema_fingerprint(engine), True))
+        with engine.begin() as connection:
+            connection.execute(text('DROP INDEX ix_urls_service_id'))
+
+        service_registry.orm.init_db(self.uri)
+        self.assertNotIn('ix_urls_service_id', self.indexes())
+
+        with service_registry.orm.get_engine().begin() as connection:
+            connection.execute(text('DELETE FROM schema_version'))
+        service_registry.orm.init_db(self.uri)
+        self.assertIn('ix_urls_service_id', self.indexes())
+
+
+if __name__ == '__main__':
+    unittest.main()
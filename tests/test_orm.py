@@ -0,0 +1,43 @@
+"""
+Unit tests for database engine set-up
+"""
+import os
+import tempfile
+import unittest
+from sqlalchemy import exc, text
+import service_registry.orm
+
+
+class SQLiteProfileTests(unittest.TestCase):
+    """Unit tests for the SQLite engines made by init_db"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.uri = 'sqlite:///' + os.path.join(self.directory.name, 'services.sqlite')
+
+    def tearDown(self):
+        service_registry.orm.get_engine().dispose()
+        service_registry.orm.get_read_engine().dispose()
+        self.directory.cleanup()
+
+    def test_performance_profile(self):
+        """
+        The performance profile puts the database in WAL mode
+        """
+        service_registry.orm.init_db(self.uri, sqlite_profile='performance')
+        with service_registry.orm.get_engine().connect() as connection:
+            self.assertEqual(connection.execute(text('PRAGMA journal_mode')).scalar(), 'wal')
+            self.assertEqual(connection.execute(text('PRAGMA busy_timeout')).scalar(), 5000)
+
+    def test_read_engine_is_read_only(self):
+        """
+        Connections of the read engine can query but not write
+        """
+        service_registry.orm.init_db(self.uri)
+        with service_registry.orm.get_read_engine().connect() as connection:
+            connection.execute(text('SELECT count(*) FROM urls'))
+            with self.assertRaises(exc.OperationalError):
+                connection.execute(text("INSERT INTO urls (id, url) VALUES ('x', 'http://x')"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+Unit tests for bulk registration of services
+"""
+import unittest
+import uuid
+import service_registry.orm
+from service_registry.api.auth import hash_token
+from service_registry.api.registration import parse_registrations, register_urls
+from service_registry.orm.models import URL, HeartbeatToken
+
+
+class ParseRegistrationsTests(unittest.TestCase):
+    """Unit tests for parse_registrations"""
+    def test_csv(self):
+        """
+        CSV rows are read with or without a header row
+        """
+        lines = ['name,url\n', 'a, http://a\n', '\n', 'b,http://b\n']
+        self.assertEqual(parse_registrations(lines), [('a', 'http://a'), ('b', 'http://b')])
+        self.assertEqual(parse_registrations(lines[1:]), [('a', 'http://a'), ('b', 'http://b')])
+
+    def test_jsonl(self):
+        """
+        JSON lines are read, and malformed ones rejected
+        """
+        lines = ['{"name": "a", "url": "http://a"}\n', '{"name": "b", "url": "http://b"}\n']
+        self.assertEqual(parse_registrations(lines), [('a', 'http://a'), ('b', 'http://b')])
+        with self.assertRaises(ValueError):
+            parse_registrations(lines + ['{"name": "c"}\n'])
+
+
+class RegisterUrlsTests(unittest.TestCase):
+    """Unit tests for register_urls"""
+    def test_existing_skipped(self):
+        """
+        Registered and repeated URLs are added only once
+        """
+        service_registry.orm.init_db('sqlite://')
+        db_session = service_registry.orm.get_session()
+        db_session.add(URL(id=uuid.uuid4(), name='a', url='http://a'))
+        db_session.commit()
+
+        added, existing, tokens = register_urls(db_session,
+                                                [('a', 'http://a'), ('b', 'http://b'), ('b2', 'http://b')])
+        self.assertEqual([(url.name, url.url) for url in added], [('b', 'http://b')])
+        self.assertEqual(existing, ['http://a'])
+        self.assertEqual(db_session.query(URL).count(), 2)
+        # only the hash of the token issued is stored
+        token_row = db_session.query(HeartbeatToken).one()
+        self.assertEqual((token_row.url_id, token_row.token_hash), (added[0].id, hash_token(tokens[0])))
@@ -0,0 +1,92 @@
+"""
+Unit tests for serializing services and sampling response validation
+"""
+import datetime
+import json
+import unittest
+import uuid
+from types import SimpleNamespace
+from tornado.options import define, options
+from service_registry.api import models, operations, upstream
+from service_registry.api.models import Service
+from service_registry.api.poller import SnapshotEntry
+from service_registry.api.validation import SampledResponseValidator, configure_validation
+
+if 'remove_active_status' not in options:
+    define('remove_active_status', False)
+
+
+class SerializationTests(unittest.TestCase):
+    """Unit tests for the JSON of services and sampled validation"""
+    def test_external_service_json(self):
+        """
+        Services are encoded with local values and without nulls, once per poll
+        """
+        service = Service(id='remote', name='remote', description='A service', version='1.0', environment=None,
+                          type={'group': 'org.ga4gh', 'artifact': 'beacon', 'version': '1.0.0'},
+                          organization={'name': 'Org', 'url': 'https://org.example'}, unknown='ignored')
+        url_orm = SimpleNamespace(id=uuid.uuid4(), name='local', url='http://local.example')
+        entry = SnapshotEntry(service, True, datetime.datetime(2021, 1, 2, 3, 4, 5))
+
+        encoded = operations.external_service_json(url_orm, entry)
+        self.assertEqual(json.loads(models.encode_list([encoded, encoded])), [{
+            'id': str(url_orm.id), 'name': 'local', 'url': 'http://local.example', 'description': 'A service',
+            'version': '1.0', 'type': {'group': 'org.ga4gh', 'artifact': 'beacon', 'version': '1.0.0'},
+            'organization': {'name': 'Org', 'url': 'https://org.example'},
+            'lastChecked': '2021-01-02T03:04:05Z', 'active': True}] * 2)
+        self.assertIs(operations.external_service_json(url_orm, entry), encoded)
+
+        polled = entry._replace(active=False, last_checked=datetime.datetime(2021, 1, 2, 3, 5, 0))
+        self.assertFalse(json.loads(operations.external_service_json(url_orm, polled))['active'])
+
+    def test_cohorts(self):
+        """
+        Cohorts are only listed with services when given, and are paged through separately
+        """
+        service = Service(id='remote', name='remote', version='1.0', cohorts=[{'id': 'polled'}],
+                          type={'group': 'org.ga4gh', 'artifact': 'beacon', 'version': '1.0.0'},
+                          organization={'name': 'Org', 'url': 'https://org.example'})
+        url_orm = SimpleNamespace(id=uuid.uuid4(), name='local', url='http://local.example')
+        entry = SnapshotEntry(service, True, datetime.datetime(2021, 1, 2, 3, 4, 5))
+        cohorts = [{'id': 'c1'}, {'id': 'c2'}]
+        self.assertNotIn('cohorts', json.loads(operations.external_service_json(url_orm, entry)))
+        self.assertEqual(json.loads(operations.external_service_json(url_orm, entry, cohorts))['cohorts'], cohorts)
+
+        body, _, headers = operations.cohorts_response(url_orm, entry, cohorts, 1, None, 'http://registry/cohorts', {})
+        self.assertEqual((json.loads(body), headers['Link']),
+                         ([{'id': 'c1'}], '<http://registry/cohorts?limit=1&cursor=1>; rel="next"'))
+        body, _, headers = operations.cohorts_response(url_orm, entry, cohorts, 1, '1', 'http://registry/cohorts', {})
+        self.assertEqual(json.loads(body), [{'id': 'c2'}])
+        self.assertNotIn('Link', headers)
+        _, _, changed = operations.cohorts_response(url_orm, entry, cohorts[:1], 1, '1', 'http://registry/cohorts', {})
+        self.assertNotEqual(changed['ETag'], headers['ETag'])
+
+    def test_fetch_cohorts(self):
+        """
+        Cohorts are fetched from a service's info, else its cohorts endpoint, through the upstream cache
+        """
+        responses = {'http://a/service-info': (200, {'id': 'a', 'cohorts': [{'id': 'in-info'}]}, 0.1),
+                     'http://b/service-info': (200, {'id': 'b'}, 0.1),
+                     'http://b/cohorts': (200, [{'id': 'at-endpoint'}], 0.1),
+                     'http://c/service-info': (200, {'id': 'c'}, 0.1),
+                     'http://c/cohorts': (404, None, 0.1)}
+        for url, response in responses.items():
+            upstream.CACHE.get_or_fetch(url, lambda response=response: response)
+        try:
+            self.assertEqual(operations.fetch_cohorts('http://a'), [{'id': 'in-info'}])
+            self.assertEqual(operations.fetch_cohorts('http://b'), [{'id': 'at-endpoint'}])
+            self.assertEqual(operations.fetch_cohorts('http://c'), [])
+        finally:
+            for url in responses:
+                upstream.CACHE.invalidate(url)
+
+    def test_unsampled_validation(self):
+        """
+        Responses are returned unvalidated when validation is not sampled
+        """
+        configure_validation(0)
+        try:
+            wrapped = SampledResponseValidator(None, 'application/json')(lambda request: ('body', 200))
+            self.assertEqual(wrapped(None), ('body', 200))
+        finally:
+            configure_validation(1.0)
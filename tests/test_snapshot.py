@@ -0,0 +1,44 @@
+"""
+Unit tests for the service snapshot shared between worker processes
+"""
+import datetime
+import unittest
+import service_registry.orm
+from service_registry.api.models import Service
+from service_registry.api.poller import SharedSnapshot, SnapshotEntry
+
+
+class SharedSnapshotTests(unittest.TestCase):
+    """Unit tests for SharedSnapshot"""
+    def setUp(self):
+        service_registry.orm.init_db('sqlite://')
+        self.snapshot = SharedSnapshot()
+        self.checked = datetime.datetime(2021, 5, 1, 12, 0, 0)
+        self.service = Service(id='beacon', name='beacon', version='1.0', cohorts=[{'id': 'c1'}],
+                               type={'group': 'org.ga4gh', 'artifact': 'beacon', 'version': '1.0.0'},
+                               organization={'name': 'Org', 'url': 'https://org.example'})
+
+    def test_round_trip(self):
+        """
+        Entries read back equal those written, and later writes replace them
+        """
+        self.snapshot.update_many({'http://a': SnapshotEntry(self.service, True, self.checked),
+                                   'http://b': SnapshotEntry(None, False, self.checked)})
+        self.snapshot.update_many({'http://b': SnapshotEntry(self.service, True, self.checked)})
+        entries = self.snapshot.get_many(['http://a', 'http://b', 'http://c'])
+        self.assertEqual(set(entries), {'http://a', 'http://b'})
+        self.assertEqual(entries['http://a'], SnapshotEntry(self.service, True, self.checked))
+        self.assertEqual(entries['http://b'].service, self.service)
+
+    def test_retain(self):
+        """
+        URLs no longer registered are forgotten
+        """
+        self.snapshot.update_many({url: SnapshotEntry(None, False, self.checked)
+                                   for url in ('http://a', 'http://b')})
+        self.snapshot.retain(['http://b'])
+        self.assertEqual(set(self.snapshot.get_many(['http://a', 'http://b'])), {'http://b'})
+
+
+if __name__ == '__main__':
+    unittest.main()
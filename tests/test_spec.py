@@ -0,0 +1,51 @@
+"""
+Unit tests for caching the API spec
+"""
+import json
+import os
+import tempfile
+import unittest
+from connexion.spec import Specification
+from service_registry.api.spec import CachedSpec
+
+
+class CachedSpecTests(unittest.TestCase):
+    """Unit tests for CachedSpec"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, 'spec-cache.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_cached_once_validated(self):
+        """
+        The spec is parsed and validated once, then loaded from the cache, trusted
+        """
+        parsed = CachedSpec(cache_path=self.cache_path)
+        self.assertFalse(parsed.validated)
+        with parsed.trusted():
+            Specification.load(parsed.spec)
+        parsed.save()
+
+        cached = CachedSpec(cache_path=self.cache_path)
+        self.assertTrue(cached.validated)
+        # connexion makes keys strings, as JSON does
+        self.assertEqual(cached.spec, json.loads(json.dumps(CachedSpec().spec)))
+        with cached.trusted():
+            Specification.load({'openapi': '3.0.0', 'paths': 'not a spec'})
+
+    def test_stale_cache(self):
+        """
+        A cache of different YAML is ignored, and replaced
+        """
+        with open(self.cache_path, 'w', encoding='utf-8') as cache_file:
+            cache_file.write('{"key": "other", "spec": {}}')
+        spec = CachedSpec(cache_path=self.cache_path)
+        self.assertFalse(spec.validated)
+        spec.save()
+        self.assertTrue(CachedSpec(cache_path=self.cache_path).validated)
+
+
+if __name__ == '__main__':
+    unittest.main()
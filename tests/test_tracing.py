@@ -0,0 +1,70 @@
+"""
+Unit tests for request tracing
+"""
+import json
+import logging
+import os
+import tempfile
+import unittest
+from service_registry import tracing
+from service_registry.api.fanout import fan_out
+
+
+def threaded(_item):
+    """Work done in a fan-out thread"""
+    with tracing.span('threaded'):
+        pass
+
+
+class TracingTests(unittest.TestCase):
+    """Unit tests for spans and their propagation"""
+    def setUp(self):
+        self.scratch = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.scratch.name, 'trace.jsonl')
+        tracing.configure(self.path)
+
+    def tearDown(self):
+        tracing._ENABLED = False  # pylint: disable=protected-access
+        export_log = logging.getLogger('service_registry.tracing')
+        for handler in list(export_log.handlers):
+            export_log.removeHandler(handler)
+            handler.close()
+        self.scratch.cleanup()
+
+    def spans(self):
+        """The spans written so far, by name"""
+        for handler in logging.getLogger('service_registry.tracing').handlers:
+            handler.close()
+        with open(self.path) as trace_file:
+            return {span['name']: span for span in map(json.loads, trace_file)}
+
+    def test_children_and_propagation(self):
+        """
+        Spans nest, continue an incoming trace, and are passed on to threads and services
+        """
+        traceparent = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+        with tracing.span('request', traceparent, root=True) as request_span:
+            with tracing.span('query') as query_span:
+                pass
+            outgoing = tracing.headers()
+            fan_out(tracing.propagate(threaded), [None], max_workers=1)
+        self.assertIsNone(tracing.current())
+        self.assertIsNone(tracing.headers())
+
+        spans = self.spans()
+        self.assertEqual({span['traceId'] for span in spans.values()}, {'0af7651916cd43dd8448eb211c80319c'})
+        self.assertEqual(spans['request']['parentSpanId'], 'b7ad6b7169203331')
+        self.assertEqual(spans['query']['parentSpanId'], request_span.span_id)
+        self.assertEqual(spans['query']['spanId'], query_span.span_id)
+        self.assertEqual(spans['threaded']['parentSpanId'], request_span.span_id)
+        self.assertEqual(outgoing, {'traceparent': request_span.traceparent()})
+
+    def test_unsampled(self):
+        """
+        No spans are made for unsampled incoming traces, or without a parent
+        """
+        with tracing.span('request', '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-00', root=True) as span:
+            self.assertIsNone(span)
+            with tracing.span('query') as child:
+                self.assertIsNone(child)
+        self.assertEqual(self.spans(), {})
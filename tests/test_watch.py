@@ -0,0 +1,97 @@
+"""
+Unit tests for the stream of changes to the registry
+"""
+import datetime
+import unittest
+import uuid
+from tornado.options import define, options
+import service_registry.orm
+from service_registry.api import poller, watch
+from service_registry.api.models import Service
+from service_registry.api.operations import Probe, URLRef, query_urls, record_service_infos, seed_snapshot, \
+    snapshot_changes, update_snapshot
+from service_registry.api.poller import SharedSnapshot, SnapshotEntry
+from service_registry.orm.models import URL
+
+if 'remove_active_status' not in options:
+    define('remove_active_status', False)
+
+
+def service(version):
+    """A fake service at version"""
+    return Service(id='beacon', name='beacon', version=version,
+                   type={'group': 'org.ga4gh', 'artifact': 'beacon', 'version': '1.0.0'},
+                   organization={'name': 'Org', 'url': 'https://org.example'})
+
+
+class WatchTests(unittest.TestCase):
+    """Unit tests for ChangeFeed and the changes published"""
+    def setUp(self):
+        service_registry.orm.init_db('sqlite://')
+        watch.FEED = watch.ChangeFeed()
+
+    def test_snapshot_changes(self):
+        """
+        Additions, active status flips and metadata changes are detected
+        """
+        checked = datetime.datetime(2021, 1, 1)
+        refs = [URLRef(uuid.uuid4(), name, 'http://' + name) for name in ('new', 'down', 'upgraded', 'same')]
+        old = {'http://down': SnapshotEntry(service('1'), True, checked),
+               'http://upgraded': SnapshotEntry(service('1'), True, checked),
+               'http://same': SnapshotEntry(service('1'), True, checked)}
+        new = [SnapshotEntry(None, False, checked), SnapshotEntry(service('1'), False, checked),
+               SnapshotEntry(service('2'), True, checked), SnapshotEntry(service('1'), True, checked)]
+
+        changes = snapshot_changes(refs, old, new)
+        self.assertEqual([(change['kind'], change['url']) for change in changes],
+                         [('added', 'http://new'), ('inactive', 'http://down'), ('changed', 'http://upgraded')])
+        self.assertEqual(changes[0]['data'], {'id': str(refs[0].id), 'name': 'new', 'url': 'http://new',
+                                              'active': False})
+        self.assertEqual(changes[2]['data']['version'], '2')
+
+    def poll(self):
+        """Poll the registered URL, which gives the same minimal service-info each time, into the snapshot"""
+        db_session = service_registry.orm.get_session()
+        url_orms = query_urls(db_session).all()
+        info = {'id': 'beacon', 'name': 'beacon', 'version': '1.0', 'cohorts': [{'id': 'c1'}],
+                'type': {'group': 'org.ga4gh', 'artifact': 'beacon', 'version': '1.0.0'},
+                'organization': {'name': 'Org', 'url': 'https://org.example'}}
+        (service, active), = record_service_infos(url_orms, [Probe(info, 200, 0.1)])
+        update_snapshot(url_orms, [SnapshotEntry(service, active, datetime.datetime.utcnow())])
+        return [kind for _, kind, _ in watch.FEED.since(0)]
+
+    def test_unchanged_polls(self):
+        """
+        Polls finding a service as it was publish no changes, with a shared
+        snapshot, or after a restart has seeded the snapshot from the database
+        """
+        db_session = service_registry.orm.get_session()
+        db_session.add(URL(id=uuid.uuid4(), name='beacon', url='http://beacon'))
+        db_session.commit()
+        try:
+            poller.SNAPSHOT = SharedSnapshot()
+            for _ in range(3):
+                kinds = self.poll()
+            self.assertEqual(kinds, ['added'])
+
+            poller.SNAPSHOT = poller.Snapshot()
+            seed_snapshot()
+            self.assertEqual(self.poll(), ['added'])
+        finally:
+            poller.SNAPSHOT = poller.Snapshot()
+
+    def test_resume(self):
+        """
+        Watchers resume after the last change they saw, or are reset once it's pruned
+        """
+        self.assertEqual(watch.catch_up(None), 'retry: 2000\n\nid: 0\nevent: ready\ndata: {"seq": 0}\n\n')
+        watch.FEED.publish([{'kind': 'removed', 'url': url, 'data': {'url': url}} for url in ('http://a', 'http://b')])
+        self.assertEqual(watch.FEED.since(1), [(2, 'removed', '{"url":"http://b"}')])
+        self.assertEqual(watch.FEED.since(2), [])
+        self.assertIn('event: removed', watch.catch_up(0))
+
+        watch.FEED.prune(datetime.datetime.utcnow() + datetime.timedelta(seconds=1))
+        self.assertTrue(watch.FEED.resumable(1))
+        self.assertFalse(watch.FEED.resumable(0))
+        self.assertFalse(watch.FEED.resumable(3))
+        self.assertIn('event: reset', watch.catch_up(watch.last_event_id(None, '0')))